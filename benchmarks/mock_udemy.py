@@ -0,0 +1,305 @@
+import re
+import json
+import time
+import random
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# The lecture kinds a mock course can be built from. "hls-aes" playlists are
+# encrypted, so they go through n_m3u8dl-re instead of the in-process fetcher
+LECTURE_KINDS = ("mp4", "hls", "hls-ts", "hls-aes", "dash", "article", "quiz")
+
+# Segment size for the HLS payloads, and the MPEG-TS packet size they are cut into
+SEGMENT_SIZE = 256 * 1024
+TS_PACKET_SIZE = 188
+
+# A bare ftyp box, enough for the payloads to look like MP4 files
+FTYP_BOX = b"\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2"
+
+def synthetic_mp4(size, seed=0):
+    body = random.Random(seed).randbytes(max(0, size - len(FTYP_BOX)))
+    return (FTYP_BOX + body)[:size]
+
+def synthetic_ts(size, seed=0):
+    packets = max(1, size // TS_PACKET_SIZE)
+    payload = random.Random(seed).randbytes(TS_PACKET_SIZE - 1)
+    return (b"\x47" + payload) * packets
+
+class MockUdemy:
+    """
+    Local stand-in for the Udemy API and CDN, serving the shapes of the URLs in constants.py.
+
+    The course is `chapters` chapters of `lectures_per_chapter` items each. Item
+    kinds cycle through `mix` (see LECTURE_KINDS). Video lectures carry a caption.
+    The first lecture of each chapter carries a workbook shared by the whole
+    course, one of its own and an external link. Every response waits `latency`
+    seconds first. `error_rate` of the responses are HTTP 502, `throttle_rate`
+    are HTTP 429, and `drop_rate` of the media downloads are cut off halfway.
+    """
+    def __init__(self, chapters=4, lectures_per_chapter=10, mix=("mp4",), media_size=4 * 1024 * 1024,
+                 latency=0.0, page_size=200, quiz_questions=50, error_rate=0.0, throttle_rate=0.0, drop_rate=0.0, seed=0):
+        self.chapters = chapters
+        self.lectures_per_chapter = lectures_per_chapter
+        self.mix = tuple(mix)
+        self.media_size = media_size
+        self.latency = latency
+        self.page_size = page_size
+        self.quiz_questions = quiz_questions
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.drop_rate = drop_rate
+
+        for kind in self.mix:
+            if kind not in LECTURE_KINDS:
+                raise ValueError(f"Unknown lecture kind {kind!r}, expected one of {', '.join(LECTURE_KINDS)}")
+
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.hits = Counter()
+        self.hits_lock = threading.Lock()
+
+        self.mp4 = synthetic_mp4(media_size, seed)
+        self.segment = synthetic_mp4(SEGMENT_SIZE, seed + 1)
+        self.ts_segment = synthetic_ts(SEGMENT_SIZE, seed + 2)
+        self.segments = max(1, media_size // SEGMENT_SIZE)
+        self.curriculum, self.lectures = self.build_curriculum()
+
+        self.server = None
+        self.base_url = None
+
+    def build_curriculum(self):
+        items = []
+        lectures = {}
+        item_id = 1000
+        for chapter in range(1, self.chapters + 1):
+            items.append({'_class': 'chapter', 'id': chapter, 'title': f"Chapter {chapter}", 'is_published': True, 'sort_order': chapter})
+            for position in range(self.lectures_per_chapter):
+                item_id += 1
+                kind = self.mix[(chapter * self.lectures_per_chapter + position) % len(self.mix)]
+                if kind == "quiz":
+                    items.append({'_class': 'quiz', 'id': item_id, 'title': f"Quiz {item_id}", 'type': 'quiz', 'is_published': True})
+                    continue
+
+                assets = []
+                if position == 0:
+                    assets = [
+                        {'id': 1, 'asset_type': 'File', 'filename': 'course-workbook.pdf'},
+                        {'id': item_id * 10 + 1, 'asset_type': 'File', 'filename': f"exercise-{item_id}.zip"},
+                        {'id': item_id * 10 + 2, 'asset_type': 'ExternalLink', 'filename': f"Reading {item_id}"},
+                    ]
+                asset_type = 'Article' if kind == "article" else 'Video'
+                items.append({
+                    '_class': 'lecture', 'id': item_id, 'title': f"Lecture {item_id}", 'is_published': True,
+                    'asset': {'id': item_id, 'asset_type': asset_type, 'time_estimation': 120},
+                    'supplementary_assets': assets,
+                })
+                lectures[item_id] = kind
+        return items, lectures
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="mock-udemy").start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def roll(self, rate):
+        if not rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < rate
+
+    def count(self, endpoint):
+        with self.hits_lock:
+            self.hits[endpoint] += 1
+
+    def item_count(self):
+        """How many downloadable items the course has, chapters excluded."""
+        return sum(1 for item in self.curriculum if item['_class'] != 'chapter')
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type="application/octet-stream", status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, obj, status=200):
+        self.send_body(json.dumps(obj).encode(), "application/json", status)
+
+    def do_GET(self):
+        mock = self.server.mock
+        if mock.latency:
+            time.sleep(mock.latency)
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path
+        base = mock.base_url
+
+        if mock.roll(mock.throttle_rate):
+            mock.count("throttled")
+            return self.send_body(b"", status=429, headers={"Retry-After": "0"})
+        if mock.roll(mock.error_rate):
+            mock.count("error")
+            return self.send_json({'detail': "Bad gateway"}, 502)
+
+        if match := re.search(r"/courses/(\d+)/subscriber-curriculum-items/$", path):
+            mock.count("curriculum")
+            size = min(int(query.get('page_size', ['200'])[0]), mock.page_size)
+            page = int(query.get('page', ['1'])[0])
+            results = mock.curriculum[(page - 1) * size:page * size]
+            next_url = f"{base}{path}?page_size={size}&page={page + 1}" if page * size < len(mock.curriculum) else None
+            return self.send_json({'count': len(mock.curriculum), 'next': next_url, 'previous': None, 'results': results})
+
+        if match := re.search(r"/courses/(\d+)/$", path):
+            mock.count("course")
+            return self.send_json({'id': int(match.group(1)), 'title': f"Benchmark Course {match.group(1)}"})
+
+        if match := re.search(r"/lectures/(\d+)/supplementary-assets/(\d+)/$", path):
+            mock.count("asset")
+            asset_id = match.group(2)
+            return self.send_json({'id': int(asset_id), 'external_url': f"https://example.com/reading/{asset_id}",
+                                   'download_urls': {'File': [{'label': 'download', 'file': f"{base}/media/asset-{asset_id}.bin"}]}})
+
+        if match := re.search(r"/lectures/(\d+)$", path):
+            mock.count("lecture")
+            return self.send_lecture(int(match.group(1)))
+
+        if match := re.search(r"/assets/(\d+)/$", path):
+            mock.count("article")
+            article_id = match.group(1)
+            body = (f"<h2>Article {article_id}</h2><link rel=\"stylesheet\" href=\"{base}/media/article.css\">"
+                    f"<img src=\"{base}/media/figure-{article_id}.png\"><img src=\"{base}/media/logo.png\"><p>{'Lorem ipsum. ' * 200}</p>")
+            return self.send_json({'id': int(article_id), 'asset_type': 'Article', 'body': body})
+
+        if match := re.search(r"/quizzes/(\d+)/assessments/$", path):
+            mock.count("quiz")
+            return self.send_quiz_page(int(query.get('page', ['1'])[0]), int(query.get('page_size', ['200'])[0]))
+
+        if match := re.search(r"/hls/(\d+)/master\.m3u8$", path):
+            mock.count("playlist")
+            lecture_id = match.group(1)
+            body = ("#EXTM3U\n"
+                    "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\nlow.m3u8\n"
+                    "#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1280x720\nhigh.m3u8\n")
+            return self.send_body(body.encode(), "application/x-mpegURL")
+
+        if match := re.search(r"/hls/(\d+)/(low|high)\.m3u8$", path):
+            mock.count("playlist")
+            ts = mock.lectures.get(int(match.group(1))) == "hls-ts"
+            extension = "ts" if ts else "m4s"
+            lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:4", "#EXT-X-PLAYLIST-TYPE:VOD"]
+            if not ts:
+                lines.append('#EXT-X-MAP:URI="init.mp4"')
+            if mock.lectures.get(int(match.group(1))) == "hls-aes":
+                lines.append('#EXT-X-KEY:METHOD=AES-128,URI="key.bin"')
+            for index in range(mock.segments):
+                lines += ["#EXTINF:4.0,", f"seg{index}.{extension}"]
+            lines.append("#EXT-X-ENDLIST")
+            return self.send_body(("\n".join(lines) + "\n").encode(), "application/x-mpegURL")
+
+        if path.startswith("/hls/"):
+            mock.count("segment")
+            if path.endswith("init.mp4"):
+                return self.send_body(FTYP_BOX, "video/mp4")
+            return self.send_body(mock.ts_segment if path.endswith(".ts") else mock.segment, "video/mp4")
+
+        if match := re.search(r"/dash/(\d+)/manifest\.mpd$", path):
+            mock.count("manifest")
+            return self.send_body(self.mpd(match.group(1)).encode(), "application/dash+xml")
+
+        if path.endswith(".vtt"):
+            mock.count("caption")
+            cues = "".join(f"{index // 60:02}:{index % 60:02}.000 --> {index // 60:02}:{index % 60:02}.900\nLine {index}\n\n" for index in range(120))
+            return self.send_body(f"WEBVTT\n\n{cues}".encode(), "text/vtt")
+
+        if path.startswith("/media/"):
+            mock.count("media")
+            return self.send_media()
+
+        mock.count("not_found")
+        self.send_json({'detail': "Not found."}, 404)
+
+    def send_lecture(self, lecture_id):
+        mock = self.server.mock
+        kind = mock.lectures.get(lecture_id)
+        if kind is None:
+            return self.send_json({'detail': "Not found."}, 404)
+        base = mock.base_url
+
+        if kind == "article":
+            return self.send_json({'id': lecture_id, 'asset': {'id': lecture_id, 'asset_type': 'Article', 'captions': [], 'media_sources': []}})
+
+        sources = {
+            "mp4": [{'type': 'video/mp4', 'src': f"{base}/media/lecture-{lecture_id}.mp4", 'label': '720'}],
+            "hls": [{'type': 'application/x-mpegURL', 'src': f"{base}/hls/{lecture_id}/master.m3u8"}],
+            "hls-ts": [{'type': 'application/x-mpegURL', 'src': f"{base}/hls/{lecture_id}/master.m3u8"}],
+            "hls-aes": [{'type': 'application/x-mpegURL', 'src': f"{base}/hls/{lecture_id}/master.m3u8"}],
+            "dash": [{'type': 'application/dash+xml', 'src': f"{base}/dash/{lecture_id}/manifest.mpd"}],
+        }[kind]
+        captions = [{'locale_id': 'en_US', 'video_label': 'English', 'file_name': f"lecture-{lecture_id}.vtt", 'url': f"{base}/captions/{lecture_id}.vtt"}]
+        return self.send_json({'id': lecture_id, 'asset': {'id': lecture_id, 'asset_type': 'Video', 'captions': captions, 'media_sources': sources}})
+
+    def send_quiz_page(self, page, page_size):
+        mock = self.server.mock
+        total = mock.quiz_questions
+        first = (page - 1) * page_size
+        results = [{
+            'id': number, 'assessment_type': 'multiple-choice',
+            'prompt': {'question': f"<p>Question {number}?</p>", 'answers': ["<p>A</p>", "<p>B</p>", "<p>C</p>"], 'feedbacks': ["", "", ""]},
+            'correct_response': ['a'], 'section': '', 'question_plain': f"Question {number}?", 'related_lectures': [],
+        } for number in range(first + 1, min(total, first + page_size) + 1)]
+        next_url = "next" if first + page_size < total else None
+        return self.send_json({'count': total, 'next': next_url, 'previous': None, 'results': results})
+
+    def mpd(self, lecture_id):
+        return (
+            '<?xml version="1.0"?>\n'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT2M" minBufferTime="PT2S">\n'
+            '  <Period>\n'
+            f'    <AdaptationSet mimeType="video/mp4"><Representation id="v{lecture_id}" bandwidth="5000000" width="1280" height="720"/></AdaptationSet>\n'
+            f'    <AdaptationSet mimeType="audio/mp4"><Representation id="a{lecture_id}" bandwidth="128000"/></AdaptationSet>\n'
+            '  </Period>\n'
+            '</MPD>\n'
+        )
+
+    def send_media(self):
+        mock = self.server.mock
+        data = mock.mp4
+        start = 0
+        byte_range = self.headers.get("Range")
+        if byte_range and (match := re.match(r"bytes=(\d+)-", byte_range)):
+            start = min(int(match.group(1)), len(data))
+
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data) - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"mock-media"')
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+
+        if len(data) - start > 1 and mock.roll(mock.drop_rate):
+            # Cut the transfer off halfway, so the client has to resume it
+            mock.count("dropped")
+            self.wfile.write(data[start:start + (len(data) - start) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:])
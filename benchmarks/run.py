@@ -0,0 +1,230 @@
+"""
+Offline benchmarks for the course downloader.
+
+Every scenario serves a synthetic course from a local MockUdemy server.
+ffmpeg and n_m3u8dl-re are replaced by the shims in benchmarks/shims. The
+scenario is then downloaded by main.py at each concurrency level. Each run
+happens in a fresh child process and a fresh working directory, so no cache,
+journal or global state leaks between runs. The child reports items/sec,
+bytes/sec, peak RSS and the peak number of threads.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --scenario mixed --concurrency 1,8,16 --json results.json
+    python benchmarks/run.py --baseline results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+SHIM_DIR = os.path.join(BENCHMARK_DIR, "shims")
+
+# The API and CDN hosts in constants.py that get pointed at the mock server
+UDEMY_HOST = "https://{portal_name}.udemy.com"
+URL_NAMES = ("COURSE_URL", "CURRICULUM_URL", "LECTURE_URL", "QUIZ_URL", "LINK_ASSET_URL", "FILE_ASSET_URL", "ARTICLE_URL")
+
+# How often the child samples its thread count
+THREAD_SAMPLE_INTERVAL = 0.005
+
+DEFAULT_CONCURRENCY = (1, 4, 8, 16)
+
+SCENARIOS = {
+    # Large progressive MP4s: transfer bound
+    "mp4": {'mock': {'chapters': 4, 'lectures_per_chapter': 10, 'mix': ("mp4",), 'media_size': 8 * 1024 * 1024}},
+    # In-process HLS, fMP4 and MPEG-TS (remuxed by the ffmpeg shim)
+    "hls": {'mock': {'chapters': 4, 'lectures_per_chapter': 8, 'mix': ("hls", "hls-ts"), 'media_size': 4 * 1024 * 1024}},
+    # Everything at once, with child processes doing simulated work
+    "mixed": {
+        'mock': {'chapters': 6, 'lectures_per_chapter': 12, 'mix': ("mp4", "hls", "article", "dash", "hls-ts", "quiz", "hls-aes"), 'media_size': 2 * 1024 * 1024, 'latency': 0.01},
+        'env': {'BENCH_TOOL_DELAY': "0.3", 'BENCH_TOOL_OUTPUT_SIZE': str(2 * 1024 * 1024)},
+    },
+    # Small items behind a slow API, with a paginated curriculum: metadata bound
+    "api-latency": {'mock': {'chapters': 10, 'lectures_per_chapter': 20, 'mix': ("mp4", "article", "quiz"), 'media_size': 64 * 1024, 'latency': 0.1, 'page_size': 50}},
+    # Server errors, throttling and dropped transfers that have to be retried and resumed
+    "flaky": {'mock': {'chapters': 4, 'lectures_per_chapter': 10, 'mix': ("mp4", "hls", "article"), 'media_size': 2 * 1024 * 1024, 'latency': 0.005,
+                       'error_rate': 0.02, 'throttle_rate': 0.01, 'drop_rate': 0.1}},
+}
+
+def run_child(args):
+    """Download the mock course in this process and write the measurements to args.result."""
+    sys.path.insert(0, REPO_DIR)
+
+    # Everything in constants.py has to be redirected before the other modules copy it
+    import constants
+    for name in URL_NAMES:
+        setattr(constants, name, getattr(constants, name).replace(UDEMY_HOST, f"{args.base_url}/{{portal_name}}"))
+
+    import resource
+    import main
+
+    peak_threads = threading.active_count()
+    stopped = threading.Event()
+
+    def sample_threads():
+        nonlocal peak_threads
+        while not stopped.wait(THREAD_SAMPLE_INTERVAL):
+            peak_threads = max(peak_threads, threading.active_count())
+
+    threading.Thread(target=sample_threads, daemon=True).start()
+
+    status_file = os.path.abspath("status.jsonl")
+    sys.argv = ["main.py", "--id", "1", "--bearer", "benchmark", "--concurrent", str(args.concurrency), "--no-tui", status_file, *args.extra]
+
+    start_time = time.monotonic()
+    main.main()
+    elapsed = time.monotonic() - start_time
+    stopped.set()
+
+    final = {}
+    with open(status_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('event') == 'finished':
+                final = record
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    with open(args.result, 'w', encoding='utf-8') as f:
+        json.dump({
+            'elapsed': elapsed,
+            'items': final.get('items_done', 0),
+            'failed': final.get('items_failed', 0),
+            'bytes': final.get('bytes', 0),
+            'items_per_sec': final.get('items_done', 0) / elapsed,
+            'bytes_per_sec': final.get('bytes', 0) / elapsed,
+            'peak_rss': peak_rss,
+            'peak_threads': peak_threads,
+        }, f)
+
+def run_scenario(name, scenario, concurrency, extra, keep):
+    """Serve the scenario's course and download it in a child process. Returns the child's measurements."""
+    from mock_udemy import MockUdemy
+
+    mock = MockUdemy(**scenario['mock'])
+    base_url = mock.start()
+    work_dir = tempfile.mkdtemp(prefix=f"udemy-bench-{name}-{concurrency}-")
+    result_file = os.path.join(work_dir, "result.json")
+
+    env = dict(os.environ, **scenario.get('env', {}))
+    env['PATH'] = SHIM_DIR + os.pathsep + env.get('PATH', "")
+    env['PYTHONDONTWRITEBYTECODE'] = "1"
+
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--base-url", base_url,
+               "--concurrency", str(concurrency), "--result", result_file, "--", *scenario.get('args', ()), *extra]
+    try:
+        with open(os.path.join(work_dir, "output.log"), 'w', encoding='utf-8') as log:
+            child = subprocess.run(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if child.returncode != 0 or not os.path.isfile(result_file):
+            with open(os.path.join(work_dir, "output.log"), 'r', encoding='utf-8') as log:
+                tail = log.read()[-2000:]
+            raise RuntimeError(f"{name} at concurrency {concurrency} exited with {child.returncode}:\n{tail}")
+
+        with open(result_file, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    finally:
+        mock.stop()
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    result.update({'scenario': name, 'concurrency': concurrency, 'expected_items': mock.item_count(), 'requests': dict(mock.hits)})
+    if keep:
+        result['work_dir'] = work_dir
+    return result
+
+def print_results(results, baseline=None):
+    from rich.console import Console
+    from rich.table import Table
+    from utils.progress import format_bytes
+
+    table = Table(title="Benchmark results")
+    for column in ("Scenario", "Concurrency", "Items", "Failed", "Time", "Items/s", "Bytes/s", "Peak RSS", "Threads"):
+        table.add_column(column, justify="left" if column == "Scenario" else "right")
+    if baseline is not None:
+        table.add_column("vs baseline", justify="right")
+
+    for result in results:
+        row = [
+            result['scenario'], str(result['concurrency']), f"{result['items']}/{result['expected_items']}", str(result['failed']),
+            f"{result['elapsed']:.2f}s", f"{result['items_per_sec']:.1f}", f"{format_bytes(result['bytes_per_sec'])}/s",
+            format_bytes(result['peak_rss']), str(result['peak_threads']),
+        ]
+        if baseline is not None:
+            previous = baseline.get((result['scenario'], result['concurrency']))
+            row.append(f"{result['items_per_sec'] / previous['items_per_sec'] - 1:+.0%}" if previous and previous['items_per_sec'] else "-")
+        table.add_row(*row)
+
+    Console().print(table)
+
+def load_baseline(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return {(result['scenario'], result['concurrency']): result for result in json.load(f)}
+
+def find_regressions(results, baseline, tolerance):
+    """Runs whose items/sec fell more than `tolerance` below the baseline, or that finished fewer items."""
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['scenario'], result['concurrency']))
+        if previous is None:
+            continue
+        if result['items_per_sec'] < previous['items_per_sec'] * (1 - tolerance) or result['items'] < previous['items']:
+            regressions.append(result)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a local mock of the Udemy API")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run, may be given more than once (default: all)")
+    parser.add_argument("--concurrency", type=str, default=",".join(map(str, DEFAULT_CONCURRENCY)), help="Comma separated --concurrent values to run each scenario at")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against the results of an earlier --json run and exit with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed items/sec slowdown against the baseline (default: 0.15)")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directories of the runs")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("extra", nargs="*", help="Extra arguments for main.py, after a '--'")
+    args = parser.parse_args()
+
+    if args.child:
+        args.concurrency = int(args.concurrency)
+        run_child(args)
+        return 0
+
+    sys.path.insert(0, REPO_DIR)
+    try:
+        levels = [int(level) for level in args.concurrency.split(",")]
+    except ValueError:
+        parser.error("--concurrency expects comma separated numbers")
+
+    results = []
+    for name in args.scenario or SCENARIOS:
+        for concurrency in levels:
+            print(f"Running {name} at concurrency {concurrency}", file=sys.stderr)
+            results.append(run_scenario(name, SCENARIOS[name], concurrency, args.extra, args.keep))
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for result in regressions:
+            print(f"Regression: {result['scenario']} at concurrency {result['concurrency']}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,10 +11,6 @@ from shutil import get_terminal_size
 from threading import Thread
 from rich.progress import TextColumn
 
-# Force UTF-8 for stdout and stderr
-sys.stdout.reconfigure(encoding='utf-8')
-sys.stderr.reconfigure(encoding='utf-8')
-
 # Update URLs to be dynamic based on the subdomain
 COURSE_URL = "https://{portal_name}.udemy.com/api-2.0/courses/{course_id}/"
 CURRICULUM_URL = "https://{portal_name}.udemy.com/api-2.0/courses/{course_id}/subscriber-curriculum-items/?page_size=200&fields[lecture]=title,object_index,is_published,sort_order,created,asset,supplementary_assets,is_free&fields[quiz]=title,object_index,is_published,sort_order,type&fields[practice]=title,object_index,is_published,sort_order&fields[chapter]=title,object_index,is_published,sort_order&fields[asset]=title,filename,asset_type,status,time_estimation,is_external&caching_intent=True"
@@ -24,16 +20,26 @@ LINK_ASSET_URL = "https://{portal_name}.udemy.com/api-2.0/users/me/subscribed-co
 FILE_ASSET_URL = "https://{portal_name}.udemy.com/api-2.0/users/me/subscribed-courses/{course_id}/lectures/{lecture_id}/supplementary-assets/{asset_id}/?fields[asset]=download_urls"
 ARTICLE_URL = "https://{portal_name}.udemy.com/api-2.0/assets/{article_id}/?fields[asset]=@min,status,delayed_asset_message,processing_errors,body"
 
+# Upper bound for --concurrent, adaptive concurrency never grows past it either
+MAX_CONCURRENT_LECTURES = 25
+
+# Lecture info is resolved by its own workers ahead of the downloads. The lane starts
+# as wide as --concurrent (at least METADATA_CONCURRENCY) and may grow up to MAX_METADATA_CONCURRENCY
+METADATA_CONCURRENCY = 4
+MAX_METADATA_CONCURRENCY = 32
+PREFETCH_DEPTH_FACTOR = 2
+
 HOME_DIR = os.getcwd()
 DOWNLOAD_DIR = os.path.join(HOME_DIR, "courses")
+CACHE_DIR = os.path.join(HOME_DIR, ".cache")
+STORE_DIR = os.path.join(HOME_DIR, "store")
+
+# Cached curricula older than this are fetched again
+CURRICULUM_CACHE_TTL = 24 * 60 * 60
 
 LOG_DIR = os.path.join(HOME_DIR, "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE_PATH = os.path.join(LOG_DIR, f"{time.strftime('%Y-%m-%d')}.log")
 
-# Make sure logs directory exists
-os.makedirs(LOG_DIR, exist_ok=True)
-
 # Configure logger
 logger = logging.getLogger('udemy-dl')
 logger.setLevel(logging.INFO)
@@ -43,14 +49,22 @@ console_handler = logging.StreamHandler(sys.stdout)  # Explicitly use stdout
 console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s : %(message)s'))
 
-# Create file handler with UTF-8 encoding
-file_handler = logging.FileHandler(LOG_FILE_PATH, encoding='utf-8')
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s : %(message)s'))
-
 # Add handlers to logger
 logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+
+def setup_logging():
+    """Force UTF-8 output and start logging to the daily log file. Left to main() so importing this module changes no process state."""
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    # Create file handler with UTF-8 encoding
+    file_handler = logging.FileHandler(LOG_FILE_PATH, encoding='utf-8')
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s : %(message)s'))
+    logger.addHandler(file_handler)
+    return file_handler
 
 class LogFormatter(logging.Formatter):
     RESET = "\x1b[0m"
@@ -80,15 +94,18 @@ class LoadAction(argparse.Action):
 
 # Source: https://stackoverflow.com/questions/22029562/python-how-to-make-simple-animated-loading-while-process-is-running
 class Loader:
-    def __init__(self, desc="Processing", timeout=0.1):
+    def __init__(self, desc="Processing", timeout=0.1, disable=False):
         self.desc = desc
         self.timeout = timeout
+        # Like rich's Progress(disable=...), for when stdout is not a terminal for people
+        self.disable = disable
         self._thread = Thread(target=self._animate, daemon=True)
         self.steps = ["⢿", "⣻", "⣽", "⣾", "⣷", "⣯", "⣟", "⡿"]
         self.done = False
 
     def start(self):
-        self._thread.start()
+        if not self.disable:
+            self._thread.start()
         return self
 
     def _animate(self):
@@ -104,6 +121,8 @@ class Loader:
 
     def stop(self):
         self.done = True
+        if self.disable:
+            return
         # Clear the spinner line
         cols = shutil.get_terminal_size(fallback=(80, 20)).columns
         print("\r" + " " * cols, end="", flush=True)
@@ -1,30 +1,41 @@
 import json
 import os
 import sys
-import requests
+import logging
 import argparse
-import subprocess
 from pathvalidate import sanitize_filename
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
-from rich.live import Live
-from rich.tree import Tree
-from rich.text import Text
-from rich import print as rprint
 
 import re
-import http.cookiejar as cookielib
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import shutil
+import hashlib
+import threading
+from collections import deque, Counter
+from concurrent.futures import Future
 
 from constants import *
-from utils.process_m3u8 import download_and_merge_m3u8
-from utils.process_mpd import download_and_merge_mpd
-from utils.process_captions import download_captions
-from utils.process_assets import download_supplementary_assets
-from utils.process_articles import download_article
+from utils.process_captions import select_captions, download_caption
+from utils.process_assets import AssetIndex, process_files, process_external_links
+from utils.process_articles import MediaCache, download_article
 from utils.process_mp4 import download_mp4
-from utils.process_quizzes import download_quiz
+from utils.session import init_session, fetch, fetch_pages, check_response, TransientError, AuthError, NotFoundError, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES
+from utils.transfer import download_file
+from utils.scheduler import Scheduler, Handoff
+from utils.journal import DownloadJournal
+from utils.cache import read_cache, write_cache
+from utils.limiter import AdaptiveLimiter, transfer_meter, bandwidth, parse_rate_schedule
+from utils.supervisor import then
+from utils.progress import TerminalProgress, JsonLinesProgress, open_status_stream
+from utils.store import ContentStore, asset_key
+from utils.metrics import metrics, tagged
+from utils.trace import tracer
+
+# Course landing pages are read in chunks only until the og:image tag, which sits early in <head>
+LANDING_PAGE_CHUNK_SIZE = 16 * 1024
+LANDING_PAGE_OVERLAP = 2048
+OG_IMAGE_PATTERN = re.compile(rb'<meta\s+property="og:image"\s+content="([^"]+)"')
+COURSE_SLUG_PATTERN = re.compile(r'(?i)/course/([^/?#]+)')
 
 console = Console()
 
@@ -35,25 +46,33 @@ class Udemy:
             if bearer_token:
                 logger.info(f"Using provided bearer token for authentication")
             else:
+                import http.cookiejar as cookielib
                 cookie_jar = cookielib.MozillaCookieJar(cookie_path)
                 cookie_jar.load()
         except Exception as e:
             logger.critical(f"The provided cookie file could not be read or is incorrectly formatted. Please ensure the file is in the correct format and contains valid authentication cookies.")
             sys.exit(1)
+
+        # Auth is attached to the shared session once instead of on every request
+        init_session(
+            MAX_CONCURRENT_LECTURES if adaptive_concurrency else max_concurrent_lectures,
+            bearer_token=bearer_token,
+            cookie_jar=None if bearer_token else cookie_jar,
+            timeout=(CONNECT_TIMEOUT, request_timeout),
+            retries=request_retries
+        )
     
     def request(self, url):
         try:
-            if bearer_token:
-                headers = {
-                    'Authorization': f'Bearer {bearer_token}',
-                    'X-Udemy-Authorization': f'Bearer {bearer_token}'
-                }
-                response = requests.get(url, headers=headers, stream=True)
-            else:
-                response = requests.get(url, cookies=cookie_jar, stream=True)
-            return response
-        except Exception as e:
-            logger.critical(f"There was a problem reaching the Udemy server. This could be due to network issues, an invalid URL, or Udemy being temporarily unavailable.")
+            return fetch(url, stream=True)
+        except TransientError:
+            logger.error(f"There was a problem reaching the Udemy server. This could be due to network issues, an invalid URL, or Udemy being temporarily unavailable.")
+            raise
+
+    def request_json(self, url):
+        """Fetch an API endpoint, raising a classified RequestError if it fails"""
+        with metrics.timed("metadata"):
+            return check_response(self.request(url)).json()
 
     def extract_portal_name(self, url):
         """Extract the portal name from a Udemy URL."""
@@ -63,47 +82,103 @@ class Udemy:
         return "www"  # Default to www if not found
 
     def extract_course_id(self, course_url):
-        global portal_name
-        portal_name = self.extract_portal_name(course_url)
-        logger.info(f"Portal name detected: {portal_name}")
-
-        with Loader(f"Fetching course ID"):            
+        """Read the course landing page only up to its og:image tag, whose URL carries the course ID"""
+        # Spinner frames would end up in the JSON-lines status stream
+        with Loader(f"Fetching course ID", disable=status_output is not None):
             response = self.request(course_url)
-            content_str = response.content.decode('utf-8')
-
-        meta_match = re.search(r'<meta\s+property="og:image"\s+content="([^"]+)"', content_str)
+            meta_match = None
+            page = bytearray()
+            scanned = 0
+            try:
+                for chunk in response.iter_content(chunk_size=LANDING_PAGE_CHUNK_SIZE):
+                    page += chunk
+                    # Rescan a little of the previous chunk in case the tag was split between the two
+                    window_start = max(0, scanned - LANDING_PAGE_OVERLAP)
+                    meta_match = OG_IMAGE_PATTERN.search(page, window_start)
+                    if meta_match:
+                        break
+                    scanned = len(page)
+            finally:
+                response.close()
 
         if meta_match:
-            url = meta_match.group(1)
+            url = meta_match.group(1).decode('utf-8', errors='replace')
             number_match = re.search(r'/(\d+)_', url)
             if number_match:
                 number = number_match.group(1)
                 logger.info(f"Course ID Extracted: {number}")
                 return number
-            else:
-                logger.critical("Unable to retrieve a valid course ID from the provided course URL. Please check the course URL or try with --id.")
-                sys.exit(1)
-        else:
-            logger.critical("Unable to retrieve a valid course ID from the provided course URL. Please check the course URL or try with --id")
-            sys.exit(1)
+
+        raise ValueError("Unable to retrieve a valid course ID from the provided course URL. Please check the course URL or try with --id.")
+
+    def resolve_course_url(self, course_url, refresh=False):
+        """Return (course_id, portal_name) for a course URL, from the cache when it has been resolved before"""
+        portal_name = self.extract_portal_name(course_url)
+        cache_key = course_url_cache_key(course_url, portal_name)
+
+        cached = None if refresh else read_cache("course-ids", cache_key)
+        if cached is not None:
+            logger.info(f"Course ID {cached['course_id']} on portal {cached['portal_name']} (cached)")
+            return cached['course_id'], cached['portal_name']
+
+        logger.info(f"Portal name detected: {portal_name}")
+        course_id = self.extract_course_id(course_url)
+        # A course keeps its ID for good, so the entry never expires
+        write_cache("course-ids", cache_key, {'course_id': course_id, 'portal_name': portal_name})
+        return course_id, portal_name
         
-    def fetch_course(self, course_id):
+    def fetch_course(self, course_id, portal_name="www"):
         try:
             response = self.request(COURSE_URL.format(portal_name=portal_name, course_id=course_id)).json()
-    
-            if response.get('detail') == 'Not found.':
-                logger.critical("The course could not be found with the provided ID or URL. Please verify the course ID/URL and ensure that it is publicly accessible or you have the necessary permissions.")
-                sys.exit(1)
-            
-            return response
         except Exception as e:
-            logger.critical(f"Unable to retrieve the course details: {e}")
-            sys.exit(1)
+            raise RuntimeError(f"Unable to retrieve the course details: {e}") from e
+
+        if response.get('detail') == 'Not found.':
+            raise LookupError("The course could not be found with the provided ID or URL. Please verify the course ID/URL and ensure that it is publicly accessible or you have the necessary permissions.")
+
+        return response
+
+    def open_course(self, entry, refresh=False):
+        """
+        Resolve a course ID or URL into the context its items are downloaded with.
+
+        The context carries everything that differs between courses (portal, output
+        directory, journal, asset index), so several courses can share one scheduler.
+        """
+        if str(entry).isdigit():
+            course_id, portal_name = str(entry), "www"
+        else:
+            course_id, portal_name = self.resolve_course_url(entry, refresh)
+
+        course_info = self.fetch_course(course_id, portal_name)
+        course_dir = os.path.join(DOWNLOAD_DIR, remove_emojis_and_binary(sanitize_filename(course_info['title'])))
+        logger.info(f"Course Title: {course_info['title']}")
+        self.create_directory(course_dir)
+
+        return {
+            'id': course_id,
+            'portal_name': portal_name,
+            'title': course_info['title'],
+            'dir': course_dir,
+        }
     
-    def fetch_course_curriculum(self, course_id):
-        all_results = []
+    def fetch_curriculum_page(self, url):
+        response = self.request(url).json()
+
+        if response.get('detail') in ('You do not have permission to perform this action.', 'Not found.'):
+            raise PermissionError("The course was found, but the curriculum (lectures and materials) could not be retrieved. This could be due to API issues, restrictions on the course, or a malformed course structure.")
+
+        return response
+
+    def fetch_course_curriculum(self, course_id, portal_name="www", refresh=False):
+        cache_key = f"{portal_name}-{course_id}"
+        if not refresh:
+            cached = read_cache("curriculum", cache_key, max_age=CURRICULUM_CACHE_TTL)
+            if cached is not None:
+                logger.info("Using cached course curriculum. Pass --refresh to fetch it again")
+                return self.organize_curriculum(cached)
+
         url = CURRICULUM_URL.format(portal_name=portal_name, course_id=course_id)
-        total_count = 0
 
         logger.info("Fetching course curriculum. This may take a while")
 
@@ -112,32 +187,20 @@ class Udemy:
             TextColumn("[progress.description]{task.description}"),
             BarColumn(),
             TextColumn("[progress.percentage]{task.percentage:>3}%"),
-            transient=True
+            transient=True,
+            disable=status_output is not None
         ) as progress:
-            task = progress.add_task(description="Fetching Course Curriculum", total=total_count)
-
-            while url:
-                response = self.request(url).json()
-
-                if response.get('detail') == 'You do not have permission to perform this action.':
-                    progress.console.log("[red]The course was found, but the curriculum (lectures and materials) could not be retrieved. This could be due to API issues, restrictions on the course, or a malformed course structure.[/red]")
-                    sys.exit(1)
-
-                if response.get('detail') == 'Not found.':
-                    progress.console.log("[red]The course was found, but the curriculum (lectures and materials) could not be retrieved. This could be due to API issues, restrictions on the course, or a malformed course structure.[/red]")
-                    sys.exit(1)
-
-                if total_count == 0:
-                    total_count = response.get('count', 0)
-                    progress.update(task, total=total_count)
-
-                results = response.get('results', [])
-                all_results.extend(results)
-                progress.update(task, completed=len(all_results))
+            task = progress.add_task(description="Fetching Course Curriculum", total=None)
+            try:
+                all_results = fetch_pages(self.fetch_curriculum_page, url, max_metadata_jobs,
+                                          lambda count, fetched: progress.update(task, total=count, completed=fetched))
+            except PermissionError as e:
+                progress.console.log(f"[red]{e}[/red]")
+                raise
 
-                url = response.get('next')
+            progress.update(task_id = task, description="Fetched Course Curriculum")
 
-            progress.update(task_id = task, description="Fetched Course Curriculum", total=total_count)
+        write_cache("curriculum", cache_key, all_results)
         return self.organize_curriculum(all_results)
     
     def organize_curriculum(self, results):
@@ -175,6 +238,7 @@ class Udemy:
         return curriculum
 
     def build_curriculum_tree(self, data, tree, index=1):
+        from rich.text import Text
         for i, item in enumerate(data, start=index):
             if 'title' in item:
                 title = f"{i:02d}. {item['title']}"
@@ -192,19 +256,30 @@ class Udemy:
                 if 'children' in item:
                     self.build_curriculum_tree(item['children'], node, index=1)
 
-    def fetch_lecture_info(self, course_id, lecture_id):
-        try:
-            return self.request(LECTURE_URL.format(portal_name=portal_name, course_id=course_id, lecture_id=lecture_id)).json()
-        except Exception as e:
-            logger.critical(f"Failed to fetch lecture info: {e}")
-            sys.exit(1)
+    def fetch_lecture_info(self, course, lecture_id):
+        # Runs on the prefetch workers, so failures are raised and reported per lecture instead of exiting
+        with tagged("Lecture"), tracer.span("fetch_lecture_info", "metadata", lecture=lecture_id):
+            return self.request_json(LECTURE_URL.format(portal_name=course['portal_name'], course_id=course['id'], lecture_id=lecture_id))
     
-    def fetch_quiz_info(self, course_id, quiz_id):
-        try:
-            return self.request(QUIZ_URL.format(portal_name=portal_name, quiz_id=quiz_id)).json()
-        except Exception as e:
-            logger.critical(f"Failed to fetch quiz info: {e}")
-            sys.exit(1)
+    def fetch_quiz_info(self, course, quiz_id):
+        return self.request_json(QUIZ_URL.format(portal_name=course['portal_name'], quiz_id=quiz_id))
+
+    def report_failure(self, item, error=None):
+        """Log a failed item and keep it for the end-of-run summary. Without an error, the item simply produced no output"""
+        if error is None:
+            kind = "error"
+            error = "no output was produced"
+        elif isinstance(error, AuthError):
+            kind = "access denied"
+        elif isinstance(error, NotFoundError):
+            kind = "not found"
+        elif isinstance(error, TransientError):
+            kind = "network"
+        else:
+            kind = "error"
+
+        self.failures.append((kind, item['lecture']['title']))
+        logger.error(f"Failed to download {item['lecture']['title']} ({kind}): {error}")
 
     def create_directory(self, path):
         try:
@@ -215,15 +290,103 @@ class Udemy:
             logger.error(f"Failed to create directory \"{path}\": {e}")
             sys.exit(1)
 
-    def download_lecture(self, course_id, lecture, lect_info, temp_folder_path, lindex, folder_path, task_id, progress):
-        if not skip_captions and len(lect_info["asset"]["captions"]) > 0:
-            download_captions(lect_info["asset"]["captions"], folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", captions, convert_to_srt, portal_name)
-
-        if not skip_assets and len(lecture["supplementary_assets"]) > 0:
-            download_supplementary_assets(self, lecture["supplementary_assets"], folder_path, course_id, lect_info["id"], portal_name)
-
+    def lecture_kind(self, lect_info):
+        """Label a lecture by how its main asset is fetched, for the metrics"""
+        asset = lect_info['asset']
+        if asset['asset_type'] == "Video":
+            source_types = {item['type'] for item in asset.get('media_sources') or []}
+            if "application/dash+xml" in source_types:
+                return "DASH"
+            if "application/x-mpegURL" in source_types:
+                return "HLS"
+            if "video/mp4" in source_types:
+                return "MP4"
+        return asset['asset_type']
+
+    def lecture_lane(self, lect_info):
+        """Pick the scheduler lane matching the resources a lecture's main asset needs"""
+        asset = lect_info['asset']
+        if asset['asset_type'] == "Video":
+            # DASH always goes through n_m3u8dl-re and ffmpeg. HLS is fetched in-process and hands
+            # its remux (MPEG-TS) or its n_m3u8dl-re run (encrypted playlists) over to the tools lane
+            if any(item['type'] == "application/dash+xml" for item in asset.get('media_sources') or []):
+                return "tools"
+            return "transfer"
+        if asset['asset_type'] == "Article":
+            return "render"
+        return "transfer"
+
+    def lecture_jobs(self, item, task_id, progress):
+        """
+        Split a lecture into (lane, kind, function, args, extra) jobs: captions, supplementary assets and the lecture itself.
+
+        `extra` names what a caption or asset job adds to the journal entry, as (name, value), and is None for the main job.
+        """
+        course = item['course']
+        lecture = item['lecture']
+        lect_info = item['lect_info']
+        jobs = []
+        # Set when the main output is left from an earlier run and only some extras are missing
+        missing = item.get('missing_extras')
+
+        if not skip_captions and (missing is None or 'captions' in missing):
+            # One small job per locale, so a dozen caption languages are fetched side by side
+            for caption in select_captions(lect_info["asset"]["captions"], captions if missing is None else missing['captions']):
+                jobs.append(("render", "Caption", download_caption, (caption, item['folder_path'], f"{item['index']}. {sanitize_filename(lecture['title'])}", convert_to_srt), ('captions', caption['locale_id'])))
+
+        if not skip_assets and (missing is None or 'assets' in missing):
+            # Each asset is its own job; files shared between lectures are only transferred once
+            for asset in lecture["supplementary_assets"]:
+                match asset['asset_type']:
+                    case 'File':
+                        jobs.append(("transfer", "File", process_files, (self, asset, course['id'], lect_info["id"], item['folder_path'], course['portal_name'], course['asset_index'], content_store), ('assets', True)))
+                    case 'ExternalLink':
+                        jobs.append(("metadata", "ExternalLink", process_external_links, (self, asset, course['id'], lect_info["id"], item['folder_path'], course['portal_name']), ('assets', True)))
+                    case _:
+                        pass
+                        # Unsupported asset type. Please create a github issue if you'd like to add support for other types
+
+        if missing is None:
+            jobs.append((self.lecture_lane(lect_info), item['kind'], self.download_lecture, (course, lecture, lect_info, item['temp_folder_path'], item['index'], item['folder_path'], task_id, progress), None))
+        return jobs
+
+    def requested_extras(self, item):
+        """What an item is downloaded with on top of its main output, as recorded in the journal"""
+        extras = {}
+        if item['lecture'].get('_class') == 'quiz':
+            return extras
+        if not skip_captions:
+            extras['captions'] = sorted(captions)
+        if not skip_assets:
+            extras['assets'] = True
+        return extras
+
+    def fetched_extras(self, item):
+        """The extras asked for in this run, less the captions and assets whose jobs failed"""
+        wanted = item['extras'] if item.get('missing_extras') is None else item['missing_extras']
+        failed = [extra for extra, _ in item['errors'] if extra is not None]
+        fetched = {}
+        for name, value in wanted.items():
+            if isinstance(value, list):
+                fetched[name] = [entry for entry in value if (name, entry) not in failed]
+            elif not any(failed_name == name for failed_name, _ in failed):
+                fetched[name] = value
+        return fetched
+
+    def download_lecture(self, course, lecture, lect_info, temp_folder_path, lindex, folder_path, task_id, progress):
         asset_type = lect_info['asset']['asset_type']
-        
+        store_keys = self.store_keys(lect_info)
+        output = None
+
+        if store_keys and not skip_lectures:
+            # Seen in this or another course before, no need to fetch it again
+            stored = content_store.lookup(store_keys[0])
+            if stored is not None:
+                output = content_store.materialize(stored, os.path.join(folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}{stored['ext']}"))
+                progress.console.log(f"[green]Linked {lindex}. {sanitize_filename(lecture['title'])} from the store[/green] ✓")
+                shutil.rmtree(temp_folder_path, ignore_errors=True)
+                return output
+
         if not skip_lectures:
             if asset_type == "Video":
                 mpd_url = next((item['src'] for item in lect_info['asset']['media_sources'] if item['type'] == "application/dash+xml"), None)
@@ -235,16 +398,18 @@ class Udemy:
                         if mp4_url is None:
                             logger.error(f"This lecture appears to be served in different format. We currently do not support downloading this format. Please create an issue on GitHub if you need this feature.")
                         else:
-                            download_mp4(mp4_url, temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", task_id, progress)
+                            output = download_mp4(mp4_url, temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", task_id, progress)
                     else:
-                        download_and_merge_m3u8(m3u8_url, temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", task_id, progress, portal_name)
+                        from utils.process_m3u8 import download_and_merge_m3u8
+                        output = download_and_merge_m3u8(m3u8_url, temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", task_id, progress, course['portal_name'])
                 else:
                     if key is None:
                         logger.warning("The video appears to be DRM-protected, and it may not play without a valid Widevine decryption key.")
-                    download_and_merge_mpd(mpd_url, temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", lecture['asset']['time_estimation'], key, task_id, progress, portal_name)
+                    from utils.process_mpd import download_and_merge_mpd
+                    output = download_and_merge_mpd(mpd_url, temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", lecture['asset']['time_estimation'], key, task_id, progress, course['portal_name'])
             elif asset_type == "Article":
                 if not skip_articles:
-                    download_article(self, lect_info['asset'], temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", task_id, progress, portal_name)
+                    output = download_article(self, lect_info['asset'], temp_folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}", task_id, progress, course['portal_name'], course['media_cache'])
             elif asset_type == "File" or "download_urls" in lect_info['asset']:
                 # Handle PDF and other direct file downloads
                 progress.update(task_id, description=f"Downloading File {lindex}. {sanitize_filename(lecture['title'])}", completed=0)
@@ -261,13 +426,7 @@ class Udemy:
                                 output_file = os.path.join(folder_path, f"{lindex}. {sanitize_filename(lecture['title'])}{file_ext}")
                                 
                                 # Download the file
-                                file_response = self.request(file_url)
-                                file_response.raise_for_status()
-                                
-                                with open(output_file, 'wb') as f:
-                                    for chunk in file_response.iter_content(chunk_size=8192):
-                                        if chunk:
-                                            f.write(chunk)
+                                output = download_file(file_url, output_file)
                                 
                                 progress.console.log(f"[green]Downloaded {lindex}. {sanitize_filename(lecture['title'])}{file_ext}[/green] ✓")
                                 break  # Only download the first available file
@@ -278,7 +437,8 @@ class Udemy:
                         progress.console.log(f"[yellow]No download URLs available for {lindex}. {sanitize_filename(lecture['title'])}[/yellow]")
                         
                     # Debug output to help understand the structure
-                    logger.debug(f"Asset info for lecture without download_urls: {json.dumps(lect_info['asset'], indent=2)}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Asset info for lecture without download_urls: {json.dumps(lect_info['asset'], indent=2)}")
                 except Exception as e:
                     progress.console.log(f"[red]Error downloading file {lindex}. {sanitize_filename(lecture['title'])}: {str(e)}[/red]")
                     logger.error(f"Error downloading file: {str(e)}")
@@ -302,19 +462,32 @@ class Udemy:
                 except Exception as e:
                     logger.warning(f"Could not remove temporary folder {temp_folder_path}: {str(e)}")
 
+        return output
+
+    def store_keys(self, lect_info):
+        """Content store keys for a lecture's main output, none without --store"""
+        asset = lect_info['asset']
+        # Articles link into their own course's media folder, so they aren't shared through the store
+        if content_store is None or asset['asset_type'] == "Article" or asset.get('id') is None:
+            return []
+        return [asset_key(asset['id'])]
+
+    def store_output(self, output, keys, digest):
+        # The journal has just hashed the file, the store takes that digest instead of reading it again
         try:
-            progress.remove_task(task_id)
-        except KeyError:
-            pass
+            content_store.add(output, keys, digest)
+        except OSError as e:
+            logger.warning(f"Could not add {os.path.basename(output)} to the content store: {e}")
 
-    def download_quiz(self, course_id, quiz, temp_folder_path, quiz_title, folder_path, task_id, progress, quiz_index=None):
+    def download_quiz(self, course, quiz, temp_folder_path, quiz_title, folder_path, task_id, progress, quiz_index=None):
         """Download a quiz from Udemy"""
         quiz_id = quiz['id']
+        output = None
         
         if not skip_quizzes:
             from utils.process_quizzes import download_quiz as process_quiz
             # Pass the actual quiz index instead of trying to extract it from the title
-            process_quiz(self, quiz_id, folder_path, quiz_title, task_id, progress, portal_name, quiz_index)
+            output = process_quiz(self, quiz_id, folder_path, quiz_title, task_id, progress, course['portal_name'], quiz_index, max_metadata_jobs)
         
         # Clean up temporary folder
         try:
@@ -323,171 +496,293 @@ class Udemy:
         except Exception as e:
             logger.warning(f"Could not remove temporary folder {temp_folder_path}: {str(e)}")
 
-    def download_course(self, course_id, curriculum):
-        progress = Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-            ElapsedTimeColumn(),
-        )
-        
-        futures = []
-        
-        # Create separate counters for lectures in each chapter
-        chapter_lecture_counts = {}
-        # Create separate counters for quizzes in each chapter
-        chapter_quiz_counts = {}
-
-        with ThreadPoolExecutor(max_workers=max_concurrent_lectures) as executor, Live(progress, refresh_per_second=10):
-            # Task generator for iterating through chapters and lectures
-            task_generator = (
-                (f"{mindex:02}" if mindex < 10 else f"{mindex}", 
-                chapter, 
-                lindex,  # Pass the raw index
-                lecture)
-                for mindex, chapter in enumerate(curriculum, start=1)
-                if chapter_filter is None or mindex in chapter_filter
-                for lindex, lecture in enumerate(chapter['children'], start=1)
+        return output
+
+    def iter_course_items(self, course):
+        """Yield every curriculum item in download order together with its course, chapter folder and numbering"""
+        for mindex, chapter in enumerate(course['curriculum'], start=1):
+            if chapter_filter is not None and mindex not in chapter_filter:
+                continue
+
+            folder_path = os.path.join(course['dir'], f"{mindex:02}. {remove_emojis_and_binary(sanitize_filename(chapter['title']))}")
+
+            # Lectures and quizzes are numbered separately within each chapter
+            lecture_number = 1
+            quiz_number = 1
+
+            for lindex, lecture in enumerate(chapter['children'], start=1):
+                item = {
+                    'key': f"{lecture['_class']}-{lecture['id']}",
+                    'course': course,
+                    'chapter': chapter,
+                    'lecture': lecture,
+                    'lindex': lindex,
+                    'folder_path': folder_path,
+                    'temp_folder_path': os.path.join(folder_path, str(lecture['id'])),
+                }
+
+                if lecture.get('_class') == 'quiz':
+                    if skip_quizzes:
+                        continue
+                    item['index'] = quiz_number
+                    quiz_number += 1
+                else:
+                    item['index'] = f"{lecture_number:02}"
+                    lecture_number += 1
+                    if skip_lectures:
+                        continue
+                    # The curriculum already tells articles apart, so skipped ones never get a job that produces nothing
+                    if skip_articles and lecture.get('asset', {}).get('asset_type') == "Article":
+                        continue
+
+                yield item
+
+    def run_job(self, item, kind, queued_at, extra, fn, *args):
+        """Run one of an item's jobs in a worker. Whichever job finishes last records the item in the journal"""
+        started_at = time.monotonic()
+        metrics.observe("queue_wait", started_at - queued_at, kind=kind)
+
+        with tagged(kind), tracer.span(fn.__name__, kind=kind, item=item['lecture']['title']):
+            try:
+                output = fn(*args)
+            except Exception as e:
+                self.job_done(item, kind, started_at, extra, error=e)
+                raise
+
+            if isinstance(output, Handoff):
+                # The rest of the job runs on another lane, the item is done once it has
+                return Handoff(output.lane, self.run_job, item, kind, time.monotonic(), extra, output.fn, *output.args,
+                               name=f"{output.fn.__name__}: {item['lecture']['title']}")
+            if isinstance(output, Future):
+                # Still running in a child process, finish up once it exits
+                return then(output,
+                            lambda value: self.job_done(item, kind, started_at, extra, value),
+                            on_error=lambda e: self.job_done(item, kind, started_at, extra, error=e))
+            return self.job_done(item, kind, started_at, extra, output)
+
+    def job_done(self, item, kind, started_at, extra, output=None, error=None):
+        metrics.observe("run", time.monotonic() - started_at, kind=kind)
+        if error is not None:
+            item['errors'].append((extra, error))
+        elif extra is None:
+            item['output'] = output
+
+        with item['lock']:
+            item['pending_jobs'] -= 1
+            finished = item['pending_jobs'] == 0
+        if finished:
+            # Hashing a multi-GB output for the journal shouldn't hold this worker or the continuation
+            # pool, so download_courses picks the item up and finishes it on the render lane
+            self.finished.append(item)
+        return output
+
+    def finish_item(self, item):
+        """
+        Record a finished item in the journal and report it if any of its jobs failed.
+
+        A lecture whose main output was written is journaled as done even when a caption or
+        asset failed; only the extras that were fetched are recorded, so a re-run retries the rest.
+        """
+        journal = item['course']['journal']
+        output = item.get('output')
+        main_error = next((error for extra, error in item['errors'] if extra is None), None)
+        extra_error = next((error for extra, error in item['errors'] if extra is not None), None)
+        failed = True
+        if item.get('missing_extras') is not None:
+            # The main output is still there from an earlier run, only the extras were fetched
+            journal.record_extras(item['key'], self.fetched_extras(item))
+            failed = extra_error is not None
+            if failed:
+                self.report_failure(item, extra_error)
+        elif main_error is None and output and os.path.isfile(output):
+            entry = journal.record(item['key'], 'done', [output], extras=self.fetched_extras(item))
+            failed = extra_error is not None
+            store_keys = self.store_keys(item['lect_info']) if 'lect_info' in item else []
+            if store_keys:
+                self.store_output(output, store_keys, entry['outputs'][0]['sha256'])
+            if failed:
+                self.report_failure(item, extra_error)
+        else:
+            # Download functions log their own errors and return None, that is a failure too
+            journal.record(item['key'], 'failed', error=main_error)
+            self.report_failure(item, main_error)
+
+        metrics.item_finished(item['kind'], failed)
+        tracer.end(item['lecture']['title'], item['trace_id'], failed=failed)
+        progress = item['progress']
+        progress.item_finished(failed)
+        try:
+            progress.remove_task(item['task_id'])
+        except KeyError:
+            pass
+
+    def item_lane(self, item):
+        if item['lecture'].get('_class') == 'quiz':
+            return "render"
+        return self.lecture_lane(item['lect_info'])
+
+    def submit_item(self, scheduler, item, progress):
+        chapter = item['chapter']
+        lecture = item['lecture']
+
+        self.create_directory(item['folder_path'])
+        self.create_directory(item['temp_folder_path'])
+
+        logger.debug(f"Processing item: {lecture.get('_class')} - {lecture.get('title')}")
+
+        if lecture.get('_class') == 'quiz':
+            item['kind'] = "Quiz"
+            task_id = progress.add_task(
+                f"Downloading Quiz: {lecture['title']} ({item['lindex']}/{len(chapter['children'])})",
+                total=100
             )
+            jobs = [("render", "Quiz", self.download_quiz, (item['course'], lecture, item['temp_folder_path'], sanitize_filename(lecture['title']),
+                     item['folder_path'], task_id, progress, item['index']), None)]
+        else:
+            item['kind'] = self.lecture_kind(item['lect_info'])
+            task_id = progress.add_task(
+                f"Downloading Lecture: {lecture['title']} ({item['lindex']}/{len(chapter['children'])})",
+                total=100
+            )
+            jobs = self.lecture_jobs(item, task_id, progress)
 
-            # Initial batch of tasks
-            for _ in range(max_concurrent_lectures):
-                try:
-                    mindex, chapter, lindex, lecture = next(task_generator)
-                    folder_path = os.path.join(COURSE_DIR, f"{mindex}. {remove_emojis_and_binary(sanitize_filename(chapter['title']))}")
-                    self.create_directory(folder_path)
-                    temp_folder_path = os.path.join(folder_path, str(lecture['id']))
-                    self.create_directory(temp_folder_path)
-                    
-                    # Log what we're processing
-                    logger.debug(f"Processing item: {lecture.get('_class')} - {lecture.get('title')}")
-                    
-                    # Initialize lecture count for this chapter if needed
-                    chapter_id = chapter['id']
-                    if chapter_id not in chapter_lecture_counts:
-                        chapter_lecture_counts[chapter_id] = 1
-                    
-                    # Initialize quiz count for this chapter if needed
-                    if chapter_id not in chapter_quiz_counts:
-                        chapter_quiz_counts[chapter_id] = 1
-                    
-                    # Handle quiz or lecture
-                    if lecture.get('_class') == 'quiz':
-                        # Format quiz title
-                        formatted_quiz_title = sanitize_filename(lecture['title'])
-                        
-                        if not skip_quizzes:
-                            # Get the quiz counter for this chapter
-                            quiz_index = chapter_quiz_counts[chapter_id]
-                            chapter_quiz_counts[chapter_id] += 1
-                            
-                            task_id = progress.add_task(
-                                f"Downloading Quiz: {lecture['title']} ({lindex}/{len(chapter['children'])})", 
-                                total=100
-                            )
-                            future = executor.submit(
-                                self.download_quiz, course_id, lecture, temp_folder_path, formatted_quiz_title, 
-                                folder_path, task_id, progress, quiz_index
-                            )
-                            futures.append((task_id, future))
-                    else:
-                        # Format lecture title with proper numbering
-                        lecture_number = chapter_lecture_counts[chapter_id]
-                        formatted_lecture_index = f"{lecture_number:02}" if lecture_number < 10 else f"{lecture_number}"
-                        chapter_lecture_counts[chapter_id] += 1
-                        
-                        if not skip_lectures:
-                            lect_info = self.fetch_lecture_info(course_id, lecture['id'])
-                            task_id = progress.add_task(
-                                f"Downloading Lecture: {lecture['title']} ({lindex}/{len(chapter['children'])})", 
-                                total=100
-                            )
-                            future = executor.submit(
-                                self.download_lecture, course_id, lecture, lect_info, temp_folder_path, formatted_lecture_index, folder_path, task_id, progress
-                            )
-                            futures.append((task_id, future))
-                except StopIteration:
-                    break
-
-            # Process futures
-            while futures:
-                completed = []
-                for task_id, future in futures:
-                    if future.done():
-                        completed.append((task_id, future))
-                
-                for task_id, future in completed:
-                    try:
-                        future.result()  # Get the result to raise any exceptions
-                    except Exception as e:
-                        logger.error(f"Error downloading item: {e}")
-                    
-                    try:
-                        progress.remove_task(task_id)
-                    except:
-                        pass
-                    
-                    futures.remove((task_id, future))
-                    
-                    # Add a new task
-                    try:
-                        mindex, chapter, lindex, lecture = next(task_generator)
-                        folder_path = os.path.join(COURSE_DIR, f"{mindex}. {sanitize_filename(chapter['title'])}")
-                        self.create_directory(folder_path)
-                        temp_folder_path = os.path.join(folder_path, str(lecture['id']))
-                        self.create_directory(temp_folder_path)
-                        
-                        # Initialize lecture count for this chapter if needed
-                        chapter_id = chapter['id']
-                        if chapter_id not in chapter_lecture_counts:
-                            chapter_lecture_counts[chapter_id] = 1
-                        
-                        # Initialize quiz count for this chapter if needed
-                        if chapter_id not in chapter_quiz_counts:
-                            chapter_quiz_counts[chapter_id] = 1
-                        
-                        if lecture.get('_class') == 'quiz':
-                            # Format quiz title
-                            formatted_quiz_title = sanitize_filename(lecture['title'])
-                            
-                            if not skip_quizzes:
-                                # Get the quiz counter for this chapter
-                                quiz_index = chapter_quiz_counts[chapter_id]
-                                chapter_quiz_counts[chapter_id] += 1
-                                
-                                task_id = progress.add_task(
-                                    f"Downloading Quiz: {lecture['title']} ({lindex}/{len(chapter['children'])})", 
-                                    total=100
-                                )
-                                future = executor.submit(
-                                    self.download_quiz, course_id, lecture, temp_folder_path, formatted_quiz_title, 
-                                    folder_path, task_id, progress, quiz_index
-                                )
-                                futures.append((task_id, future))
-                        else:
-                            # Format lecture title with proper numbering
-                            lecture_number = chapter_lecture_counts[chapter_id]
-                            formatted_lecture_index = f"{lecture_number:02}" if lecture_number < 10 else f"{lecture_number}"
-                            chapter_lecture_counts[chapter_id] += 1
-                            
-                            if not skip_lectures:
-                                lect_info = self.fetch_lecture_info(course_id, lecture['id'])
-                                task_id = progress.add_task(
-                                    f"Downloading Lecture: {lecture['title']} ({lindex}/{len(chapter['children'])})",
-                                    total=100
-                                )
-                                future = executor.submit(
-                                    self.download_lecture, course_id, lecture, lect_info, temp_folder_path, formatted_lecture_index, folder_path, task_id, progress
-                                )
-                                futures.append((task_id, future))
-                    except StopIteration:
-                        break
-                
-                # If no task completed in this iteration, wait a bit
-                if not completed:
-                    import time
-                    time.sleep(0.1)
+        # Failures are reported once per item, by finish_item after its last job
+        item.update(task_id=task_id, progress=progress, errors=[], lock=threading.Lock(), pending_jobs=len(jobs))
+        if not jobs:
+            # None of the missing extras exist for this lecture
+            self.finish_item(item)
+            return
+
+        for lane, kind, fn, args, extra in jobs:
+            scheduler.submit(lane, self.run_job, item, kind, time.monotonic(), extra, fn, *args,
+                             name=f"{fn.__name__}: {lecture['title']}")
+
+    def download_courses(self, courses):
+        """Download several courses under one scheduler, so every lane is shared across them"""
+        if status_output is None:
+            progress = TerminalProgress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+                ElapsedTimeColumn(),
+            )
+        else:
+            progress = JsonLinesProgress(open_status_stream(status_output))
+        for course in courses:
+            course['journal'] = DownloadJournal(course['dir'])
+            course['asset_index'] = AssetIndex()
+            course['media_cache'] = MediaCache(os.path.join(course['dir'], "media"))
+        progress.set_total(sum(1 for course in courses for _ in self.iter_course_items(course)))
+
+        # Taking items from every course in turn mixes lectures of different kinds,
+        # so one course's long merges leave room for another's small files
+        items = interleave(self.iter_course_items(course) for course in courses)
+        skipped = 0
+        self.failures = []
+        # Items whose last job is done, waiting to be journaled
+        self.finished = deque()
+
+        # Metadata calls, byte transfers, external tools and local rendering each get their own lane,
+        # so a few long merges can't starve the cheap items and the CPU isn't swamped by ffmpeg
+        scheduler = Scheduler()
+        if adaptive_concurrency:
+            # Network lanes back off on throttling; transfers also grow while the byte rate keeps improving
+            scheduler.add_lane("metadata", max_metadata_jobs, AdaptiveLimiter(max_metadata_jobs, maximum=max(MAX_METADATA_CONCURRENCY, max_metadata_jobs)))
+            scheduler.add_lane("transfer", max_concurrent_lectures, AdaptiveLimiter(max_concurrent_lectures, maximum=MAX_CONCURRENT_LECTURES), lambda: transfer_meter.total)
+        else:
+            scheduler.add_lane("metadata", max_metadata_jobs)
+            scheduler.add_lane("transfer", max_concurrent_lectures)
+        scheduler.add_lane("tools", max_tool_jobs)
+        scheduler.add_lane("render", max_render_jobs)
+
+        # Items whose lecture info has been resolved and are waiting for a slot in their lane
+        ready = deque()
+        prefetching = 0
+
+        def prefetch_depth():
+            # Follows the adaptive limits: enough resolved items to refill the download lanes,
+            # plus room for every lecture info request the metadata lane may have in flight
+            lanes = scheduler.lanes
+            return (lanes["transfer"].limit + lanes["tools"].limit) * PREFETCH_DEPTH_FACTOR + lanes["metadata"].limit
+
+        def on_lecture_info(item, future):
+            nonlocal prefetching
+            prefetching -= 1
+            try:
+                item['lect_info'] = future.result()
+            except Exception as e:
+                self.report_failure(item, e)
+                metrics.item_finished("Lecture", failed=True)
+                tracer.end(item['lecture']['title'], item['trace_id'], failed=True)
+                progress.item_finished(failed=True)
+                return
+            ready.append(item)
+
+        def refill():
+            nonlocal prefetching, skipped
+            # Every job appends its item before its own Future completes, so the scheduler wakes up for it
+            while self.finished:
+                item = self.finished.popleft()
+                scheduler.submit("render", self.finish_item, item, name=f"finish_item: {item['lecture']['title']}")
+
+            while True:
+                # Start every ready item whose lane has room, not just the head of the queue
+                for item in list(ready):
+                    if scheduler.has_capacity(self.item_lane(item)):
+                        ready.remove(item)
+                        self.submit_item(scheduler, item, progress)
+
+                # Resolve lecture info ahead of the download workers, up to prefetch_depth() items
+                if prefetching + len(ready) >= prefetch_depth():
+                    return
+                item = next(items, None)
+                if item is None:
+                    return
+
+                # Finished in an earlier run with everything asked for now, nothing to fetch
+                journal = item['course']['journal']
+                item['extras'] = self.requested_extras(item)
+                missing = journal.missing_extras(item['key'], item['extras'])
+                if journal.intact_outputs(item['key']) is not None:
+                    if not missing:
+                        logger.debug(f"Skipping already downloaded item: {item['lecture']['title']}")
+                        skipped += 1
+                        progress.item_finished()
+                        continue
+                    # Captions or assets asked for now that the earlier run didn't fetch
+                    item['missing_extras'] = missing
+
+                # One bar per item, from lecture info until its last job is done
+                item['trace_id'] = f"{item['course']['id']}:{item['key']}"
+                tracer.begin(item['lecture']['title'], item['trace_id'], course=item['course']['title'])
+
+                if item['lecture'].get('_class') == 'quiz':
+                    ready.append(item)
+                else:
+                    prefetching += 1
+                    scheduler.submit(
+                        "metadata", self.fetch_lecture_info, item['course'], item['lecture']['id'],
+                        callback=lambda future, item=item: on_lecture_info(item, future),
+                        name=f"fetch_lecture_info: {item['lecture']['title']}"
+                    )
+
+        try:
+            with progress:
+                scheduler.run(refill)
+        finally:
+            scheduler.shutdown()
+
+        if skipped:
+            logger.info(f"Skipped {skipped} item(s) already downloaded in a previous run")
+
+        if self.failures:
+            counts = Counter(kind for kind, _ in self.failures)
+            logger.warning(f"{len(self.failures)} item(s) failed ({', '.join(f'{count} {kind}' for kind, count in counts.items())}). Run the same command again to retry them.")
+            if counts.get("access denied"):
+                logger.error("Some requests were rejected. Your cookies or bearer token may have expired.")
+        else:
+            logger.info("All course materials have been successfully downloaded.")
 
     def extract_quiz_number(self, title):
         """Extract quiz number from title if it exists"""
@@ -521,20 +816,37 @@ def check_prerequisites():
                 logger.error(f"The provided cookie file path does not exist.")
                 return False
 
-    try:
-        subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-    except:
-        logger.error("ffmpeg is not installed or not found in the system PATH.")
-        return False
-    
-    try:
-        subprocess.run(["n_m3u8dl-re", "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-    except:
-        logger.error("Make sure mp4decrypt & n_m3u8dl-re is not installed or not found in the system PATH.")
-        return False
-    
+    # ffmpeg and n_m3u8dl-re are looked up by utils.tools once a lecture needs them
     return True
 
+def course_url_cache_key(course_url, portal_name):
+    """Cache key for a course URL: its portal and slug, so tracking parameters and lecture paths don't matter"""
+    slug_match = COURSE_SLUG_PATTERN.search(course_url)
+    if slug_match:
+        return f"{portal_name}-{sanitize_filename(slug_match.group(1))}"
+    return f"{portal_name}-{hashlib.sha1(course_url.encode('utf-8')).hexdigest()[:16]}"
+
+def read_batch_file(path):
+    """Course IDs or URLs from a batch file, one per line. Blank lines and # comments are skipped."""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and line not in entries:
+                entries.append(line)
+    return entries
+
+def interleave(iterables):
+    """Round-robin over several iterators until all of them are exhausted"""
+    iterators = deque(iter(iterable) for iterable in iterables)
+    while iterators:
+        iterator = iterators.popleft()
+        try:
+            yield next(iterator)
+        except StopIteration:
+            continue
+        iterators.append(iterator)
+
 def parse_chapter_filter(chapter_filter_str):
     chapter_filter = set()
     for part in chapter_filter_str.split(","):
@@ -550,19 +862,33 @@ bearer_token = None
 skip_quizzes = False
 
 def main():
+    setup_logging()
 
     try:
-        global course_url, key, cookie_path, COURSE_DIR, captions, max_concurrent_lectures, skip_captions, skip_assets, skip_lectures, skip_articles, skip_assignments, convert_to_srt, chapter_filter, portal_name, bearer_token, skip_quizzes
+        global course_url, key, status_output, content_store, adaptive_concurrency, max_metadata_jobs, max_tool_jobs, max_render_jobs, request_timeout, request_retries, cookie_path, captions, max_concurrent_lectures, skip_captions, skip_assets, skip_lectures, skip_articles, skip_assignments, convert_to_srt, chapter_filter, bearer_token, skip_quizzes
 
         parser = argparse.ArgumentParser(description="Udemy Course Downloader")
         parser.add_argument("--id", "-i", type=int, required=False, help="The ID of the Udemy course to download")
         parser.add_argument("--url", "-u", type=str, required=False, help="The URL of the Udemy course to download")
+        parser.add_argument("--batch", metavar="FILE", type=str, help="Download every course listed in FILE (one course ID or URL per line) in a single run")
         parser.add_argument("--key", "-k", type=str, help="Key to decrypt the DRM-protected videos")
         parser.add_argument("--cookies", "-c", type=str, default="cookies.txt", help="Path to cookies.txt file")
         parser.add_argument("--bearer", "-b", type=str, help="Bearer token for authentication (for Udemy Business)")
         parser.add_argument("--load", "-l", help="Load course curriculum from file", action=LoadAction, const=True, nargs='?')
         parser.add_argument("--save", "-s", help="Save course curriculum to a file", action=LoadAction, const=True, nargs='?')
         parser.add_argument("--concurrent", "-cn", type=int, default=4, help="Maximum number of concurrent downloads")
+        parser.add_argument("--metadata-jobs", type=int, help="Number of concurrent API requests for lecture info and asset links to start with (defaults to --concurrent, at least 4)")
+        parser.add_argument("--tool-jobs", type=int, help="Maximum number of concurrent n_m3u8dl-re/ffmpeg jobs (defaults to the number of CPU cores)")
+        parser.add_argument("--no-adaptive", help="Keep --concurrent fixed instead of adapting it to throttling and throughput", action="store_true")
+        parser.add_argument("--max-rate", metavar="RATE", help="Cap the download rate in bytes/sec (e.g. 500K, 2M), or follow a daily schedule like '08:00=1M,19:00=off'")
+        parser.add_argument("--timeout", type=float, default=READ_TIMEOUT, help="Seconds to wait for a server response before retrying")
+        parser.add_argument("--retries", type=int, default=MAX_RETRIES, help="Number of retries for failed requests")
+        parser.add_argument("--no-tui", dest="status_output", metavar="FILE", nargs="?", const="-", help="Write JSON-lines status records instead of drawing progress bars, to FILE if given or stdout otherwise")
+        parser.add_argument("--store", metavar="DIR", nargs="?", const=STORE_DIR, help="Keep every downloaded file once in a content-addressed store (default: ./store) and hardlink it into the course folders, so content seen in any course is not downloaded again")
+        parser.add_argument("--refresh", help="Ignore the cached course curriculum and fetch it again", action="store_true")
+        parser.add_argument("--metrics", metavar="FILE", help="Write per-stage timings and byte counts for each kind of item to FILE as JSON at the end of the run")
+        parser.add_argument("--metrics-prom", metavar="FILE", help="Write the same metrics to FILE in the Prometheus text format (for node_exporter's textfile collector)")
+        parser.add_argument("--trace", metavar="FILE", help="Record a timeline of workers, scheduler slots and child processes to FILE (Chrome trace-event JSON, open it in Perfetto or chrome://tracing)")
         
         # parser.add_argument("--quality", "-q", type=str, help="Specify the quality of the videos to download.")
         parser.add_argument("--chapter", dest="chapter_filter", type=str, help="Download specific chapters. Use comma separated values and ranges (e.g., '1,3-5,7,9-11')")
@@ -586,18 +912,46 @@ def main():
         course_url = args.url
 
         key = args.key
-
-        if args.concurrent > 25:
-            logger.warning("The maximum number of concurrent downloads is 25. The provided number of concurrent downloads will be capped to 25.")
-            max_concurrent_lectures = 25
+        adaptive_concurrency = not args.no_adaptive
+        status_output = args.status_output
+        content_store = ContentStore(args.store) if args.store else None
+        if status_output == "-":
+            # Keep stdout clean for the status records
+            console_handler.setStream(sys.stderr)
+        request_timeout = args.timeout
+        request_retries = max(0, args.retries)
+
+        if args.max_rate:
+            try:
+                bandwidth.set_schedule(parse_rate_schedule(args.max_rate))
+            except ValueError as e:
+                logger.error(f"Invalid --max-rate: {e}")
+                return
+
+        if args.concurrent > MAX_CONCURRENT_LECTURES:
+            logger.warning(f"The maximum number of concurrent downloads is {MAX_CONCURRENT_LECTURES}. The provided number of concurrent downloads will be capped to {MAX_CONCURRENT_LECTURES}.")
+            max_concurrent_lectures = MAX_CONCURRENT_LECTURES
         elif args.concurrent < 1:
             logger.warning("The minimum number of concurrent downloads is 1. The provided number of concurrent downloads will be capped to 1.")
             max_concurrent_lectures = 1
         else:
             max_concurrent_lectures = args.concurrent
 
-        if not course_url and not args.id:
-            logger.error("You must provide either the course ID with '--id' or the course URL with '--url' to proceed.")
+        # Each item needs an API round trip before its download can start, so lecture info is
+        # resolved about as wide as the downloads run; adaptive mode grows it from there
+        max_metadata_jobs = max(1, args.metadata_jobs) if args.metadata_jobs else min(MAX_METADATA_CONCURRENCY, max(METADATA_CONCURRENCY, max_concurrent_lectures))
+
+        # Merges are CPU and disk bound. Captions, articles and quizzes render cheaply but mostly wait
+        # on the API, so their lane is at least as wide as the downloads
+        cpu_count = os.cpu_count() or 1
+        max_tool_jobs = max(1, args.tool_jobs) if args.tool_jobs else min(max_concurrent_lectures, max(2, cpu_count))
+        max_render_jobs = max(4, cpu_count * 2, max_concurrent_lectures)
+
+        if args.batch:
+            if course_url or args.id:
+                logger.warning("A batch file was provided. Ignoring '--id' and '--url'.")
+        elif not course_url and not args.id:
+            logger.error("You must provide either the course ID with '--id', the course URL with '--url' or a batch file with '--batch' to proceed.")
             return
         elif course_url and args.id:
             logger.warning("Both course ID and URL provided. Prioritizing course ID over URL.")
@@ -619,14 +973,6 @@ def main():
         
         udemy = Udemy()
 
-        if args.id:
-            course_id = args.id
-            # If we have a course ID but no URL, we need to set a default portal_name
-            portal_name = "www"
-        else:
-            course_id = udemy.extract_course_id(course_url)
-            # portal_name should be set by extract_course_id
-
         if args.captions:
             try:
                 captions = args.captions.split(",")
@@ -642,68 +988,103 @@ def main():
         skip_assignments = args.skip_assignments
         skip_quizzes = args.skip_quizzes
 
-        course_info = udemy.fetch_course(course_id)
-        COURSE_DIR = os.path.join(DOWNLOAD_DIR, remove_emojis_and_binary(sanitize_filename(course_info['title'])))
-
-        logger.info(f"Course Title: {course_info['title']}")
+        if args.batch:
+            if args.load or args.save or args.tree:
+                logger.warning("--load, --save and --tree only apply to a single course and are ignored in batch mode.")
 
-        udemy.create_directory(os.path.join(COURSE_DIR))
-
-        if args.load:
-            if args.load is True and os.path.isfile(os.path.join(HOME_DIR, "course.json")):
+            try:
+                entries = read_batch_file(args.batch)
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error(f"The batch file could not be read: {e}")
+                return
+
+            courses = []
+            opened = set()
+            for entry in entries:
+                # A course that can't be opened shouldn't hold up the rest of the batch
                 try:
-                    course_curriculum = json.load(open(os.path.join(HOME_DIR, "course.json"), "r"))
-                    logger.info(f"The course curriculum is successfully loaded from course.json")
-                except json.JSONDecodeError:
-                    logger.error("The course curriculum file provided is either malformed or corrupted.")
-                    sys.exit(1)
-            elif args.load:
-                if os.path.isfile(args.load):
+                    course = udemy.open_course(entry, refresh=args.refresh)
+                    # Listed twice (by URL and by ID, say), both would share one directory and journal
+                    if (course['portal_name'], course['id']) in opened:
+                        logger.warning(f"Skipping {entry}: the course is already in the batch")
+                        continue
+                    course['curriculum'] = udemy.fetch_course_curriculum(course['id'], course['portal_name'], refresh=args.refresh)
+                except Exception as e:
+                    logger.error(f"Skipping {entry}: {e}")
+                    continue
+                opened.add((course['portal_name'], course['id']))
+                courses.append(course)
+
+            if not courses:
+                logger.error("None of the courses in the batch file could be opened.")
+                return
+        else:
+            try:
+                course = udemy.open_course(args.id or course_url, refresh=args.refresh)
+            except Exception as e:
+                logger.critical(e)
+                sys.exit(1)
+            courses = [course]
+
+            if args.load:
+                if args.load is True and os.path.isfile(os.path.join(HOME_DIR, "course.json")):
                     try:
-                        course_curriculum = json.load(open(args.load, "r"))
-                        logger.info(f"The course curriculum is successfully loaded from {args.load}")
+                        course_curriculum = json.load(open(os.path.join(HOME_DIR, "course.json"), "r"))
+                        logger.info(f"The course curriculum is successfully loaded from course.json")
                     except json.JSONDecodeError:
                         logger.error("The course curriculum file provided is either malformed or corrupted.")
                         sys.exit(1)
+                elif args.load:
+                    if os.path.isfile(args.load):
+                        try:
+                            course_curriculum = json.load(open(args.load, "r"))
+                            logger.info(f"The course curriculum is successfully loaded from {args.load}")
+                        except json.JSONDecodeError:
+                            logger.error("The course curriculum file provided is either malformed or corrupted.")
+                            sys.exit(1)
+                    else:
+                        logger.error("The course curriculum file could not be located. Please verify the file path and ensure that the file exists.")
+                        sys.exit(1)
                 else:
-                    logger.error("The course curriculum file could not be located. Please verify the file path and ensure that the file exists.")
+                    logger.error("Please provide the path to the course curriculum file.")
                     sys.exit(1)
             else:
-                logger.error("Please provide the path to the course curriculum file.")
-                sys.exit(1)
-        else:
-            try:
-                course_curriculum = udemy.fetch_course_curriculum(course_id)
-            except Exception as e:
-                logger.critical(f"Unable to retrieve the course curriculum. {e}")
-                sys.exit(1)
-
-        if args.save:
-            if args.save is True:
-                if (os.path.isfile(os.path.join(HOME_DIR, "course.json"))):
-                    logger.warning("Course curriculum file already exists. Overwriting the existing file.")
-                with open(os.path.join(HOME_DIR, "course.json"), "w") as f:
-                    json.dump(course_curriculum, f, indent=4)
-                    logger.info(f"The course curriculum has been successfully saved to course.json")
-            elif args.save:
-                if (os.path.isfile(args.save)):
-                    logger.warning("Course curriculum file already exists. Overwriting the existing file.")
-                with open(args.save, "w") as f:
-                    json.dump(course_curriculum, f, indent=4)
-                    logger.info(f"The course curriculum has been successfully saved to {args.save}")
-
-        if args.tree:
-            root_tree = Tree(course_info['title'], style="green")
-            udemy.build_curriculum_tree(course_curriculum, root_tree)
-            rprint(root_tree)
-            if args.tree is True:
-                pass
-            elif args.tree:
-                if (os.path.isfile(args.tree)):
-                    logger.warning("Course Curriculum Tree file already exists. Overwriting the existing file.")
-                with open(args.tree, "w") as f:
-                    rprint(root_tree, file=f)
-                    logger.info(f"The course curriculum tree has been successfully saved to {args.tree}")
+                try:
+                    course_curriculum = udemy.fetch_course_curriculum(course['id'], course['portal_name'], refresh=args.refresh)
+                except Exception as e:
+                    logger.critical(f"Unable to retrieve the course curriculum. {e}")
+                    sys.exit(1)
+            course['curriculum'] = course_curriculum
+
+            if args.save:
+                if args.save is True:
+                    if (os.path.isfile(os.path.join(HOME_DIR, "course.json"))):
+                        logger.warning("Course curriculum file already exists. Overwriting the existing file.")
+                    with open(os.path.join(HOME_DIR, "course.json"), "w") as f:
+                        json.dump(course_curriculum, f, indent=4)
+                        logger.info(f"The course curriculum has been successfully saved to course.json")
+                elif args.save:
+                    if (os.path.isfile(args.save)):
+                        logger.warning("Course curriculum file already exists. Overwriting the existing file.")
+                    with open(args.save, "w") as f:
+                        json.dump(course_curriculum, f, indent=4)
+                        logger.info(f"The course curriculum has been successfully saved to {args.save}")
+
+            if args.tree:
+                from rich.tree import Tree
+                from rich import print as rprint
+                root_tree = Tree(course['title'], style="green")
+                udemy.build_curriculum_tree(course_curriculum, root_tree)
+                # Stdout carries the JSON-lines status records under a bare --no-tui
+                rprint(root_tree, file=sys.stderr if status_output == "-" else None)
+                if args.tree is True:
+                    pass
+                elif args.tree:
+                    if (os.path.isfile(args.tree)):
+                        logger.warning("Course Curriculum Tree file already exists. Overwriting the existing file.")
+                    with open(args.tree, "w") as f:
+                        rprint(root_tree, file=f)
+                        logger.info(f"The course curriculum tree has been successfully saved to {args.tree}")
 
         if args.srt:
             convert_to_srt = True
@@ -716,17 +1097,41 @@ def main():
         else:
             chapter_filter = None
 
-        logger.info("The course download is starting. Please wait while the materials are being downloaded.")
+        if len(courses) > 1:
+            logger.info(f"Downloading {len(courses)} courses. Please wait while the materials are being downloaded.")
+        else:
+            logger.info("The course download is starting. Please wait while the materials are being downloaded.")
+
+        if args.trace:
+            tracer.enable()
 
         start_time = time.time()
-        udemy.download_course(course_id, course_curriculum)
+        try:
+            with tracer.span("download_courses", "run"):
+                udemy.download_courses(courses)
+        finally:
+            if args.trace:
+                try:
+                    tracer.write(args.trace)
+                    logger.info(f"Trace written to {args.trace}")
+                except OSError as e:
+                    logger.warning(f"Could not write the trace: {e}")
         end_time = time.time()
 
         elapsed_time = end_time - start_time
         
         logger.info(f"Download finished in {format_time(elapsed_time)}")
+        for line in metrics.report():
+            logger.info(line)
+
+        try:
+            if args.metrics:
+                metrics.write_json(args.metrics)
+            if args.metrics_prom:
+                metrics.write_prometheus(args.metrics_prom)
+        except OSError as e:
+            logger.warning(f"Could not write the metrics: {e}")
 
-        logger.info("All course materials have been successfully downloaded.")    
         logger.info("Download Complete.")
     except KeyboardInterrupt:
         logger.warning("Process interrupted. Exiting")
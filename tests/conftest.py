@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def run_main(monkeypatch):
+    """Run main() with the given arguments, without a log file or an HTTP session."""
+    import main
+    monkeypatch.setattr(main, 'setup_logging', lambda: None)
+    monkeypatch.setattr(main, 'init_session', lambda *args, **kwargs: None)
+    # --no-tui moves the console handler over to stderr
+    monkeypatch.setattr(main.console_handler, 'stream', main.console_handler.stream)
+
+    def run(*argv):
+        monkeypatch.setattr(sys, 'argv', ["main.py", "--bearer", "token", *argv])
+        main.main()
+    return run
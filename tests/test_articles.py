@@ -0,0 +1,21 @@
+import pytest
+from utils import process_articles
+
+def test_failed_media_fetch_is_retried_by_the_next_article(tmp_path, monkeypatch):
+    attempts = []
+
+    def download_file(url, path):
+        attempts.append(url)
+        if len(attempts) == 1:
+            raise OSError("connection reset")
+        open(path, 'wb').close()
+        return path
+
+    monkeypatch.setattr(process_articles, 'download_file', download_file)
+    cache = process_articles.MediaCache(str(tmp_path / "media"))
+    url = "https://img.example/diagram.png"
+
+    with pytest.raises(OSError):
+        cache.get(url).result(timeout=5)
+    assert cache.get(url).result(timeout=5) == cache.path_for(url)
+    assert len(attempts) == 2
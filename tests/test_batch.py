@@ -0,0 +1,24 @@
+import logging
+import main
+
+def test_unreadable_batch_file_is_an_error(run_main, tmp_path, caplog):
+    with caplog.at_level(logging.ERROR, logger="udemy-dl"):
+        run_main("--batch", str(tmp_path / "missing.txt"))
+
+    assert "The batch file could not be read" in caplog.text
+
+def test_course_listed_twice_is_opened_once(run_main, tmp_path, monkeypatch):
+    batch = tmp_path / "batch.txt"
+    batch.write_text("https://www.udemy.com/course/python/\n123\n", encoding='utf-8')
+
+    def open_course(self, entry, refresh=False):
+        return {'id': "123", 'portal_name': "www", 'title': "Python", 'dir': str(tmp_path / "Python")}
+    downloaded = []
+    monkeypatch.setattr(main.Udemy, 'open_course', open_course)
+    monkeypatch.setattr(main.Udemy, 'fetch_course_curriculum', lambda self, *args, **kwargs: [])
+    monkeypatch.setattr(main.Udemy, 'download_courses', lambda self, courses: downloaded.extend(courses))
+    monkeypatch.setattr(main.metrics, 'report', lambda: [])
+
+    run_main("--batch", str(batch))
+
+    assert [course['id'] for course in downloaded] == ["123"]
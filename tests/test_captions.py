@@ -0,0 +1,24 @@
+from utils.process_captions import vtt_to_srt
+
+def test_cues_are_numbered_with_srt_timestamps():
+    vtt = "WEBVTT\n\nintro\n00:01.000 --> 00:04.500\nHello\n\n01:00:02.250 --> 01:00:03.000\nWorld\n"
+
+    assert vtt_to_srt(vtt) == "1\n00:00:01,000 --> 00:00:04,500\nHello\n\n2\n01:00:02,250 --> 01:00:03,000\nWorld\n\n"
+
+def test_cue_settings_and_inline_tags_are_dropped():
+    vtt = "WEBVTT\n\n00:00:01.000 --> 00:00:02.000 align:start position:10% line:0\n<v Speaker>Hi <i>there</i></v>\n<c.yellow>two lines</c>\n"
+
+    assert vtt_to_srt(vtt) == "1\n00:00:01,000 --> 00:00:02,000\nHi there\ntwo lines\n\n"
+
+def test_note_style_and_region_blocks_are_skipped():
+    vtt = ("WEBVTT - with a header\nKind: captions\n\n"
+           "STYLE\n::cue { color: yellow }\n\n"
+           "REGION\nid:bottom\n\n"
+           "NOTE written by hand\n00:00:09.000 --> 00:00:10.000 is not a cue here\n\n"
+           "00:00:01.000 --> 00:00:02.000\nOnly cue\n")
+
+    assert vtt_to_srt(vtt) == "1\n00:00:01,000 --> 00:00:02,000\nOnly cue\n\n"
+
+def test_output_ends_with_a_newline_without_one_in_the_input():
+    assert vtt_to_srt("WEBVTT\n\n00:01.000 --> 00:02.000\nLast").endswith("Last\n\n")
+    assert vtt_to_srt("WEBVTT\n") == ""
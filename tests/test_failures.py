@@ -0,0 +1,103 @@
+import os
+import logging
+import threading
+import pytest
+import main
+
+LECTURE = {'_class': 'lecture', 'id': 7, 'title': "Broken Lecture", 'supplementary_assets': []}
+LECTURE_INFO = {'id': 7, 'asset': {'id': 70, 'asset_type': 'Video', 'captions': [],
+                                   'media_sources': [{'type': 'video/mp4', 'src': "https://example.invalid/7.mp4"}]}}
+
+@pytest.fixture
+def udemy(tmp_path, monkeypatch):
+    settings = {
+        'status_output': str(tmp_path / "status.jsonl"), 'content_store': None, 'adaptive_concurrency': False,
+        'max_concurrent_lectures': 2, 'max_metadata_jobs': 2, 'max_tool_jobs': 1, 'max_render_jobs': 1, 'chapter_filter': None,
+        'skip_quizzes': False, 'skip_lectures': False, 'skip_articles': False, 'skip_captions': True, 'skip_assets': True,
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(main, name, value, raising=False)
+
+    # No session or cookies are needed when nothing goes over the network
+    udemy = main.Udemy.__new__(main.Udemy)
+    monkeypatch.setattr(udemy, 'fetch_lecture_info', lambda course, lecture_id: LECTURE_INFO, raising=False)
+    return udemy
+
+def course(tmp_path):
+    return {'id': 1, 'title': "Course", 'portal_name': "www", 'dir': str(tmp_path / "course"),
+            'curriculum': [{'id': 1, 'title': "Chapter", 'is_published': True, 'children': [dict(LECTURE)]}]}
+
+def failing_lecture(*args):
+    raise RuntimeError("ffmpeg exited with 1")
+
+@pytest.mark.parametrize("download_lecture, kind", [
+    # A download function that logs its own error and returns None, like a failed remux
+    (lambda *args: None, "error"),
+    (failing_lecture, "error"),
+])
+def test_failed_job_is_reported(udemy, tmp_path, monkeypatch, caplog, download_lecture, kind):
+    monkeypatch.setattr(udemy, 'download_lecture', download_lecture, raising=False)
+
+    with caplog.at_level(logging.INFO, logger="udemy-dl"):
+        udemy.download_courses([course(tmp_path)])
+
+    assert udemy.failures == [(kind, "Broken Lecture")]
+    assert "1 item(s) failed" in caplog.text
+    assert "successfully downloaded" not in caplog.text
+
+def test_failed_caption_keeps_the_lecture(udemy, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'skip_captions', False)
+    monkeypatch.setattr(main, 'captions', ['en_US', 'fr_FR'], raising=False)
+    monkeypatch.setattr(main, 'convert_to_srt', False, raising=False)
+    info = {'id': 7, 'asset': dict(LECTURE_INFO['asset'], captions=[
+        {'locale_id': 'en_US'}, {'locale_id': 'fr_FR'}])}
+    monkeypatch.setattr(udemy, 'fetch_lecture_info', lambda course, lecture_id: info, raising=False)
+
+    def download_caption(caption, *args):
+        if caption['locale_id'] == 'fr_FR':
+            raise main.NotFoundError("404")
+    monkeypatch.setattr(main, 'download_caption', download_caption)
+
+    def download_lecture(course, lecture, lect_info, temp_folder_path, lindex, folder_path, *args):
+        output = os.path.join(folder_path, "01. Broken Lecture.mp4")
+        with open(output, 'wb') as f:
+            f.write(b"video")
+        return output
+    monkeypatch.setattr(udemy, 'download_lecture', download_lecture, raising=False)
+
+    test_course = course(tmp_path)
+    udemy.download_courses([test_course])
+
+    assert udemy.failures == [("not found", "Broken Lecture")]
+    entry = test_course['journal'].entries["lecture-7"]
+    assert entry['status'] == 'done'
+    assert entry['extras'] == {'captions': ['en_US']}
+    # The next run only fetches the caption that failed
+    assert test_course['journal'].missing_extras("lecture-7", {'captions': ['en_US', 'fr_FR']}) == {'captions': ['fr_FR']}
+
+def test_skipped_articles_are_not_failures(udemy, tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(main, 'skip_articles', True, raising=False)
+    article = {'_class': 'lecture', 'id': 8, 'title': "Art", 'supplementary_assets': [],
+               'asset': {'id': 80, 'asset_type': 'Article'}}
+    test_course = course(tmp_path)
+    test_course['curriculum'][0]['children'] = [article]
+
+    with caplog.at_level(logging.INFO, logger="udemy-dl"):
+        udemy.download_courses([test_course])
+
+    assert udemy.failures == []
+    assert "successfully downloaded" in caplog.text
+
+def test_items_are_journaled_on_the_render_lane(udemy, tmp_path, monkeypatch):
+    threads = []
+    finish_item = udemy.finish_item
+
+    def record_thread(item):
+        threads.append(threading.current_thread().name)
+        finish_item(item)
+    monkeypatch.setattr(udemy, 'finish_item', record_thread, raising=False)
+    monkeypatch.setattr(udemy, 'download_lecture', lambda *args: None, raising=False)
+
+    udemy.download_courses([course(tmp_path)])
+
+    assert len(threads) == 1 and threads[0].startswith("udm-render")
@@ -0,0 +1,15 @@
+from utils.journal import DownloadJournal
+
+def test_extras_asked_for_later_are_missing(tmp_path):
+    output = tmp_path / "01. Lecture.mp4"
+    output.write_bytes(b"video")
+    journal = DownloadJournal(str(tmp_path))
+    journal.record("lecture-1", 'done', [str(output)], extras={'captions': ['en_US']})
+
+    assert journal.missing_extras("lecture-1", {'captions': ['en_US']}) == {}
+    assert journal.missing_extras("lecture-1", {'captions': ['en_US', 'fr_FR'], 'assets': True}) == {'captions': ['fr_FR'], 'assets': True}
+
+    journal.record_extras("lecture-1", {'captions': ['fr_FR'], 'assets': True})
+    reopened = DownloadJournal(str(tmp_path))
+    assert reopened.intact_outputs("lecture-1") == [str(output)]
+    assert reopened.missing_extras("lecture-1", {'captions': ['en_US', 'fr_FR'], 'assets': True}) == {}
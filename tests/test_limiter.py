@@ -0,0 +1,113 @@
+import time
+import pytest
+from utils import limiter as limiter_module
+from utils.limiter import AdaptiveLimiter, BandwidthLimiter, LATENCY_FLOOR_WINDOWS, MIN_CHILD_RATE, parse_rate_schedule
+
+def advance(limiter, units, latency=None):
+    """Feed one window's worth of latency samples and re-evaluate the limit at its end."""
+    if latency is not None:
+        for _ in range(20):
+            limiter.observe_latency(latency)
+    # Move the clock on by a window without sleeping
+    limiter.window_start -= limiter.window
+    limiter.throttled_at -= limiter.window
+    limiter.tick(units)
+
+def test_fast_start_does_not_walk_the_limit_down():
+    limiter = AdaptiveLimiter(4, maximum=16)
+    units = 0
+    for _ in range(3):
+        units += 100
+        advance(limiter, units, latency=0.03)
+
+    # Transfers are five times slower than the startup API calls, but throughput keeps rising
+    step = 100
+    for _ in range(15):
+        step *= 1.1
+        units += step
+        advance(limiter, units, latency=0.15)
+    assert limiter.limit == 16
+
+def test_latency_backoff_needs_a_throughput_drop():
+    limiter = AdaptiveLimiter(8, maximum=8)
+    units = 0
+    for _ in range(3):
+        units += 100
+        advance(limiter, units, latency=0.03)
+    limit = limiter.limit
+
+    units += 50
+    advance(limiter, units, latency=0.5)
+    assert limiter.limit == limit - 1
+
+def test_latency_floor_ages_out():
+    limiter = AdaptiveLimiter(8, maximum=8)
+    units = 0
+    advance(limiter, units, latency=0.03)
+    for _ in range(LATENCY_FLOOR_WINDOWS + 5):
+        units += 100
+        advance(limiter, units, latency=0.15)
+    assert not limiter.latency_rising()
+
+def test_recovers_to_the_maximum_after_a_throttle():
+    limiter = AdaptiveLimiter(8, maximum=8)
+    limiter.throttle()
+    assert limiter.limit == 4
+
+    # Flat throughput, as when the lane is bound by how much work there is
+    units = 0
+    for _ in range(8):
+        units += 100
+        advance(limiter, units)
+    assert limiter.limit == 8
+
+def test_throttle_during_recovery_keeps_the_original_target():
+    limiter = AdaptiveLimiter(16, maximum=16)
+    limiter.throttle()
+    units = 100
+    advance(limiter, units)
+    units += 100
+    advance(limiter, units)
+
+    limiter.throttle()
+    for _ in range(20):
+        units += 100
+        advance(limiter, units)
+    assert limiter.limit == 16
+
+@pytest.mark.parametrize("spec", ["fast", "5X", "08:00=1M,2M", "25:00=1M", "08:60=1M", "8=1M", "08:00=lots"])
+def test_invalid_rate_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_rate_schedule(spec)
+
+def test_rate_specs():
+    assert parse_rate_schedule("500K") == [(0, 500 * 1024)]
+    assert parse_rate_schedule("off") == [(0, None)]
+    assert parse_rate_schedule("19:00=off, 08:00=1.5M") == [(8 * 60, 1536 * 1024), (19 * 60, None)]
+
+@pytest.mark.parametrize("hour, rate", [(7, 256 * 1024), (8, None), (21, 256 * 1024), (23, 256 * 1024)])
+def test_schedule_wraps_past_midnight(monkeypatch, hour, rate):
+    bandwidth = BandwidthLimiter()
+    # Capped overnight, from 21:00 until 08:00 the next morning
+    bandwidth.set_schedule(parse_rate_schedule("08:00=off,21:00=256K"))
+    monkeypatch.setattr(limiter_module.time, 'localtime', lambda: time.struct_time((2026, 10, 17, hour, 30, 0, 5, 290, -1)))
+
+    assert bandwidth.scheduled_rate() == rate
+
+def test_child_shares_are_reserved_and_released():
+    bandwidth = BandwidthLimiter()
+    bandwidth.set_schedule(parse_rate_schedule("1M"))
+
+    first = bandwidth.reserve_child()
+    second = bandwidth.reserve_child()
+    assert MIN_CHILD_RATE <= second <= first <= 512 * 1024
+    assert bandwidth.in_process_rate() == 1024 * 1024 - first - second
+
+    bandwidth.release_child(first)
+    bandwidth.release_child(second)
+    assert bandwidth.children == []
+    assert bandwidth.in_process_rate() == 1024 * 1024
+
+    bandwidth.set_schedule(parse_rate_schedule("off"))
+    assert bandwidth.reserve_child() is None
+    bandwidth.release_child(None)
@@ -0,0 +1,21 @@
+import json
+import pytest
+import main
+from utils.progress import ProgressHub
+
+def test_progress_hub_needs_log_and_publish():
+    with pytest.raises(TypeError):
+        ProgressHub()
+
+def test_tree_stays_out_of_the_status_stream(run_main, tmp_path, monkeypatch, capsys):
+    curriculum = [{'id': 1, 'title': "Chapter", 'is_published': True, 'children': []}]
+    monkeypatch.setattr(main.Udemy, 'open_course', lambda self, entry, refresh=False: {'id': "123", 'portal_name': "www", 'title': "Python", 'dir': str(tmp_path)})
+    monkeypatch.setattr(main.Udemy, 'fetch_course_curriculum', lambda self, *args, **kwargs: curriculum)
+    monkeypatch.setattr(main.Udemy, 'download_courses', lambda self, courses: print(json.dumps({'items_done': 0})))
+    monkeypatch.setattr(main.metrics, 'report', lambda: [])
+
+    run_main("--id", "123", "--tree", "--no-tui")
+
+    captured = capsys.readouterr()
+    assert "Chapter" in captured.err
+    assert all(json.loads(line) for line in captured.out.splitlines())
@@ -0,0 +1,26 @@
+import threading
+from utils.scheduler import Scheduler, Handoff
+
+def test_handoff_frees_the_slot_and_continues_on_the_other_lane():
+    scheduler = Scheduler()
+    scheduler.add_lane("transfer", 1)
+    scheduler.add_lane("tools", 1)
+    lanes = []
+    results = []
+
+    def merge(name):
+        lanes.append((name, threading.current_thread().name))
+        return f"{name}.mp4"
+
+    def download(name):
+        lanes.append((name, threading.current_thread().name))
+        return Handoff("tools", merge, name)
+
+    for name in ("a", "b"):
+        scheduler.submit("transfer", download, name, callback=lambda future: results.append(future.result()))
+    scheduler.run()
+    scheduler.shutdown()
+
+    assert sorted(results) == ["a.mp4", "b.mp4"]
+    assert [thread.split("_")[0] for _, thread in lanes].count("udm-tools") == 2
+    assert scheduler.lanes["transfer"].active == scheduler.lanes["tools"].active == 0
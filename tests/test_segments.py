@@ -0,0 +1,25 @@
+import pytest
+from requests.exceptions import ConnectionError, ReadTimeout
+from utils import process_m3u8
+
+class BrokenBody:
+    status_code = 200
+
+    def __init__(self, error):
+        self.error = error
+
+    @property
+    def content(self):
+        raise self.error
+
+class Body:
+    status_code = 200
+    content = b"segment"
+
+@pytest.mark.parametrize("error", [ConnectionError("reset by peer"), ReadTimeout("stalled")])
+def test_body_read_errors_are_retried(monkeypatch, error):
+    responses = [BrokenBody(error), Body()]
+    monkeypatch.setattr(process_m3u8, 'fetch', lambda url, headers: responses.pop(0))
+    monkeypatch.setattr(process_m3u8.time, 'sleep', lambda seconds: None)
+
+    assert process_m3u8.fetch_segment("https://cdn.example/segment-1.ts") == b"segment"
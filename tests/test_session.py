@@ -0,0 +1,43 @@
+import pytest
+from utils import session
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def get(self, url, **kwargs):
+        return self.responses.pop(0)
+
+@pytest.mark.parametrize("retry_after", ["0", "Wed, 21 Oct 2015 07:28:00 GMT"])
+def test_retry_after_in_the_past_still_backs_off(monkeypatch, retry_after):
+    sleeps = []
+    monkeypatch.setattr(session.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(session, '_session', FakeSession([FakeResponse(429, {'Retry-After': retry_after}), FakeResponse(200)]))
+
+    assert session.fetch("https://www.udemy.com/api-2.0/courses/1/").status_code == 200
+    assert sleeps and sleeps[0] >= session.BACKOFF_BASE * 0.5
+
+def test_fetch_pages_keeps_page_order():
+    requested = []
+
+    def fetch_page(url):
+        requested.append(url)
+        page = int(url.rsplit("page=", 1)[1]) if "page=" in url else 1
+        # The last page is short
+        results = list(range((page - 1) * 2, min(page * 2, 5)))
+        return {'count': 5, 'next': "more" if page < 3 else None, 'results': results}
+
+    progress = []
+    results = session.fetch_pages(fetch_page, "https://example.invalid/items/?page_size=2", 4, lambda count, fetched: progress.append((count, fetched)))
+
+    assert results == [0, 1, 2, 3, 4]
+    assert len(requested) == 3
+    assert progress[0] == (5, 2) and progress[-1] == (5, 5)
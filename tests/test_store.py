@@ -0,0 +1,53 @@
+import os
+import errno
+from utils.store import ContentStore, asset_key
+
+def objects(store):
+    return [name for _, _, files in os.walk(os.path.join(store.root, "objects")) for name in files]
+
+def test_add_lookup_and_materialize(tmp_path):
+    store = ContentStore(str(tmp_path / "store"))
+    output = tmp_path / "course-a" / "01. Intro.mp4"
+    output.parent.mkdir()
+    output.write_bytes(b"video")
+
+    store.add(str(output), [asset_key(7)])
+    entry = store.lookup(asset_key(7))
+    assert entry['size'] == 5 and entry['ext'] == ".mp4"
+    assert store.lookup(asset_key(8)) is None
+
+    # A reopened store reads the index back
+    linked = tmp_path / "course-b.mp4"
+    ContentStore(store.root).materialize(entry, str(linked))
+    assert linked.read_bytes() == b"video" and os.path.samefile(linked, output)
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = ContentStore(str(tmp_path / "store"))
+    first, second = tmp_path / "a.pdf", tmp_path / "b.pdf"
+    first.write_bytes(b"workbook")
+    second.write_bytes(b"workbook")
+
+    store.add(str(first), [asset_key(1)])
+    store.add(str(second), [asset_key(2)])
+    store.add(str(second), [asset_key(2)])
+
+    assert len(objects(store)) == 1
+    assert os.path.samefile(first, second)
+    assert store.lookup(asset_key(1))['sha256'] == store.lookup(asset_key(2))['sha256']
+
+def test_copies_where_hardlinks_fail(tmp_path, monkeypatch):
+    def cross_device(source, target):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(os, 'link', cross_device)
+
+    store = ContentStore(str(tmp_path / "store"))
+    output = tmp_path / "a.mp4"
+    output.write_bytes(b"video")
+
+    store.add(str(output), [asset_key(7)])
+    copy = tmp_path / "b.mp4"
+    store.materialize(store.lookup(asset_key(7)), str(copy))
+
+    assert len(objects(store)) == 1
+    assert copy.read_bytes() == b"video" and not os.path.samefile(copy, output)
+    assert not (tmp_path / "b.mp4.part").exists()
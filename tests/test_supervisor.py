@@ -0,0 +1,28 @@
+import sys
+import time
+from utils import supervisor
+from utils.limiter import bandwidth
+
+class Progress:
+    def __init__(self):
+        self.completed = []
+
+    def update(self, task_id, completed=None, **kwargs):
+        self.completed.append(completed)
+
+def test_segment_downloader_follows_progress_and_hands_back_its_share():
+    bandwidth.set_schedule([(0, 1024 * 1024)])
+    try:
+        progress = Progress()
+        child = [sys.executable, "-c", "print('Vid 1280x720 10.00% 1MB'); print('Vid 1280x720 99.50% 9MB')"]
+        result = supervisor.spawn_segment_downloader(child, "task", progress, ceiling=99).result(timeout=10)
+    finally:
+        bandwidth.set_schedule([])
+
+    assert result.returncode == 0
+    assert progress.completed[-1] == 99
+    # The share is handed back from the Future's done callback, right after the result is set
+    deadline = time.monotonic() + 5
+    while bandwidth.children and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert bandwidth.children == []
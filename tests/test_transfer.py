@@ -0,0 +1,90 @@
+import io
+import pytest
+from requests.exceptions import ChunkedEncodingError
+from utils import transfer
+
+class FakeRaw:
+    def __init__(self, data, error=None):
+        self.stream = io.BytesIO(data)
+        self.error = error
+        self.decode_content = False
+
+    def readinto(self, view):
+        length = self.stream.readinto(view)
+        if not length and self.error is not None:
+            raise self.error
+        return length
+
+class FakeResponse:
+    url = "https://cdn.example/file.zip"
+
+    def __init__(self, status_code, body=b"", headers=None, error=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.raw = FakeRaw(body, error)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def server(monkeypatch):
+    """Answers download_file's requests from a list of responses and keeps the headers it was sent."""
+    requests = []
+    responses = []
+
+    def fetch(url, stream=False, headers=None):
+        requests.append(headers)
+        return responses.pop(0)
+    monkeypatch.setattr(transfer, 'fetch', fetch)
+    return requests, responses
+
+def test_resumes_from_a_part_file(server, tmp_path):
+    requests, responses = server
+    output = tmp_path / "file.zip"
+    (tmp_path / "file.zip.part").write_bytes(b"hello ")
+    (tmp_path / "file.zip.part.etag").write_text('"v1"', encoding='utf-8')
+    responses.append(FakeResponse(206, b"world", {'Content-Range': "bytes 6-10/11", 'ETag': '"v1"'}))
+
+    assert transfer.download_file("https://cdn.example/file.zip", str(output)) == str(output)
+
+    assert requests[0]['Range'] == "bytes=6-" and requests[0]['If-Range'] == '"v1"'
+    assert output.read_bytes() == b"hello world"
+    assert not (tmp_path / "file.zip.part").exists() and not (tmp_path / "file.zip.part.etag").exists()
+
+def test_changed_file_restarts_from_zero(server, tmp_path):
+    requests, responses = server
+    output = tmp_path / "file.zip"
+    (tmp_path / "file.zip.part").write_bytes(b"stale data")
+    (tmp_path / "file.zip.part.etag").write_text('"v1"', encoding='utf-8')
+    # If-Range no longer matches, so the server sends the whole new file
+    responses.append(FakeResponse(200, b"hello world", {'Content-Length': "11", 'ETag': '"v2"'}))
+
+    transfer.download_file("https://cdn.example/file.zip", str(output))
+
+    assert requests[0]['If-Range'] == '"v1"'
+    assert output.read_bytes() == b"hello world"
+
+def test_unsatisfiable_range_restarts(server, tmp_path):
+    requests, responses = server
+    output = tmp_path / "file.zip"
+    (tmp_path / "file.zip.part").write_bytes(b"longer than the file on the server")
+    responses.extend([FakeResponse(416), FakeResponse(200, b"hello world", {'Content-Length': "11"})])
+
+    transfer.download_file("https://cdn.example/file.zip", str(output))
+
+    assert 'Range' in requests[0] and 'Range' not in requests[1]
+    assert output.read_bytes() == b"hello world"
+
+@pytest.mark.parametrize("error", [None, ChunkedEncodingError("connection broken")])
+def test_truncated_body_is_resumed(server, tmp_path, error):
+    requests, responses = server
+    output = tmp_path / "file.zip"
+    responses.extend([
+        FakeResponse(200, b"hello ", {'Content-Length': "11", 'ETag': '"v1"'}, error),
+        FakeResponse(206, b"world", {'Content-Range': "bytes 6-10/11", 'ETag': '"v1"'}),
+    ])
+
+    transfer.download_file("https://cdn.example/file.zip", str(output))
+
+    assert requests[1]['Range'] == "bytes=6-" and requests[1]['If-Range'] == '"v1"'
+    assert output.read_bytes() == b"hello world"
@@ -0,0 +1,32 @@
+import os
+import json
+import time
+import threading
+from constants import CACHE_DIR, logger
+
+def _cache_path(namespace, key):
+    return os.path.join(CACHE_DIR, namespace, f"{key}.json")
+
+def read_cache(namespace, key, max_age=None):
+    """Return the cached value for `key`, or None when it is missing, unreadable or older than `max_age` seconds."""
+    path = _cache_path(namespace, key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if max_age is not None and time.time() - entry.get('cached_at', 0) > max_age:
+        return None
+    return entry.get('value')
+
+def write_cache(namespace, key, value):
+    path = _cache_path(namespace, key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'cached_at': time.time(), 'value': value}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write {namespace} cache: {e}")
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from constants import logger
+
+JOURNAL_FILENAME = ".download-journal.jsonl"
+
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+class DownloadJournal:
+    """
+    Append-only record of finished items, kept as JSON lines in the course directory.
+
+    The last line for a key wins, so re-running a course only ever appends.
+    Output paths are stored relative to the course directory.
+    """
+    def __init__(self, course_dir):
+        self.course_dir = course_dir
+        self.path = os.path.join(course_dir, JOURNAL_FILENAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave a torn last line behind
+                        continue
+                    self.entries[entry['key']] = entry
+
+    def intact_outputs(self, key):
+        """Paths of the item's outputs if it finished earlier and all of them are still on disk with the recorded size, else None."""
+        entry = self.entries.get(key)
+        if entry is None or entry['status'] != 'done':
+            return None
+
+        paths = []
+        for output in entry['outputs']:
+            path = os.path.join(self.course_dir, output['path'])
+            try:
+                if os.path.getsize(path) != output['size']:
+                    return None
+            except OSError:
+                return None
+            paths.append(path)
+        return paths
+
+    def missing_extras(self, key, extras):
+        """
+        The part of `extras` the item's entry doesn't cover yet.
+
+        Extras are what was asked for on top of the main output, like
+        {'captions': ['en_US'], 'assets': True}. A list is covered by a
+        recorded list holding all of its values, anything else by an equal value.
+        """
+        recorded = self.entries.get(key, {}).get('extras', {})
+        missing = {}
+        for name, value in extras.items():
+            have = recorded.get(name)
+            if isinstance(value, list):
+                wanted = [item for item in value if item not in (have or ())]
+                if wanted:
+                    missing[name] = wanted
+            elif have != value:
+                missing[name] = value
+        return missing
+
+    def record(self, key, status, outputs=(), error=None, extras=None):
+        """Append an entry for `key` and return it, with the size and sha256 of every output."""
+        entry = {'key': key, 'status': status, 'time': int(time.time()), 'outputs': []}
+        if error is not None:
+            entry['error'] = str(error)
+        if extras:
+            entry['extras'] = extras
+
+        for output in outputs:
+            entry['outputs'].append({
+                'path': os.path.relpath(output, self.course_dir),
+                'size': os.path.getsize(output),
+                'sha256': file_checksum(output),
+            })
+
+        self._append(entry)
+        return entry
+
+    def record_extras(self, key, extras):
+        """Add `extras` to a finished item whose outputs were kept from an earlier run, without hashing them again."""
+        previous = self.entries[key]
+        merged = dict(previous.get('extras', {}))
+        for name, value in extras.items():
+            merged[name] = sorted(set(merged.get(name) or ()) | set(value)) if isinstance(value, list) else value
+
+        entry = {**previous, 'time': int(time.time()), 'extras': merged}
+        self._append(entry)
+        return entry
+
+    def _append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self.lock:
+            self.entries[entry['key']] = entry
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning(f"Could not update the download journal: {e}")
@@ -0,0 +1,295 @@
+import re
+import time
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Udemy and its CDN answer with these when we are going too fast
+THROTTLE_STATUS_CODES = (429, 503)
+
+class ThroughputMeter:
+    """Cumulative byte counter shared by every in-process transfer."""
+    def __init__(self):
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def record(self, nbytes):
+        with self.lock:
+            self.total += nbytes
+
+transfer_meter = ThroughputMeter()
+
+# How many seconds' worth of bytes may be sent in one burst under --max-rate
+BURST_SECONDS = 1.0
+# In-process transfers keep at least this share of the rate, however many children hold theirs
+MIN_IN_PROCESS_SHARE = 0.1
+MIN_CHILD_RATE = 16 * 1024
+
+RATE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMG]?)(?:I?B)?(?:/S)?$')
+UNLIMITED_RATES = ("0", "OFF", "NONE", "UNLIMITED")
+
+def parse_rate(value):
+    """Parse a bytes/sec rate like "500K" or "2.5M" (binary units). 0, "off" or "unlimited" mean no cap (None)."""
+    text = value.strip()
+    value = text.upper()
+    if value in UNLIMITED_RATES:
+        return None
+    match = RATE_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Invalid rate {text!r}, expected something like 500K or 2M")
+    rate = float(match.group(1)) * 1024 ** " KMG".index(match.group(2) or " ")
+    return int(rate) or None
+
+def parse_rate_schedule(text):
+    """
+    Parse --max-rate: a single rate, or "HH:MM=RATE" entries separated by commas.
+
+    Each entry applies from its time of day until the next one, wrapping
+    around midnight, so "08:00=1M,19:00=off" caps the day and runs free at
+    night. Returns a list of (minute of day, rate or None), sorted by time.
+    """
+    entries = []
+    for part in text.split(','):
+        if '=' not in part:
+            if len(text.split(',')) > 1:
+                raise ValueError(f"Schedule entry {part.strip()!r} needs a time, like 08:00=1M")
+            return [(0, parse_rate(part))]
+        start, rate = part.split('=', 1)
+        try:
+            hours, minutes = (int(number) for number in start.strip().split(':'))
+        except ValueError:
+            raise ValueError(f"Invalid time {start.strip()!r}, expected HH:MM") from None
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            raise ValueError(f"Invalid time {start.strip()!r}, expected HH:MM")
+        entries.append((hours * 60 + minutes, parse_rate(rate)))
+    return sorted(entries)
+
+class BandwidthLimiter:
+    """
+    Token bucket capping the bytes/sec of every transfer, in this process and in child downloaders.
+
+    The cap follows a time-of-day schedule. Each n_m3u8dl-re child is given a
+    share of it when it starts (`reserve_child`). A running child can't be
+    re-tuned, so rebalancing happens around the children: the in-process
+    transfers get whatever the children don't hold, and grow back as
+    children exit. Later children get a fair share of what is left.
+    """
+    def __init__(self):
+        self.schedule = []
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.children = []
+
+    def set_schedule(self, schedule):
+        with self.lock:
+            self.schedule = [] if all(rate is None for _, rate in schedule) else schedule
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
+    def scheduled_rate(self):
+        """The cap in effect right now, or None when transfers run free."""
+        if not self.schedule:
+            return None
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        # The last entry of the day is still in effect until the first one of the next
+        rate = self.schedule[-1][1]
+        for start, entry_rate in self.schedule:
+            if start > minute:
+                break
+            rate = entry_rate
+        return rate
+
+    def in_process_rate(self):
+        total = self.scheduled_rate()
+        if total is None:
+            return None
+        return max(total - sum(self.children), total * MIN_IN_PROCESS_SHARE)
+
+    def read_size(self, chunk_size):
+        """How much to read at once, so a low cap is a steady trickle rather than a big read and a long sleep."""
+        rate = self.in_process_rate()
+        if rate is None:
+            return chunk_size
+        return max(16 * 1024, min(chunk_size, int(rate / 8)))
+
+    def consume(self, nbytes):
+        """Account for `nbytes` just transferred, sleeping for as long as that overdraws the bucket."""
+        if not self.schedule:
+            return
+        with self.lock:
+            rate = self.in_process_rate()
+            if rate is None:
+                return
+            now = time.monotonic()
+            self.tokens = min(rate * BURST_SECONDS, self.tokens + (now - self.updated) * rate) - nbytes
+            self.updated = now
+            delay = -self.tokens / rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def reserve_child(self):
+        """Set aside a share of the rate for a child downloader. Returns bytes/sec, or None when there is no cap."""
+        with self.lock:
+            total = self.scheduled_rate()
+            if total is None:
+                return None
+            # Fair share among the children and the in-process transfers, but never more than half of what's left
+            fair = total / (len(self.children) + 2)
+            share = max(MIN_CHILD_RATE, int(min(fair, (total - sum(self.children)) / 2)))
+            self.children.append(share)
+            return share
+
+    def release_child(self, share):
+        if share is None:
+            return
+        with self.lock:
+            self.children.remove(share)
+
+bandwidth = BandwidthLimiter()
+
+# Request latency is compared against the lowest average seen in this many recent windows,
+# so a fast phase (the first API calls, say) ages out instead of setting the bar for good
+LATENCY_FLOOR_WINDOWS = 6
+LATENCY_BACKOFF_FACTOR = 3
+
+_limiters = []
+_lock = threading.Lock()
+_resume_at = 0.0
+# The limiter of the lane the current worker thread belongs to, if any
+_current = threading.local()
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit.
+
+    The limit is halved whenever the server throttles us, then climbs back
+    by one slot per quiet window to where it was. Beyond that it is probed
+    upwards by one slot per window for as long as the measured
+    throughput keeps improving, and stepped back when throughput dropped
+    after a probe, or dropped while the lane's own request latency climbed
+    well above its recent floor.
+    """
+    def __init__(self, initial, minimum=1, maximum=25, window=5.0):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.limit = max(minimum, min(initial, self.maximum))
+        self.window = window
+        self.lock = threading.Lock()
+
+        self.window_start = time.monotonic()
+        self.window_units = 0
+        self.last_rate = None
+        self.last_step = 0
+        self.throttled_at = 0.0
+        # The limit before the last throttle, which it is restored to one slot per window
+        self.recover_to = None
+
+        self.latency_ewma = None
+        self.window_latency = None
+        self.latency_minima = deque(maxlen=LATENCY_FLOOR_WINDOWS)
+
+        with _lock:
+            _limiters.append(self)
+
+    def throttle(self):
+        now = time.monotonic()
+        with self.lock:
+            # One decrease per window, a burst of 429s is a single congestion event
+            if now - self.throttled_at < self.window:
+                return
+            self.throttled_at = now
+            self.recover_to = max(self.limit, self.recover_to or 0)
+            self.limit = max(self.minimum, self.limit // 2)
+            self.last_step = -1
+
+    def observe_latency(self, seconds):
+        with self.lock:
+            self.latency_ewma = seconds if self.latency_ewma is None else self.latency_ewma * 0.8 + seconds * 0.2
+            self.window_latency = self.latency_ewma if self.window_latency is None else min(self.window_latency, self.latency_ewma)
+
+    def latency_rising(self):
+        return bool(self.latency_minima) and self.latency_ewma > min(self.latency_minima) * LATENCY_BACKOFF_FACTOR
+
+    def tick(self, units):
+        """Re-evaluate the limit given the lane's cumulative work counter."""
+        now = time.monotonic()
+        with self.lock:
+            elapsed = now - self.window_start
+            if elapsed < self.window:
+                return
+            rate = (units - self.window_units) / elapsed
+
+            if self.window_latency is not None:
+                self.latency_minima.append(self.window_latency)
+                self.window_latency = None
+            # Slower requests alone are no reason to back off while more work is getting done
+            slower = self.last_rate and rate < self.last_rate * 0.9
+
+            if self.throttled_at >= self.window_start:
+                pass
+            elif self.recover_to is not None and self.limit < self.recover_to:
+                # Additive increase after a throttle doesn't wait for throughput to improve,
+                # which it may not do while the lane is short of slots
+                self.limit += 1
+                self.last_step = 0
+            elif rate > 0 and (self.last_rate is None or rate > self.last_rate * 1.05):
+                if self.limit < self.maximum:
+                    self.limit += 1
+                    self.last_step = 1
+            elif slower and (self.last_step > 0 or self.latency_rising()):
+                self.limit = max(self.minimum, self.limit - 1)
+                self.last_step = -1
+            else:
+                self.last_step = 0
+
+            if self.recover_to is not None and self.limit >= self.recover_to:
+                self.recover_to = None
+            self.last_rate = rate
+            self.window_start = now
+            self.window_units = units
+
+def report_throttle(retry_after=None):
+    """Back every limiter off and pause new requests for `retry_after` seconds."""
+    global _resume_at
+    with _lock:
+        limiters = list(_limiters)
+        if retry_after:
+            _resume_at = max(_resume_at, time.monotonic() + retry_after)
+
+    for limiter in limiters:
+        limiter.throttle()
+
+def bind_limiter(limiter):
+    """Attribute the latency of requests made on this thread to `limiter`. Used as the lane executors' initializer."""
+    _current.limiter = limiter
+
+def report_latency(seconds):
+    # API calls and CDN transfers run on different lanes, each limiter only hears about its own
+    limiter = getattr(_current, 'limiter', None)
+    if limiter is not None:
+        limiter.observe_latency(seconds)
+
+def wait_for_resume():
+    """Sleep while a Retry-After pause is in effect."""
+    delay = _resume_at - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, in delta-seconds or as an HTTP date. None if missing or malformed."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
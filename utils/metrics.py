@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Work done outside of any item (the curriculum, say) is counted under this kind
+DEFAULT_KIND = "Other"
+
+_context = threading.local()
+
+def current_kind():
+    return getattr(_context, 'kind', DEFAULT_KIND)
+
+@contextmanager
+def tagged(kind):
+    """Attribute everything measured on this thread to `kind` until the block ends."""
+    previous = current_kind()
+    _context.kind = kind
+    try:
+        yield
+    finally:
+        _context.kind = previous
+
+class Metrics:
+    """
+    Time spent and bytes moved per stage, broken down by the kind of item they were spent on.
+
+    Stages are `metadata` (API calls), `queue_wait` (job submitted until a
+    worker picks it up), `run` (job start to finish, child processes
+    included), `transfer`, `write` and `tool:<name>` (child process
+    lifetime). Kinds are HLS, DASH, MP4, Article, File, Quiz, Caption and so
+    on. Recording is a dict update under a lock, done once per request,
+    file or job rather than per chunk.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.items = {}
+        self.started_at = time.time()
+        self.start_time = time.monotonic()
+
+    def observe(self, stage, seconds, nbytes=0, kind=None):
+        key = (stage, kind or current_kind())
+        with self.lock:
+            entry = self.stages.get(key)
+            if entry is None:
+                entry = self.stages[key] = {'count': 0, 'seconds': 0.0, 'max': 0.0, 'bytes': 0}
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['bytes'] += nbytes
+
+    @contextmanager
+    def timed(self, stage, kind=None):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time, kind=kind)
+
+    def item_finished(self, kind, failed=False):
+        with self.lock:
+            entry = self.items.setdefault(kind, {'done': 0, 'failed': 0})
+            entry['failed' if failed else 'done'] += 1
+
+    def summary(self):
+        with self.lock:
+            stages = {key: dict(entry) for key, entry in self.stages.items()}
+            items = {kind: dict(entry) for kind, entry in self.items.items()}
+
+        return {
+            'started_at': round(self.started_at, 3),
+            'elapsed': round(time.monotonic() - self.start_time, 3),
+            'items': items,
+            'stages': [{
+                'stage': stage,
+                'kind': kind,
+                'count': entry['count'],
+                'seconds': round(entry['seconds'], 6),
+                'mean_seconds': round(entry['seconds'] / entry['count'], 6),
+                'max_seconds': round(entry['max'], 6),
+                'bytes': entry['bytes'],
+                'bytes_per_sec': round(entry['bytes'] / entry['seconds']) if entry['bytes'] and entry['seconds'] else None,
+            } for (stage, kind), entry in sorted(stages.items())],
+        }
+
+    def report(self):
+        """One line per kind of item: how many, how many bytes at what rate, and where the time went."""
+        from utils.progress import format_bytes
+
+        summary = self.summary()
+        by_kind = {}
+        for stage in summary['stages']:
+            by_kind.setdefault(stage['kind'], {})[stage['stage']] = stage
+
+        lines = []
+        for kind in sorted(set(by_kind) | set(summary['items'])):
+            stages = by_kind.get(kind, {})
+            parts = []
+            # Some kinds only do work on behalf of others (lecture info, the curriculum) and finish no items
+            items = summary['items'].get(kind)
+            if items:
+                parts.append(f"{items['done']} done" + (f", {items['failed']} failed" if items['failed'] else ""))
+
+            transfer = stages.get('transfer')
+            if transfer and transfer['bytes']:
+                parts.append(f"{format_bytes(transfer['bytes'])} at {format_bytes(transfer['bytes_per_sec'] or 0)}/s")
+            for name in ('metadata', 'queue_wait', 'run'):
+                if name in stages:
+                    parts.append(f"{name.replace('_', ' ')} {stages[name]['mean_seconds']:.2f}s avg")
+            tools = sum(stage['seconds'] for name, stage in stages.items() if name.startswith('tool:'))
+            if tools:
+                parts.append(f"tools {tools:.1f}s")
+            if 'write' in stages:
+                parts.append(f"writes {stages['write']['seconds']:.1f}s")
+            lines.append(f"{kind}: {', '.join(parts)}")
+        return lines
+
+    def write_json(self, path):
+        _write_atomically(path, json.dumps(self.summary(), indent=2) + "\n")
+
+    def write_prometheus(self, path):
+        """Write the totals in the Prometheus text format, for node_exporter's textfile collector."""
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP udemy_dl_{name} {help_text}")
+            lines.append(f"# TYPE udemy_dl_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{label}="{_escape_label(str(text))}"' for label, text in labels.items())
+                lines.append(f"udemy_dl_{name}{{{label_text}}} {value}" if label_text else f"udemy_dl_{name} {value}")
+
+        stages = summary['stages']
+        metric("stage_seconds_total", "counter", "Seconds spent in each stage.",
+               [({'stage': s['stage'], 'kind': s['kind']}, s['seconds']) for s in stages])
+        metric("stage_count_total", "counter", "Times each stage ran.",
+               [({'stage': s['stage'], 'kind': s['kind']}, s['count']) for s in stages])
+        metric("stage_seconds_max", "gauge", "Longest single run of each stage.",
+               [({'stage': s['stage'], 'kind': s['kind']}, s['max_seconds']) for s in stages])
+        metric("stage_bytes_total", "counter", "Bytes moved by each stage.",
+               [({'stage': s['stage'], 'kind': s['kind']}, s['bytes']) for s in stages if s['bytes']])
+        metric("items_total", "counter", "Items finished, by kind and outcome.",
+               [({'kind': kind, 'status': status}, count) for kind, counts in sorted(summary['items'].items()) for status, count in counts.items()])
+        metric("run_duration_seconds", "gauge", "Wall time of the run.", [({}, summary['elapsed'])])
+        metric("run_started_timestamp_seconds", "gauge", "When the run started.", [({}, summary['started_at'])])
+
+        _write_atomically(path, "\n".join(lines) + "\n")
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _write_atomically(path, text):
+    # The textfile collector may read at any moment, never let it see half a file
+    part_file = f"{path}.{os.getpid()}.part"
+    with open(part_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(part_file, path)
+
+metrics = Metrics()
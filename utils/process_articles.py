@@ -1,17 +1,119 @@
 import os
+import re
 import shutil
 import json
-from urllib.parse import urlparse
+import logging
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse, quote
 from constants import ARTICLE_URL, logger
+from utils.transfer import download_file
+from utils.metrics import tagged
 
-def download_article(udemy, article, download_folder_path, title_of_output_article, task_id, progress, portal_name="www"):
+RESOURCE_WORKERS = 8
+
+# Tags whose resources are needed to render the article; links in <a> tags are left alone
+RESOURCE_TAG_PATTERN = re.compile(r'<(img|source|video|audio|link)\b[^>]*>', re.IGNORECASE)
+RESOURCE_ATTR_PATTERN = re.compile(r'\b(src|href|poster)\s*=\s*(["\'])((?:https?:)?//[^"\']+)\2', re.IGNORECASE)
+
+_resource_pool = None
+_resource_pool_lock = threading.Lock()
+
+def get_resource_pool():
+    global _resource_pool
+    with _resource_pool_lock:
+        if _resource_pool is None:
+            _resource_pool = ThreadPoolExecutor(max_workers=RESOURCE_WORKERS, thread_name_prefix="udm-resource")
+        return _resource_pool
+
+class MediaCache:
+    """
+    Per-course folder of the images and stylesheets articles refer to.
+
+    Every URL is fetched once, even when several articles ask for it at the
+    same time, and stored under a name derived from the URL. A failed fetch
+    is forgotten, so the next article that asks tries again.
+    """
+    def __init__(self, media_dir):
+        self.media_dir = media_dir
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def path_for(self, url):
+        extension = os.path.splitext(urlparse(url).path)[1][:8]
+        return os.path.join(self.media_dir, hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + extension)
+
+    def get(self, url):
+        """Return a Future for the local path of `url`."""
+        with self.lock:
+            future = self.files.get(url)
+            if future is not None:
+                return future
+            future = self.files[url] = Future()
+
+        path = self.path_for(url)
+        if os.path.isfile(path):
+            future.set_result(path)
+        else:
+            get_resource_pool().submit(self._fetch, url, path, future)
+        return future
+
+    def _fetch(self, url, path, future):
+        try:
+            os.makedirs(self.media_dir, exist_ok=True)
+            with tagged("Article"):
+                future.set_result(download_file(url, path))
+        except Exception as e:
+            with self.lock:
+                if self.files.get(url) is future:
+                    del self.files[url]
+            future.set_exception(e)
+
+def localize_resources(article_content, article_dir, media_cache):
+    """Fetch the images and stylesheets an article uses and point its links at the local copies."""
+    urls = set()
+    for tag in RESOURCE_TAG_PATTERN.finditer(article_content):
+        if tag.group(1).lower() == 'link' and 'stylesheet' not in tag.group(0).lower():
+            continue
+        for attr in RESOURCE_ATTR_PATTERN.finditer(tag.group(0)):
+            urls.add(attr.group(3))
+
+    if not urls:
+        return article_content
+
+    # Start every fetch before waiting on any of them
+    downloads = {url: media_cache.get(f"https:{url}" if url.startswith('//') else url) for url in urls}
+    local_paths = {}
+    for url, download in downloads.items():
+        try:
+            local_paths[url] = quote(os.path.relpath(download.result(), article_dir).replace(os.sep, '/'))
+        except Exception as e:
+            # Leave the remote URL in place, the article still works online
+            logger.warning(f"Could not fetch article resource {url}: {e}")
+
+    def rewrite_attr(attr):
+        local_path = local_paths.get(attr.group(3))
+        if local_path is None:
+            return attr.group(0)
+        return f"{attr.group(1)}={attr.group(2)}{local_path}{attr.group(2)}"
+
+    def rewrite_tag(tag):
+        if tag.group(1).lower() == 'link' and 'stylesheet' not in tag.group(0).lower():
+            return tag.group(0)
+        return RESOURCE_ATTR_PATTERN.sub(rewrite_attr, tag.group(0))
+
+    return RESOURCE_TAG_PATTERN.sub(rewrite_tag, article_content)
+
+def download_article(udemy, article, download_folder_path, title_of_output_article, task_id, progress, portal_name="www", media_cache=None):
     progress.update(task_id, description=f"Downloading Article {title_of_output_article}", completed=0)
 
     article_filename = f"{title_of_output_article}.html"
-    article_response = udemy.request(ARTICLE_URL.format(portal_name=portal_name, article_id=article['id'])).json()
+    article_response = udemy.request_json(ARTICLE_URL.format(portal_name=portal_name, article_id=article['id']))
     
-    # Debug the response structure
-    logger.debug(f"Article response: {json.dumps(article_response, indent=2)}")
+    # Debug the response structure, only serialized when someone is going to read it
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Article response: {json.dumps(article_response, indent=2)}")
     
     # Look for the body content in different possible fields
     article_content = None
@@ -28,10 +130,16 @@ def download_article(udemy, article, download_folder_path, title_of_output_artic
         shutil.rmtree(download_folder_path)
         return
 
-    with open(os.path.join(os.path.dirname(download_folder_path), article_filename), 'w', encoding='utf-8', errors='replace') as file:
+    article_path = os.path.join(os.path.dirname(download_folder_path), article_filename)
+    if media_cache is not None:
+        progress.update(task_id, description=f"Localizing Article {title_of_output_article}", completed=50)
+        article_content = localize_resources(article_content, os.path.dirname(article_path), media_cache)
+
+    with open(article_path, 'w', encoding='utf-8', errors='replace') as file:
         file.write(article_content)
 
     progress.console.log(f"[green]Downloaded {title_of_output_article}[/green] ✓")
     progress.remove_task(task_id)
 
-    shutil.rmtree(download_folder_path)
\ No newline at end of file
+    shutil.rmtree(download_folder_path)
+    return article_path
@@ -1,45 +1,123 @@
 import os
-from urllib.parse import urlparse
-from constants import LINK_ASSET_URL, FILE_ASSET_URL
-
-def download_supplementary_assets(udemy, assets, download_folder_path, course_id, lecture_id, portal_name="www"):
-    for asset in assets:
-        match asset['asset_type']:
-            case 'File':
-                process_files(udemy, asset, course_id, lecture_id, download_folder_path, portal_name)
-            case 'ExternalLink':
-                process_external_links(udemy, asset, course_id, lecture_id, download_folder_path, portal_name)
-            case _:
-                pass
-                # Unsupported asset type. Please create a github issue if you'd like to add support for other types
-
-def process_files(udemy, asset, course_id, lecture_id, download_folder_path, portal_name="www"):
+import threading
+from concurrent.futures import Future
+from constants import LINK_ASSET_URL, FILE_ASSET_URL, logger
+from utils.transfer import download_file, link_or_copy
+from utils.supervisor import then
+from utils.store import asset_key, file_key
+
+class AssetIndex:
+    """
+    Per-course record of the supplementary files already fetched, or being fetched.
+
+    Courses often attach the same workbook to dozens of lectures. Files are
+    keyed by asset id and, when the server sends a strong ETag, by filename,
+    size and ETag. The first lecture to claim a key downloads the file; every later
+    one gets the same Future and hardlinks the result.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def claim(self, key):
+        """Return (future, owner). The owner has to settle the future with the downloaded path."""
+        with self.lock:
+            future = self.files.get(key)
+            if future is not None:
+                return future, False
+            future = self.files[key] = Future()
+            return future, True
+
+    def alias(self, key, future):
+        """Point `key` at an existing download, unless it already has one of its own."""
+        with self.lock:
+            return self.files.setdefault(key, future)
+
+def process_files(udemy, asset, course_id, lecture_id, download_folder_path, portal_name="www", asset_index=None, store=None):
     assets_folder = os.path.join(download_folder_path, "assets")
     if not os.path.exists(assets_folder):
-        os.makedirs(assets_folder)
-    
+        os.makedirs(assets_folder, exist_ok=True)
+
     asset_file_path = os.path.join(assets_folder, asset['filename'])
 
-    file_response = udemy.request(udemy.request(FILE_ASSET_URL.format(portal_name=portal_name, course_id=course_id, lecture_id=lecture_id, asset_id=asset['id'])).json()['download_urls']['File'][0]['file'])
+    if store is not None:
+        stored = store.lookup(asset_key(asset['id']))
+        if stored is not None:
+            return store.materialize(stored, asset_file_path)
+
+    if asset_index is None:
+        asset_index = AssetIndex()
+
+    download, owner = asset_index.claim(('id', asset['id']))
+    if not owner:
+        return then(download, lambda source: link_or_copy(source, asset_file_path))
+
+    duplicate_of = None
+    stored = None
+    keys = [asset_key(asset['id'])]
+
+    def on_start(response, size):
+        nonlocal duplicate_of, stored
+        # Without a strong ETag, two different files that share a name and size can't be told apart
+        etag = response.headers.get('ETag')
+        if size is None or not etag or etag.startswith('W/'):
+            return True
+        key = file_key(asset['filename'], size, etag)
+        if store is not None:
+            stored = store.lookup(key)
+            if stored is not None:
+                return False
+            keys.append(key)
+
+        existing = asset_index.alias(key, download)
+        if existing is download:
+            return True
+        # Same file attached under another asset id, that download will do
+        duplicate_of = existing
+        return False
+
+    try:
+        output = fetch_file(udemy, asset, course_id, lecture_id, asset_file_path, portal_name, on_start)
+        if stored is not None:
+            output = store.materialize(stored, asset_file_path)
+            store.record(keys, stored)
+        elif duplicate_of is None and store is not None:
+            store.add(output, keys)
+    except Exception as e:
+        download.set_exception(e)
+        raise
+
+    if duplicate_of is not None:
+        logger.debug(f"{asset['filename']} is already being downloaded for another lecture, linking it")
+        duplicate_of.add_done_callback(lambda existing: _settle_from(download, existing))
+        return then(duplicate_of, lambda source: link_or_copy(source, asset_file_path))
+
+    download.set_result(output)
+    return output
+
+def _settle_from(future, source):
+    if source.exception() is not None:
+        future.set_exception(source.exception())
+    else:
+        future.set_result(source.result())
 
-    file_response.raise_for_status()
+def fetch_file(udemy, asset, course_id, lecture_id, asset_file_path, portal_name="www", on_start=None):
+    file_url = udemy.request_json(FILE_ASSET_URL.format(portal_name=portal_name, course_id=course_id, lecture_id=lecture_id, asset_id=asset['id']))['download_urls']['File'][0]['file']
 
-    with open(asset_file_path, 'wb') as file:
-        for chunk in file_response.iter_content(chunk_size=8192):
-            if chunk:
-                file.write(chunk)
+    return download_file(file_url, asset_file_path, on_start=on_start)
 
 def process_external_links(udemy, asset, course_id, lecture_id, download_folder_path, portal_name="www"):
     external_links_folder = os.path.join(download_folder_path, "external-links")
     if not os.path.exists(external_links_folder):
-        os.makedirs(external_links_folder)
+        os.makedirs(external_links_folder, exist_ok=True)
 
     asset_filename = f"{asset['filename']}.url"
     asset_file_path = os.path.join(external_links_folder, asset_filename)
 
-    response = udemy.request(LINK_ASSET_URL.format(portal_name=portal_name, course_id=course_id, lecture_id=lecture_id, asset_id=asset['id'])).json()
+    response = udemy.request_json(LINK_ASSET_URL.format(portal_name=portal_name, course_id=course_id, lecture_id=lecture_id, asset_id=asset['id']))
 
     asset_url = response['external_url']
 
     with open(asset_file_path, 'w') as file:
-        file.write(f"[InternetShortcut]\nURL={asset_url}\n")
\ No newline at end of file
+        file.write(f"[InternetShortcut]\nURL={asset_url}\n")
+    return asset_file_path
@@ -1,27 +1,77 @@
 import os
-import requests
-import webvtt
-
-def download_captions(captions, download_folder_path, title_of_output_mp4, captions_list, convert_to_srt, portal_name="www"):
-    filtered_captions = [caption for caption in captions if caption["locale_id"] in captions_list]
-
-    for caption in filtered_captions:
-        response = requests.get(caption['url'])
-        response.raise_for_status()
-        if caption['file_name'].endswith('.vtt'):
-            caption_name = f"{title_of_output_mp4} - {caption['video_label']}.vtt"
-            vtt_path = os.path.join(download_folder_path, caption_name)
-            with open(vtt_path, 'wb') as file:
-                file.write(response.content)
-
-            if convert_to_srt:
-                srt_name = caption_name.replace('.vtt', '.srt')
-                srt_path = os.path.join(download_folder_path, srt_name)
-                srt_content = webvtt.read(vtt_path)
-                srt_content.save_as_srt(srt_path)
-              
-                # Remove VTT file
-                os.remove(vtt_path)
-                
-        else:
-            print("Only VTT captions are supported. Please create a github issue if you'd like to add support for other formats.")
+import re
+import time
+from constants import logger
+from utils.session import fetch, check_response
+from utils.transfer import write_blob
+from utils.limiter import transfer_meter, bandwidth
+from utils.metrics import metrics
+
+TIMING_PATTERN = re.compile(r'^\s*((?:\d+:)?\d{2}:\d{2}\.\d{3})\s+-->\s+((?:\d+:)?\d{2}:\d{2}\.\d{3})')
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+def select_captions(captions, captions_list):
+    return [caption for caption in captions if caption["locale_id"] in captions_list]
+
+def _srt_timestamp(timestamp):
+    # SRT always has hours and uses a comma before the milliseconds
+    if timestamp.count(':') == 1:
+        timestamp = f"00:{timestamp}"
+    return timestamp.replace('.', ',')
+
+def iter_srt_lines(vtt_text):
+    """Convert WebVTT to SRT line by line. Cue settings, markup tags, NOTE/STYLE/REGION blocks and cue ids are dropped."""
+    index = 0
+    in_cue = False
+    skipping = True  # The WEBVTT header block
+
+    for line in vtt_text.splitlines():
+        if not line.strip():
+            if in_cue:
+                yield ""
+            in_cue = False
+            skipping = False
+            continue
+        if in_cue:
+            yield TAG_PATTERN.sub('', line)
+            continue
+        if skipping:
+            continue
+
+        timing = TIMING_PATTERN.match(line)
+        if timing:
+            index += 1
+            in_cue = True
+            yield str(index)
+            yield f"{_srt_timestamp(timing.group(1))} --> {_srt_timestamp(timing.group(2))}"
+        elif line.startswith(('NOTE', 'STYLE', 'REGION')):
+            skipping = True
+        # Anything else is a cue identifier, SRT numbers the cues itself
+
+    if in_cue:
+        yield ""
+
+def vtt_to_srt(vtt_text):
+    """Every cue ends with a blank line, the last one included, like webvtt-py's save_as_srt."""
+    return "".join(f"{line}\n" for line in iter_srt_lines(vtt_text))
+
+def download_caption(caption, download_folder_path, title_of_output_mp4, convert_to_srt):
+    """Fetch a single caption track and write it out, converted to SRT in memory if asked to."""
+    if not caption['file_name'].endswith('.vtt'):
+        logger.warning("Only VTT captions are supported. Please create a github issue if you'd like to add support for other formats.")
+        return
+
+    start_time = time.perf_counter()
+    response = fetch(caption['url'])
+    check_response(response)
+    # Counted like every other download, in the progress totals and the transfer metrics
+    transfer_meter.record(len(response.content))
+    metrics.observe("transfer", time.perf_counter() - start_time, len(response.content))
+    bandwidth.consume(len(response.content))
+
+    caption_name = f"{title_of_output_mp4} - {caption['video_label']}"
+    if convert_to_srt:
+        # WebVTT is always UTF-8, whatever the Content-Type says
+        srt_text = vtt_to_srt(response.content.decode('utf-8-sig', errors='replace'))
+        return write_blob(os.path.join(download_folder_path, f"{caption_name}.srt"), srt_text.encode('utf-8'))
+    return write_blob(os.path.join(download_folder_path, f"{caption_name}.vtt"), response.content)
@@ -1,19 +1,35 @@
-import re
 import os
+import time
 import m3u8
+import queue
 import shutil
-import requests
-import subprocess
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
 from constants import remove_emojis_and_binary
+from utils.session import fetch, check_response, backoff_delay, TransientError
+from utils.limiter import transfer_meter, bandwidth
+from utils.supervisor import spawn, spawn_segment_downloader, record_child_download, then
+from utils.scheduler import Handoff
+from utils.tools import require_tool
+from utils.metrics import metrics
+from utils.trace import tracer
+
+# Segment fetchers shared by all lectures, and how far each lecture may read ahead of its writer
+SEGMENT_WORKERS = 16
+SEGMENT_WINDOW = 24
+SEGMENT_ATTEMPTS = 3
 
 def download_and_merge_m3u8(m3u8_file_url, download_folder_path, title_of_output_mp4, task_id, progress, portal_name="www"):
     progress.update(task_id,  description=f"Downloading Stream {remove_emojis_and_binary(title_of_output_mp4)}", completed=0)
     
-    response = requests.get(m3u8_file_url)
-    response.raise_for_status()
+    response = fetch(m3u8_file_url)
+    check_response(response)
     
     m3u8_content = response.text
-    m3u8_obj = m3u8.loads(m3u8_content)
+    m3u8_obj = m3u8.loads(m3u8_content, uri=m3u8_file_url)
     playlists = m3u8_obj.playlists
     
     highest_quality_playlist = None
@@ -33,49 +49,220 @@ def download_and_merge_m3u8(m3u8_file_url, download_folder_path, title_of_output
         progress.remove_task(task_id)
         return
     
-    highest_quality_url = highest_quality_playlist.uri
+    highest_quality_url = highest_quality_playlist.absolute_uri
+
+    highest_quality_response = fetch(highest_quality_url)
+    check_response(highest_quality_response)
+
+    media_playlist = m3u8.loads(highest_quality_response.text, uri=highest_quality_url)
+    if media_playlist.segments and all(segment.key is None or segment.key.method in (None, "NONE") for segment in media_playlist.segments):
+        # Plain HLS can be fetched in-process over the shared session, no need for n_m3u8dl-re
+        return download_segments(media_playlist, download_folder_path, title_of_output_mp4, task_id, progress)
 
-    highest_quality_response = requests.get(highest_quality_url)
     m3u8_file_path = os.path.join(download_folder_path, "index.m3u8")
 
     with open(m3u8_file_path, 'wb') as file:
         file.write(highest_quality_response.content) 
 
-    merge_segments_into_mp4(m3u8_file_path, download_folder_path, title_of_output_mp4, task_id, progress, portal_name)
+    # n_m3u8dl-re fetches the segments itself, it runs under the tools lane's limit
+    return Handoff("tools", merge_segments_into_mp4, m3u8_file_path, download_folder_path, title_of_output_mp4, task_id, progress, portal_name)
+
+class SegmentPool:
+    """
+    Worker threads shared by every HLS download in the process.
+
+    Jobs are served in (lecture, segment) order, so the lecture that started
+    first gets its segments first. It finishes sooner and the pool keeps the
+    link busy with whatever comes next.
+    """
+    def __init__(self, workers):
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True, name="udm-segment").start()
+
+    def submit(self, priority, fn, *args):
+        future = Future()
+        self.queue.put((priority, next(self.sequence), future, fn, args))
+        return future
+
+    def _work(self):
+        while True:
+            _, _, future, fn, args = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with tracer.span(fn.__name__, "segment"):
+                    future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+_segment_pool = None
+_segment_pool_lock = threading.Lock()
+_lecture_sequence = itertools.count()
+
+def get_segment_pool():
+    global _segment_pool
+    with _segment_pool_lock:
+        if _segment_pool is None:
+            _segment_pool = SegmentPool(SEGMENT_WORKERS)
+        return _segment_pool
+
+def fetch_segment(url, byterange=None):
+    headers = {}
+    if byterange is not None:
+        length, offset = byterange
+        headers['Range'] = f"bytes={offset}-{offset + length - 1}"
+
+    for attempt in range(1, SEGMENT_ATTEMPTS + 1):
+        try:
+            response = fetch(url, headers=headers)
+            check_response(response)
+            data = response.content
+        except (ChunkedEncodingError, ConnectionError, Timeout, TransientError):
+            # The connection can also drop or stall while the body is being read
+            if attempt == SEGMENT_ATTEMPTS:
+                raise
+            time.sleep(backoff_delay(attempt - 1))
+            continue
+        transfer_meter.record(len(data))
+        bandwidth.consume(len(data))
+        return data
+
+def segment_requests(media_playlist):
+    """List (url, byterange) for the init section (if any) and every media segment, in playback order."""
+    segment_list = []
+    init_section = None
+    next_offset = {}
+
+    for segment in media_playlist.segments:
+        if segment.init_section is not None and segment.init_section.absolute_uri != init_section:
+            # Only a single leading init section can simply be concatenated
+            if init_section is not None:
+                raise ValueError("Playlists with several initialization sections are not supported")
+            init_section = segment.init_section.absolute_uri
+            segment_list.append((init_section, _parse_byterange(segment.init_section.byterange, init_section, next_offset)))
+        segment_list.append((segment.absolute_uri, _parse_byterange(segment.byterange, segment.absolute_uri, next_offset)))
+
+    return segment_list, init_section is not None
+
+def _parse_byterange(byterange, url, next_offset):
+    # EXT-X-BYTERANGE is "length[@offset]", the offset defaults to the end of the previous range of the same resource
+    if not byterange:
+        return None
+    length, _, offset = byterange.partition('@')
+    length = int(length)
+    offset = int(offset) if offset else next_offset.get(url, 0)
+    next_offset[url] = offset + length
+    return length, offset
+
+def download_segments(media_playlist, download_folder_path, output_file_name, task_id, progress):
+    output_path = os.path.dirname(download_folder_path)
+
+    progress.update(task_id,  description=f"Downloading segments {remove_emojis_and_binary(output_file_name)}", completed=0)
+
+    try:
+        segment_list, fragmented = segment_requests(media_playlist)
+    except ValueError as e:
+        progress.console.log(f"[red]Error Downloading {remove_emojis_and_binary(output_file_name)}: {e}[/red] ✕")
+        progress.remove_task(task_id)
+        return
+
+    if not fragmented:
+        # Don't fetch segments that can't be remuxed afterwards
+        require_tool("ffmpeg")
+
+    # fMP4 segments concatenate into a playable file, MPEG-TS needs a remux into MP4 afterwards
+    output_file = os.path.join(output_path, f"{output_file_name}.mp4")
+    stream_file = os.path.join(download_folder_path, "stream.mp4" if fragmented else "stream.ts")
+
+    pool = get_segment_pool()
+    lecture_priority = next(_lecture_sequence)
+    pending = deque()
+    next_request = 0
+    received = 0
+    write_time = 0.0
+    start_time = time.perf_counter()
+
+    try:
+        with open(stream_file, 'wb') as f:
+            for written in range(len(segment_list)):
+                # Keep a bounded window of segments in flight ahead of the writer
+                while next_request < len(segment_list) and len(pending) < SEGMENT_WINDOW:
+                    url, byterange = segment_list[next_request]
+                    pending.append(pool.submit((lecture_priority, next_request), fetch_segment, url, byterange))
+                    next_request += 1
+
+                data = pending.popleft().result()
+                write_start = time.perf_counter()
+                f.write(data)
+                write_time += time.perf_counter() - write_start
+                received += len(data)
+                progress.update(task_id, completed=(written + 1) / len(segment_list) * 100)
+    except Exception as e:
+        for future in pending:
+            future.cancel()
+        progress.console.log(f"[red]Error Downloading Segments {remove_emojis_and_binary(output_file_name)}: {e}[/red] ✕")
+        progress.remove_task(task_id)
+        return
+    finally:
+        metrics.observe("transfer", time.perf_counter() - start_time, received)
+        metrics.observe("write", write_time, received)
+
+    if fragmented:
+        os.replace(stream_file, output_file)
+        return finish_download(download_folder_path, output_file, output_file_name, task_id, progress)
+
+    # The transfer slot is free once the segments are on disk, ffmpeg waits for a tools slot
+    return Handoff("tools", remux_stream, stream_file, output_file, download_folder_path, output_file_name, task_id, progress)
+
+def remux_stream(stream_file, output_file, download_folder_path, output_file_name, task_id, progress):
+    """Remux downloaded MPEG-TS into MP4 with ffmpeg; returns a Future for the output path (None on failure)."""
+    progress.update(task_id,  description=f"Remuxing {remove_emojis_and_binary(output_file_name)}", completed=99)
+    remuxed = spawn([require_tool("ffmpeg"), "-loglevel", "error", "-i", stream_file, "-c", "copy", "-bsf:a", "aac_adtstoasc", "-y", output_file])
+
+    def after_remux(result):
+        if not result.ok:
+            progress.console.log(f"[red]Error Remuxing {remove_emojis_and_binary(output_file_name)}[/red] ✕")
+            progress.remove_task(task_id)
+            return
+        return finish_download(download_folder_path, output_file, output_file_name, task_id, progress)
+
+    return then(remuxed, after_remux)
+
+def finish_download(download_folder_path, output_file, output_file_name, task_id, progress):
+    progress.console.log(f"[green]Downloaded {remove_emojis_and_binary(output_file_name)}[/green] ✓")
+    progress.remove_task(task_id)
+    shutil.rmtree(download_folder_path)
+    return output_file
 
 def merge_segments_into_mp4(m3u8_file_path, download_folder_path, output_file_name, task_id, progress, portal_name="www"):
+    """Hand an encrypted playlist to n_m3u8dl-re; returns a Future for the output path (None on failure)."""
     output_path = os.path.dirname(download_folder_path)
 
     progress.update(task_id,  description=f"Merging segments {remove_emojis_and_binary(output_file_name)}", completed=0)
     
-    nm3u8dl_command = (
-        f"n_m3u8dl-re \"{m3u8_file_path}\" --save-dir \"{output_path}\" "
-        f"--save-name \"{output_file_name}\" --auto-select --concurrent-download "
-        f"--del-after-done --no-log --tmp-dir \"{output_path}\" --log-level ERROR"
-    )
-
-    pattern = re.compile(r'(\d+\.\d+%)')
-    process = subprocess.Popen(nm3u8dl_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-    while True:
-        output = process.stdout.readline()
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            stripped_output = output.strip().replace(' ', '')
-        if stripped_output.startswith('Vid'):
-            matches = pattern.findall(output)
-            if matches:
-                first_percentage = float(matches[0].replace('%', ''))
-                progress.update(task_id,  completed=first_percentage)
-
-    stdout, stderr = process.communicate()
-
-    if stderr or process.returncode != 0:
+    nm3u8dl_command = [
+        require_tool("n_m3u8dl-re"), m3u8_file_path, "--save-dir", output_path,
+        "--save-name", output_file_name, "--auto-select", "--concurrent-download",
+        "--del-after-done", "--no-log", "--tmp-dir", output_path, "--log-level", "ERROR"
+    ]
+
+    merged = spawn_segment_downloader(nm3u8dl_command, task_id, progress)
+    return then(merged, lambda result: finish_merge(result, download_folder_path, output_path, output_file_name, task_id, progress))
+
+def finish_merge(result, download_folder_path, output_path, output_file_name, task_id, progress):
+    if not result.ok:
         progress.console.log(f"[red]Error Merging {remove_emojis_and_binary(output_file_name)}[/red] ✕")
         progress.remove_task(task_id)
         return
     
     progress.console.log(f"[green]Downloaded {remove_emojis_and_binary(output_file_name)}[/green] ✓")
     progress.remove_task(task_id)
-    shutil.rmtree(download_folder_path)
\ No newline at end of file
+    shutil.rmtree(download_folder_path)
+
+    # n_m3u8dl-re picks the container extension itself
+    output_file = next((os.path.join(output_path, f) for f in os.listdir(output_path) if os.path.splitext(f)[0] == output_file_name), None)
+    if output_file:
+        record_child_download(output_file)
+    return output_file
@@ -1,33 +1,26 @@
 import os
 import shutil
-import requests
-from constants import remove_emojis_and_binary
+from constants import remove_emojis_and_binary, logger
+from utils.transfer import download_file
 
 def download_mp4(mp4_file_url, download_folder_path, title_of_output_mp4, task_id, progress):
     progress.update(task_id,  description=f"Downloading Video {remove_emojis_and_binary(title_of_output_mp4)}", completed=0)
     output_path = os.path.dirname(download_folder_path)
     
     try:
-        response = requests.get(mp4_file_url, stream=True)
-        response.raise_for_status()
-        total_size = int(response.headers.get('content-length', 0))
-        
-        downloaded_size = 0  
-
-        
         output_file = os.path.join(output_path, title_of_output_mp4 + ".mp4")
-        with open(output_file, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    downloaded_size += len(chunk)  
-                    percentage = (downloaded_size / total_size) * 100
-                    progress.update(task_id, completed=percentage)
+
+        def on_progress(downloaded_size, total_size):
+            if total_size:
+                progress.update(task_id, completed=(downloaded_size / total_size) * 100)
+
+        download_file(mp4_file_url, output_file, on_progress)
         
         progress.update(task_id,  completed=100)
         progress.console.log(f"[green]Downloaded {remove_emojis_and_binary(title_of_output_mp4)}[/green] ✓")
         progress.remove_task(task_id)
         shutil.rmtree(download_folder_path)
+        return output_file
     except Exception as e:
-        print(e)
+        logger.error(f"Error downloading {title_of_output_mp4}: {e}")
         progress.console.log(f"[red]Error Downloading {remove_emojis_and_binary(title_of_output_mp4)}[/red] ✕")
\ No newline at end of file
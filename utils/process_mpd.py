@@ -1,58 +1,49 @@
 import os
 import re
 import shutil
-import subprocess
-import requests
 from urllib.parse import urlparse
-from constants import remove_emojis_and_binary, timestamp_to_seconds
+from constants import remove_emojis_and_binary
+from utils.session import fetch, check_response
+from utils.supervisor import spawn, spawn_segment_downloader, record_child_download, then
+from utils.tools import require_tool
+
+OUT_TIME_PATTERN = re.compile(r'out_time_(?:us|ms)=(\d+)')
 
 def download_and_merge_mpd(mpd_file_url, download_folder_path, title_of_output_mp4, length, key, task_id, progress, portal_name="www"):
+    # Fail before fetching anything when the tools aren't there
+    require_tool("n_m3u8dl-re")
+    require_tool("ffmpeg")
+
     progress.update(task_id,  description=f"Downloading Stream {remove_emojis_and_binary(title_of_output_mp4)}", completed=0)
     
     mpd_filename = os.path.basename(urlparse(mpd_file_url).path)
     mpd_file_path = os.path.join(download_folder_path, mpd_filename)
 
-    response = requests.get(mpd_file_url)
-    response.raise_for_status()
+    response = fetch(mpd_file_url)
+    check_response(response)
 
     with open(mpd_file_path, 'wb') as file:
         file.write(response.content)
 
-    process_mpd(mpd_file_path, download_folder_path, title_of_output_mp4, length, key, task_id, progress)
+    return process_mpd(mpd_file_path, download_folder_path, title_of_output_mp4, length, key, task_id, progress)
 
 def process_mpd(mpd_file_path, download_folder_path, output_file_name, length, key, task_id, progress):
-    nm3u8dl_command = (
-        f"n_m3u8dl-re \"{mpd_file_path}\" --save-dir \"{download_folder_path}\" "
-        f"--save-name \"{output_file_name}.mp4\" --auto-select --concurrent-download "
-        f"--key {key} --del-after-done --no-log --tmp-dir \"{download_folder_path}\" "
-        f"--log-level ERROR"
-    )
-
-    pattern = re.compile(r'(\d+\.\d+%)')
-    process_nm3u8dl = subprocess.Popen(
-        nm3u8dl_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    )
+    """Start the segment download; returns a Future for the merged file's path (None on failure)."""
+    nm3u8dl_command = [
+        require_tool("n_m3u8dl-re"), mpd_file_path, "--save-dir", download_folder_path,
+        "--save-name", f"{output_file_name}.mp4", "--auto-select", "--concurrent-download",
+        "--del-after-done", "--no-log", "--tmp-dir", download_folder_path, "--log-level", "ERROR"
+    ]
+    if key is not None:
+        nm3u8dl_command += ["--key", key]
 
     progress.update(task_id,  description=f"Merging segments {remove_emojis_and_binary(output_file_name)}", completed=0)
-    
-    while True:
-        output = process_nm3u8dl.stdout.readline()
-        if output == '' and process_nm3u8dl.poll() is not None:
-            break
-        if output:
-            stripped_output = output.strip().replace(' ', '')
-        if stripped_output.startswith('Vid'):
-            matches = pattern.findall(output)
-            if matches:
-                first_percentage = float(matches[0].replace('%', ''))
-                if first_percentage < 100.0:
-                    progress.update(task_id,  completed=first_percentage)
-                else:
-                    progress.update(task_id,  completed=99)
-
-    stdout_nm3u8dl, stderr_nm3u8dl = process_nm3u8dl.communicate()
-
-    if stderr_nm3u8dl or process_nm3u8dl.returncode != 0:
+
+    segments_done = spawn_segment_downloader(nm3u8dl_command, task_id, progress, ceiling=99)
+    return then(segments_done, lambda result: merge_video_and_audio(result, download_folder_path, output_file_name, length, task_id, progress))
+
+def merge_video_and_audio(nm3u8dl_result, download_folder_path, output_file_name, length, task_id, progress):
+    if not nm3u8dl_result.ok:
         progress.console.log(f"[red]Error Downloading Segments {remove_emojis_and_binary(output_file_name)}[/red] ✕")
         progress.remove_task(task_id)
         return
@@ -72,31 +63,27 @@ def process_mpd(mpd_file_path, download_folder_path, output_file_name, length, k
     audio_path = os.path.join(download_folder_path, m4a_files[0])
     output_path = os.path.join(os.path.dirname(download_folder_path), output_file_name)
 
-    ffmpeg_command = (
-        f"ffmpeg -loglevel panic -i \"{video_path}\" -i \"{audio_path}\" -c:v copy -c:a aac -y "
-        f"\"{output_path}.mp4\""
-    )
-
-    process_ffmpeg = subprocess.Popen(
-        ffmpeg_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    )
-    
-    time_pattern = re.compile(r'time=(\d{2}:\d{2}:\d{2}\.\d{2})')
-    
-    while True:
-        output = process_ffmpeg.stderr.readline()
-        if output == '' and process_ffmpeg.poll() is not None:
-            break
-        if output:
-            match = time_pattern.search(output)
+    # -progress reports machine-readable out_time lines on stdout while -loglevel keeps stderr for errors
+    ffmpeg_command = [
+        require_tool("ffmpeg"), "-loglevel", "panic", "-nostats", "-progress", "pipe:1",
+        "-i", video_path, "-i", audio_path, "-c:v", "copy", "-c:a", "aac", "-y", f"{output_path}.mp4"
+    ]
+
+    def on_ffmpeg_output(stream, lines):
+        if stream != 'stdout' or not length:
+            return
+        for line in reversed(lines):
+            match = OUT_TIME_PATTERN.match(line)
             if match:
-                timestamp = match.group(1)
-                seconds = timestamp_to_seconds(timestamp)
-                progress.update(task_id,  completed=(int(seconds) / length) * 100)
+                seconds = int(match.group(1)) / 1000000
+                progress.update(task_id,  completed=min((seconds / length) * 100, 100))
+                break
 
-    stdout_ffmpeg, stderr_ffmpeg = process_ffmpeg.communicate()
+    merged = spawn(ffmpeg_command, on_ffmpeg_output)
+    return then(merged, lambda result: finish_merge(result, download_folder_path, output_path, output_file_name, task_id, progress))
 
-    if stderr_ffmpeg or process_ffmpeg.returncode != 0:
+def finish_merge(ffmpeg_result, download_folder_path, output_path, output_file_name, task_id, progress):
+    if not ffmpeg_result.ok:
         progress.console.log(f"[red]Error Merging Video and Audio files {remove_emojis_and_binary(output_file_name)}[/red] ✕")
         progress.remove_task(task_id)
         return
@@ -104,3 +91,6 @@ def process_mpd(mpd_file_path, download_folder_path, output_file_name, length, k
     progress.console.log(f"[green]Downloaded {remove_emojis_and_binary(output_file_name)}[/green] ✓")
     progress.remove_task(task_id)
     shutil.rmtree(download_folder_path)
+
+    record_child_download(f"{output_path}.mp4")
+    return f"{output_path}.mp4"
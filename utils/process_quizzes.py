@@ -1,10 +1,53 @@
 import os
 import json
+import logging
+import threading
 from pathvalidate import sanitize_filename
-from constants import QUIZ_URL, logger
+from constants import QUIZ_URL, METADATA_CONCURRENCY, logger
+from utils.session import fetch_pages
+from utils.metrics import tagged
 
-def download_quiz(udemy, quiz_id, folder_path, title_of_output_quiz, task_id, progress, portal_name="www", quiz_order=None):
-    """Download and process a quiz from Udemy"""
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
+PLACEHOLDER = "__data_placeholder__"
+
+DEFAULT_TEMPLATES = {
+    "coding_assignment_template.html": """<!DOCTYPE html>
+<html><head><title>Coding Assignment</title></head>
+<body><h1>__data_placeholder__</h1></body></html>""",
+    "quiz_template.html": """<!DOCTYPE html>
+<html><head><title>Quiz</title></head>
+<body><h1>__data_placeholder__</h1></body></html>""",
+}
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def load_template(name):
+    """Return the template split into the parts before and after the data placeholder, read from disk once per process."""
+    with _templates_lock:
+        if name not in _templates:
+            template_path = os.path.join(TEMPLATE_DIR, name)
+            if not os.path.exists(template_path):
+                logger.error(f"Quiz template not found at {template_path}, creating a default template")
+                os.makedirs(TEMPLATE_DIR, exist_ok=True)
+                with open(template_path, "w", encoding="utf-8") as f:
+                    f.write(DEFAULT_TEMPLATES[name])
+
+            with open(template_path, "r", encoding="utf-8") as f:
+                head, _, tail = f.read().partition(PLACEHOLDER)
+            _templates[name] = (head, tail)
+        return _templates[name]
+
+def fetch_assessments(udemy, quiz_url, workers=METADATA_CONCURRENCY):
+    """Fetch every page of a quiz's assessments, `workers` pages at a time after the first."""
+    def fetch_page(url):
+        with tagged("Quiz"):
+            return udemy.request_json(url)
+
+    return fetch_pages(fetch_page, quiz_url, workers)
+
+def download_quiz(udemy, quiz_id, folder_path, title_of_output_quiz, task_id, progress, portal_name="www", quiz_order=None, page_workers=METADATA_CONCURRENCY):
+    """Download and process a quiz from Udemy. Assessment pages are fetched `page_workers` at a time, like the curriculum's."""
     progress.update(task_id, description=f"Downloading Quiz {title_of_output_quiz}", completed=0)
     
     # Format quiz filename
@@ -17,12 +60,11 @@ def download_quiz(udemy, quiz_id, folder_path, title_of_output_quiz, task_id, pr
     quiz_url = QUIZ_URL.format(portal_name=portal_name, quiz_id=quiz_id)
     logger.debug(f"Requesting quiz URL: {quiz_url}")
     
-    quiz_response = udemy.request(quiz_url).json()
-    
-    # Log the raw response for debugging
-    logger.debug(f"Quiz response: {json.dumps(quiz_response, indent=2)}")
-    
-    quiz_results = quiz_response.get('results', [])
+    quiz_results = fetch_assessments(udemy, quiz_url, page_workers)
+
+    # Log the raw response for debugging, only serialized when someone is listening
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Quiz response: {json.dumps(quiz_results, indent=2)}")
     
     if not quiz_results:
         progress.console.log(f"[yellow]No quiz data found for {title_of_output_quiz}[/yellow]")
@@ -34,33 +76,9 @@ def download_quiz(udemy, quiz_id, folder_path, title_of_output_quiz, task_id, pr
     if len(quiz_results) == 1 and quiz_results[0].get('assessment_type') == 'coding-problem':
         is_coding_assignment = True
     
-    # Get the template path
-    template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
-    os.makedirs(template_dir, exist_ok=True)
-    
-    template_path = os.path.join(template_dir, 
-                               "coding_assignment_template.html" if is_coding_assignment else "quiz_template.html")
-    
-    if not os.path.exists(template_path):
-        logger.error(f"Quiz template not found at {template_path}")
-        progress.console.log(f"[red]Quiz template not found. Creating default template.[/red]")
-        
-        # Create a default template if missing
-        if is_coding_assignment:
-            with open(template_path, "w", encoding="utf-8") as f:
-                f.write("""<!DOCTYPE html>
-<html><head><title>Coding Assignment</title></head>
-<body><h1>__data_placeholder__</h1></body></html>""")
-        else:
-            with open(template_path, "w", encoding="utf-8") as f:
-                f.write("""<!DOCTYPE html>
-<html><head><title>Quiz</title></head>
-<body><h1>__data_placeholder__</h1></body></html>""")
-    
     try:
-        with open(template_path, "r", encoding="utf-8") as f:
-            html_template = f.read()
-            
+        head, tail = load_template("coding_assignment_template.html" if is_coding_assignment else "quiz_template.html")
+
         if is_coding_assignment:
             # Process coding assignment
             assignment = quiz_results[0]
@@ -85,16 +103,21 @@ def download_quiz(udemy, quiz_id, folder_path, title_of_output_quiz, task_id, pr
                 "questions": quiz_results
             }
         
-        html_content = html_template.replace("__data_placeholder__", json.dumps(quiz_data))
-        
+        # Stream the page out around the placeholder instead of building it in memory first
         output_path = os.path.join(folder_path, quiz_filename)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-            
+        with open(f"{output_path}.part", 'w', encoding='utf-8') as f:
+            f.write(head)
+            json.dump(quiz_data, f)
+            f.write(tail)
+        os.replace(f"{output_path}.part", output_path)
+
         progress.console.log(f"[green]Downloaded {quiz_filename}[/green] ✓")
         
     except Exception as e:
         logger.error(f"Error processing quiz: {str(e)}")
         progress.console.log(f"[red]Error processing quiz {title_of_output_quiz}: {str(e)}[/red]")
+        output_path = None
     
-    progress.update(task_id, completed=100) 
+    progress.update(task_id, completed=100)
+    return output_path
+ 
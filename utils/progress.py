@@ -0,0 +1,233 @@
+import sys
+import json
+import time
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from rich.console import Group
+from rich.live import Live
+from rich.progress import Progress, BarColumn, TextColumn
+from rich.text import Text
+from utils.limiter import transfer_meter
+
+# How often the terminal is redrawn and how often a JSON-lines status record is written
+TUI_INTERVAL = 0.25
+STATUS_INTERVAL = 2.0
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes:02}:{seconds:02}"
+
+class _Console:
+    """Stands in for `progress.console` so log lines go wherever the hub publishes to."""
+    def __init__(self, hub):
+        self.hub = hub
+
+    def log(self, message):
+        self.hub.log(message)
+
+class ProgressHub(ABC):
+    """
+    Drop-in for the rich Progress handed to the download functions.
+
+    Workers only write into plain per-task dicts, which costs next to nothing
+    even when it happens for every chunk. A publisher thread takes a snapshot
+    every `interval` seconds and renders it, together with course totals
+    (items, bytes, bytes/sec and ETA).
+    """
+    interval = TUI_INTERVAL
+
+    def __init__(self):
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.console = _Console(self)
+
+        self.items_total = 0
+        self.items_done = 0
+        self.items_failed = 0
+        self.start_time = time.monotonic()
+        self.rate = None
+        self.last_sample = (self.start_time, transfer_meter.total)
+
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add_task(self, description, total=100):
+        task_id = next(self.ids)
+        with self.lock:
+            self.tasks[task_id] = {'description': description, 'total': total, 'completed': 0}
+        return task_id
+
+    def update(self, task_id, description=None, completed=None, total=None):
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        if description is not None:
+            task['description'] = description
+        if completed is not None:
+            task['completed'] = completed
+        if total is not None:
+            task['total'] = total
+
+    def remove_task(self, task_id):
+        # Raises KeyError for unknown tasks, like rich does
+        with self.lock:
+            del self.tasks[task_id]
+
+    def set_total(self, items):
+        with self.lock:
+            self.items_total = items
+
+    def item_finished(self, failed=False):
+        with self.lock:
+            self.items_done += 1
+            if failed:
+                self.items_failed += 1
+
+    def snapshot(self):
+        with self.lock:
+            tasks = {task_id: dict(task) for task_id, task in self.tasks.items()}
+
+        now = time.monotonic()
+        transferred = transfer_meter.total
+        last_time, last_transferred = self.last_sample
+        if now > last_time:
+            sample = (transferred - last_transferred) / (now - last_time)
+            self.rate = sample if self.rate is None else self.rate * 0.7 + sample * 0.3
+        self.last_sample = (now, transferred)
+
+        # Items vary wildly in size, but the average pace so far is a fair guess for the rest
+        elapsed = now - self.start_time
+        remaining = max(0, self.items_total - self.items_done)
+        eta = elapsed / self.items_done * remaining if self.items_done else None
+
+        return tasks, {
+            'items_done': self.items_done,
+            'items_failed': self.items_failed,
+            'items_total': self.items_total,
+            'bytes': transferred,
+            'bytes_per_sec': round(self.rate or 0.0),
+            'eta_seconds': None if eta is None else round(eta),
+        }
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.publish()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._run, daemon=True, name="udm-progress")
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.publish(final=True)
+
+    @abstractmethod
+    def log(self, message):
+        """Show a one-off message, like a finished or failed download."""
+
+    @abstractmethod
+    def publish(self, final=False):
+        """Render the current snapshot. `final` is set for the last one, once every item is done."""
+
+class TerminalProgress(ProgressHub):
+    """Rich progress bars, one per active task plus an overall course bar, redrawn at a fixed rate."""
+    def __init__(self, *columns):
+        super().__init__()
+        self.task_progress = Progress(*columns, auto_refresh=False)
+        self.overall = Progress(
+            TextColumn("[bold]{task.description}"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total} items"),
+            TextColumn("[cyan]{task.fields[transferred]}[/cyan] @ [cyan]{task.fields[rate]}/s[/cyan]"),
+            TextColumn("ETA [yellow]{task.fields[eta]}[/yellow]"),
+            auto_refresh=False,
+        )
+        self.overall_task = self.overall.add_task("Course", total=None, transferred=format_bytes(0), rate=format_bytes(0), eta=format_eta(None))
+        self.rich_ids = {}
+        self.published = {}
+        self.live = Live(Group(self.overall, self.task_progress), auto_refresh=False)
+
+    def __enter__(self):
+        self.live.start()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        self.live.stop()
+
+    def log(self, message):
+        # Attribute the line to whoever called progress.console.log
+        self.live.console.log(message, _stack_offset=3)
+
+    def publish(self, final=False):
+        tasks, totals = self.snapshot()
+
+        for task_id in list(self.rich_ids):
+            if task_id not in tasks:
+                self.task_progress.remove_task(self.rich_ids.pop(task_id))
+                del self.published[task_id]
+
+        for task_id, task in tasks.items():
+            if self.published.get(task_id) == task:
+                continue
+            if task_id in self.rich_ids:
+                self.task_progress.update(self.rich_ids[task_id], **task)
+            else:
+                self.rich_ids[task_id] = self.task_progress.add_task(**task)
+            self.published[task_id] = task
+
+        self.overall.update(
+            self.overall_task,
+            completed=totals['items_done'],
+            total=totals['items_total'],
+            transferred=format_bytes(totals['bytes']),
+            rate=format_bytes(totals['bytes_per_sec']),
+            eta=format_eta(totals['eta_seconds']),
+        )
+        self.live.refresh()
+
+class JsonLinesProgress(ProgressHub):
+    """Writes one JSON status record per interval, plus one per log line, for schedulers and log shippers."""
+    interval = STATUS_INTERVAL
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.write_lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps({'time': round(time.time(), 3), **record}, ensure_ascii=False)
+        with self.write_lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, message):
+        self.emit({'event': 'log', 'message': Text.from_markup(message).plain})
+
+    def publish(self, final=False):
+        tasks, totals = self.snapshot()
+        active = [
+            {'description': task['description'], 'percent': round(task['completed'] / task['total'] * 100, 1) if task['total'] else None}
+            for task in tasks.values()
+        ]
+        self.emit({'event': 'finished' if final else 'status', **totals, 'active': active})
+
+def open_status_stream(target):
+    """`-` means stdout; anything else is a file that status lines are appended to."""
+    if target == "-":
+        return sys.stdout
+    return open(target, 'a', encoding='utf-8', buffering=1)
@@ -0,0 +1,151 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.trace import tracer, SLOTS_PID
+from utils.limiter import bind_limiter
+
+# How often adaptive lanes re-evaluate their limits while jobs are running
+TICK_INTERVAL = 1.0
+
+class Handoff:
+    """
+    Returned by a job to finish its work on another lane.
+
+    The job's slot is freed and `fn(*args)` is queued on `lane` under the same
+    callback, so a download can leave its merge to the tools lane instead of
+    holding a transfer slot while a child process runs. `name` labels the
+    new slot in traces.
+    """
+    def __init__(self, lane, fn, *args, name=None):
+        self.lane = lane
+        self.fn = fn
+        self.args = args
+        self.name = name
+
+class Lane:
+    def __init__(self, name, workers, limiter=None, meter=None, index=0):
+        self.name = name
+        self.index = index
+        self.workers = workers
+        self.limiter = limiter
+        self.meter = meter
+        self.active = 0
+        self.completed = 0
+        self.pending = deque()
+        # Slot numbers in use, only tracked while tracing
+        self.busy_slots = set()
+        # An adaptive lane may grow up to the limiter's maximum
+        max_workers = limiter.maximum if limiter is not None else workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"udm-{name}",
+                                           initializer=bind_limiter if limiter is not None else None, initargs=(limiter,))
+
+    @property
+    def limit(self):
+        return self.limiter.limit if self.limiter is not None else self.workers
+
+    def has_capacity(self):
+        return self.active < self.limit
+
+    def tick(self):
+        if self.limiter is not None:
+            self.limiter.tick(self.meter() if self.meter is not None else self.completed)
+
+class Scheduler:
+    """
+    Runs jobs on named lanes, keeping at most `limit` jobs of each lane in flight.
+
+    Completions are handled on the calling thread as soon as they happen, so
+    callbacks can safely submit follow-up jobs and refill free slots. A job
+    may return a Future (a supervised child process, say); its slot is then
+    held until that Future is done, without tying up a worker thread. A job
+    returning a Handoff gives up its slot and continues on another lane.
+    """
+    def __init__(self):
+        self.lanes = {}
+        self.running = {}
+
+    def add_lane(self, name, workers, limiter=None, meter=None):
+        """
+        Add a lane running up to `workers` jobs at once.
+
+        With a `limiter` the lane follows its adaptive limit instead; `meter`
+        returns the cumulative work done (bytes, say) used to judge throughput
+        and defaults to the number of completed jobs.
+        """
+        self.lanes[name] = Lane(name, workers, limiter, meter, index=len(self.lanes))
+        return self.lanes[name]
+
+    def has_capacity(self, lane):
+        lane = self.lanes[lane]
+        return not lane.pending and lane.has_capacity()
+
+    def submit(self, lane, fn, *args, callback=None, name=None, **kwargs):
+        """Queue `fn(*args, **kwargs)` on a lane. `name` labels the job's slot in traces and defaults to the function's name."""
+        lane = self.lanes[lane]
+        lane.pending.append((fn, args, kwargs, callback, name or fn.__name__))
+        self._dispatch(lane)
+
+    def _dispatch(self, lane):
+        while lane.pending and lane.has_capacity():
+            fn, args, kwargs, callback, name = lane.pending.popleft()
+            future = lane.executor.submit(fn, *args, **kwargs)
+            lane.active += 1
+            self.running[future] = (lane, callback, self._take_slot(lane, name))
+
+    def _take_slot(self, lane, name):
+        if not tracer.enabled:
+            return None
+        slot = next(slot for slot in range(len(lane.busy_slots) + 1) if slot not in lane.busy_slots)
+        lane.busy_slots.add(slot)
+        tracer.counter(lane.name, active=lane.active, limit=lane.limit)
+        return slot, name, tracer.now()
+
+    def _release_slot(self, lane, slot):
+        if slot is None:
+            return
+        number, name, start = slot
+        lane.busy_slots.discard(number)
+        tid = lane.index * 1000 + number
+        tracer.name_track(SLOTS_PID, tid, f"{lane.name} slot {number + 1}")
+        tracer.complete(name, start, "slot", pid=SLOTS_PID, tid=tid)
+        tracer.counter(lane.name, active=lane.active, limit=lane.limit)
+
+    def run(self, refill=None):
+        """
+        Block until every submitted job has completed.
+
+        `refill` is called before each wait so the caller can top up lanes that
+        have free slots.
+        """
+        while True:
+            if refill is not None:
+                refill()
+            if not self.running:
+                break
+
+            adaptive = any(lane.limiter is not None for lane in self.lanes.values())
+            done, _ = wait(self.running, timeout=TICK_INTERVAL if adaptive else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                lane, callback, slot = self.running.pop(future)
+                if future.exception() is None and isinstance(future.result(), Future):
+                    # The job handed its work to a child process, the worker thread is free
+                    # but the slot stays taken until the child is done
+                    self.running[future.result()] = (lane, callback, slot)
+                    continue
+                lane.active -= 1
+                lane.completed += 1
+                self._release_slot(lane, slot)
+                if future.exception() is None and isinstance(future.result(), Handoff):
+                    # The callback runs once the work is done on the other lane
+                    handoff = future.result()
+                    self.submit(handoff.lane, handoff.fn, *handoff.args, callback=callback, name=handoff.name)
+                elif callback is not None:
+                    callback(future)
+                self._dispatch(lane)
+
+            for lane in self.lanes.values():
+                lane.tick()
+                self._dispatch(lane)
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.executor.shutdown(wait=True)
@@ -0,0 +1,172 @@
+import time
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
+from requests.exceptions import ConnectionError, Timeout
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from constants import logger
+from utils.limiter import THROTTLE_STATUS_CODES, report_throttle, report_latency, wait_for_resume, parse_retry_after
+
+# Server errors worth another try, on top of the throttling codes
+RETRY_STATUS_CODES = THROTTLE_STATUS_CODES + (500, 502, 504)
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+MAX_RETRIES = 4
+
+_session = None
+_timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+_retries = MAX_RETRIES
+
+class RequestError(Exception):
+    """A request that failed for a reason other than the ones below."""
+
+class TransientError(RequestError):
+    """Network failures, timeouts and server errors that outlasted every retry."""
+
+class AuthError(RequestError):
+    """The cookies or bearer token were rejected (HTTP 401/403)."""
+
+class NotFoundError(RequestError):
+    """The item does not exist or is no longer available (HTTP 404/410)."""
+
+class BearerAuth(AuthBase):
+    """Attach the Udemy bearer headers, but only to requests aimed at udemy.com hosts."""
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, request):
+        host = urlparse(request.url).hostname or ""
+        if host == "udemy.com" or host.endswith(".udemy.com"):
+            request.headers['Authorization'] = f'Bearer {self.token}'
+            request.headers['X-Udemy-Authorization'] = f'Bearer {self.token}'
+        return request
+
+def init_session(max_concurrent, bearer_token=None, cookie_jar=None, timeout=None, retries=None):
+    """Create the process-wide keep-alive session, with pools sized for the given concurrency."""
+    global _session, _timeout, _retries
+
+    session = requests.Session()
+
+    # Every worker may hold a connection to the API and one to the CDN at the same time,
+    # on top of the HLS segment fetchers
+    pool_size = max(32, max_concurrent * 4)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    if bearer_token:
+        session.auth = BearerAuth(bearer_token)
+    elif cookie_jar is not None:
+        session.cookies = cookie_jar
+
+    if timeout is not None:
+        _timeout = timeout
+    if retries is not None:
+        _retries = retries
+
+    _session = session
+    return session
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = init_session(1)
+    return _session
+
+def backoff_delay(attempt):
+    """Exponential backoff with jitter, so workers that failed together don't retry together."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def fetch(url, stream=False, **kwargs):
+    """
+    GET a URL over the shared session.
+
+    Connection errors, timeouts and 429/5xx responses are retried with
+    jittered exponential backoff. Throttling responses also back off the
+    adaptive limiters and wait out the server's Retry-After. Once the
+    retries are used up, network failures raise TransientError and the last
+    response is returned as is.
+    """
+    kwargs.setdefault('timeout', _timeout)
+
+    for attempt in range(_retries + 1):
+        wait_for_resume()
+
+        start_time = time.monotonic()
+        try:
+            response = get_session().get(url, stream=stream, **kwargs)
+        except (ConnectionError, Timeout) as e:
+            if attempt == _retries:
+                raise TransientError(f"{urlparse(url).hostname} could not be reached: {e}") from e
+            delay = backoff_delay(attempt)
+            logger.debug(f"Request to {urlparse(url).hostname} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        report_latency(time.monotonic() - start_time)
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt == _retries:
+            return response
+        response.close()
+
+        if response.status_code in THROTTLE_STATUS_CODES:
+            # Every worker pauses for as long as the server asked. The one that was throttled also
+            # waits at least its own jittered backoff, so "Retry-After: 0" or a date in the past
+            # doesn't bring all of them back at once
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            report_throttle(retry_after)
+            delay = max(retry_after or 0.0, backoff_delay(attempt))
+            logger.warning(f"Server is throttling requests (HTTP {response.status_code}), backing off for {delay:.1f}s")
+            time.sleep(delay)
+        else:
+            delay = backoff_delay(attempt)
+            logger.debug(f"Server error (HTTP {response.status_code}) from {urlparse(url).hostname}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def check_response(response):
+    """Raise the matching RequestError subclass for an unsuccessful response."""
+    status = response.status_code
+    if status < 400:
+        return response
+
+    reason = f"HTTP {status} from {urlparse(response.url).hostname}"
+    if status in (401, 403):
+        raise AuthError(reason)
+    if status in (404, 410):
+        raise NotFoundError(reason)
+    if status in RETRY_STATUS_CODES:
+        raise TransientError(reason)
+    raise RequestError(reason)
+
+def fetch_pages(fetch_page, url, workers, on_page=None):
+    """
+    Fetch every page of a paginated API listing and return all of their results, in order.
+
+    `fetch_page(url)` returns one page's JSON. The first page tells how many
+    items there are, so the rest are requested at once, `workers` at a time.
+    `on_page(count, fetched)` is called after each page, for progress bars.
+    """
+    first_page = fetch_page(url)
+    count = first_page.get('count', 0)
+    pages = [first_page.get('results', [])]
+    fetched = len(pages[0])
+    if on_page is not None:
+        on_page(count, fetched)
+
+    page_count = -(-count // max(len(pages[0]), 1))
+    if first_page.get('next') and pages[0] and page_count > 1:
+        pages.extend([None] * (page_count - 1))
+        with ThreadPoolExecutor(max_workers=min(workers, page_count - 1)) as executor:
+            futures = {executor.submit(fetch_page, f"{url}&page={page}"): page for page in range(2, page_count + 1)}
+            for future in as_completed(futures):
+                page = futures[future]
+                pages[page - 1] = future.result().get('results', [])
+                fetched += len(pages[page - 1])
+                if on_page is not None:
+                    on_page(count, fetched)
+
+    return [result for page in pages for result in page]
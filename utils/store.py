@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import threading
+from constants import logger
+from utils.journal import file_checksum
+from utils.transfer import link_or_copy
+
+INDEX_FILENAME = "index.jsonl"
+
+def asset_key(asset_id):
+    # Udemy asset ids are global, so the same asset in two courses shares a key
+    return f"asset:{asset_id}"
+
+def file_key(filename, size, etag):
+    # Only with a strong ETag: plenty of different assets share a name like slides.pdf and a size
+    return f"file:{filename}:{size}:{etag}"
+
+class ContentStore:
+    """
+    Files stored once under their sha256, shared by every course tree.
+
+    Course files are hardlinks (or reflinks, or copies where neither works)
+    of the objects in `objects/`. `index.jsonl` maps lookup keys, such as an
+    asset id or a filename/size/strong ETag triple, to the object holding that
+    content, so known content is never transferred again.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        self.keys = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.keys[entry['key']] = entry
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def lookup(self, key):
+        """Return the index entry for `key` if its object is still intact, else None."""
+        entry = self.keys.get(key)
+        if entry is None:
+            return None
+        try:
+            if os.path.getsize(self.object_path(entry['sha256'])) != entry['size']:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def materialize(self, entry, output_file):
+        """Put the stored content at `output_file`."""
+        return link_or_copy(self.object_path(entry['sha256']), output_file)
+
+    def add(self, path, keys, digest=None):
+        """
+        Take `path` into the store and record it under `keys`. Content the store already has is linked back over `path`.
+
+        Pass `digest` when the file's sha256 is already known, to spare reading it again.
+        """
+        digest = digest or file_checksum(path)
+        object_file = self.object_path(digest)
+        os.makedirs(os.path.dirname(object_file), exist_ok=True)
+
+        if os.path.exists(object_file):
+            if not os.path.samefile(object_file, path):
+                link_or_copy(object_file, path)
+        else:
+            try:
+                os.link(path, object_file)
+            except FileExistsError:
+                link_or_copy(object_file, path)
+            except OSError:
+                # The store lives on another filesystem, it keeps its own copy
+                link_or_copy(path, object_file)
+
+        self.record(keys, {'sha256': digest, 'size': os.path.getsize(object_file), 'ext': os.path.splitext(path)[1]})
+        return path
+
+    def record(self, keys, entry):
+        """Point more keys at content that is already in the store."""
+        entry = {'sha256': entry['sha256'], 'size': entry['size'], 'ext': entry['ext'], 'time': int(time.time())}
+        lines = []
+        with self.lock:
+            for key in keys:
+                if self.keys.get(key, {}).get('sha256') != entry['sha256']:
+                    self.keys[key] = {'key': key, **entry}
+                    lines.append(json.dumps(self.keys[key], separators=(',', ':')))
+            if lines:
+                try:
+                    with open(self.index_path, 'a', encoding='utf-8') as f:
+                        f.write("\n".join(lines) + "\n")
+                except OSError as e:
+                    logger.warning(f"Could not update the content store index: {e}")
@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import selectors
+import threading
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from constants import logger
+from utils.metrics import metrics, current_kind, tagged
+from utils.trace import tracer, CHILDREN_PID
+from utils.limiter import transfer_meter, bandwidth
+
+# The percentage on n_m3u8dl-re's video progress lines
+PERCENT_PATTERN = re.compile(r'(\d+\.\d+)%')
+
+# Continuations run here rather than on the supervisor thread, so follow-up work
+# (cleanup, starting the next tool) never delays reading the pipes of other children
+_continuations = ThreadPoolExecutor(max_workers=4, thread_name_prefix="udm-continuation")
+
+class ChildResult:
+    def __init__(self, returncode, stderr):
+        self.returncode = returncode
+        self.stderr = stderr
+
+    @property
+    def ok(self):
+        # Both tools are run with quiet log levels, anything on stderr is an error
+        return self.returncode == 0 and not self.stderr.strip()
+
+class _Child:
+    def __init__(self, process, on_output, future):
+        self.process = process
+        self.on_output = on_output
+        self.future = future
+        self.tool = os.path.splitext(os.path.basename(process.args[0]))[0]
+        self.stage = f"tool:{self.tool}"
+        self.kind = current_kind()
+        self.start_time = time.monotonic()
+        self.trace_start = tracer.now()
+        self.partial = {'stdout': b'', 'stderr': b''}
+        self.stderr = []
+        self.open_streams = 2
+
+class ProcessSupervisor:
+    """
+    Watches the output of every running n_m3u8dl-re/ffmpeg child from a single thread.
+
+    `spawn` returns a Future that resolves to a ChildResult once the child has
+    exited, so no worker thread has to sit in a readline() loop. Output is
+    handed to `on_output` one batch of complete lines at a time; progress
+    parsers only need to look at the newest line of each batch.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.selector = None
+        self.thread = None
+        if os.name != 'nt':
+            # Wakes select() up when a new child is registered
+            self.wakeup_read, self.wakeup_write = os.pipe()
+            os.set_blocking(self.wakeup_read, False)
+
+    def spawn(self, argv, on_output=None, cwd=None):
+        future = Future()
+        process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, cwd=cwd)
+        child = _Child(process, on_output, future)
+
+        if os.name == 'nt':
+            # Selectors can't watch pipes on Windows, fall back to a reader thread per stream
+            for name in ('stdout', 'stderr'):
+                threading.Thread(target=self._read_blocking, args=(child, name), daemon=True, name="udm-child-reader").start()
+            return future
+
+        with self.lock:
+            if self.selector is None:
+                self.selector = selectors.DefaultSelector()
+                self.selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+                self.thread = threading.Thread(target=self._run, daemon=True, name="udm-supervisor")
+                self.thread.start()
+
+            for name in ('stdout', 'stderr'):
+                stream = getattr(process, name)
+                os.set_blocking(stream.fileno(), False)
+                self.selector.register(stream, selectors.EVENT_READ, (child, name))
+        os.write(self.wakeup_write, b'\0')
+        return future
+
+    def _run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    try:
+                        os.read(self.wakeup_read, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                child, name = key.data
+                try:
+                    data = os.read(key.fd, 65536)
+                except BlockingIOError:
+                    continue
+
+                if not data:
+                    with self.lock:
+                        self.selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    self._stream_closed(child, name)
+                else:
+                    self._feed(child, name, data)
+
+    def _read_blocking(self, child, name):
+        stream = getattr(child.process, name)
+        for data in iter(lambda: stream.read1(65536), b''):
+            self._feed(child, name, data)
+        stream.close()
+        with self.lock:
+            self._stream_closed(child, name)
+
+    def _feed(self, child, name, data):
+        # Progress bars redraw with \r, treat it as a line break too
+        chunk = (child.partial[name] + data).replace(b'\r', b'\n')
+        *lines, child.partial[name] = chunk.split(b'\n')
+        lines = [line.decode('utf-8', errors='replace') for line in lines if line.strip()]
+        if not lines:
+            return
+
+        if name == 'stderr':
+            child.stderr.extend(lines)
+        if child.on_output is not None:
+            try:
+                child.on_output(name, lines)
+            except Exception as e:
+                logger.debug(f"Output handler failed: {e}")
+
+    def _stream_closed(self, child, name):
+        if child.partial[name]:
+            self._feed(child, name, b'\n')
+        child.open_streams -= 1
+        if child.open_streams == 0:
+            returncode = child.process.wait()
+            metrics.observe(child.stage, time.monotonic() - child.start_time, kind=child.kind)
+            if tracer.enabled:
+                pid = child.process.pid
+                tracer.name_track(CHILDREN_PID, pid, f"{child.tool} {pid}")
+                tracer.complete(child.tool, child.trace_start, "child", pid=CHILDREN_PID, tid=pid, args={'kind': child.kind, 'returncode': returncode})
+            child.future.set_result(ChildResult(returncode, "\n".join(child.stderr)))
+
+_supervisor = ProcessSupervisor()
+
+def spawn(argv, on_output=None, cwd=None):
+    """Start a child process under the shared supervisor and return a Future for its ChildResult."""
+    return _supervisor.spawn(argv, on_output, cwd)
+
+def then(future, fn, on_error=None):
+    """
+    Return a Future for `fn(result of future)`, run on the continuation pool.
+
+    `fn` may itself return a Future, in which case the returned Future
+    follows that one, so child-process steps can be chained. If `future`
+    fails, `on_error(exception)` is run instead and the exception is passed on.
+    """
+    result = Future()
+    # Keep attributing the follow-up work to the item that started it
+    kind = current_kind()
+
+    def settle(value):
+        if isinstance(value, Future):
+            value.add_done_callback(on_inner_done)
+        else:
+            result.set_result(value)
+
+    def on_inner_done(inner):
+        try:
+            settle(inner.result())
+        except BaseException as e:
+            result.set_exception(e)
+
+    def run(value):
+        try:
+            with tagged(kind), tracer.span(fn.__qualname__, "continuation"):
+                settle(fn(value))
+        except BaseException as e:
+            result.set_exception(e)
+
+    def fail(error):
+        try:
+            with tagged(kind):
+                on_error(error)
+        finally:
+            result.set_exception(error)
+
+    def on_done(inner):
+        try:
+            value = inner.result()
+        except BaseException as e:
+            if on_error is None:
+                result.set_exception(e)
+            else:
+                _continuations.submit(fail, e)
+            return
+        _continuations.submit(run, value)
+
+    future.add_done_callback(on_done)
+    return result
+
+def spawn_segment_downloader(argv, task_id, progress, ceiling=100):
+    """
+    Start n_m3u8dl-re under the supervisor and follow its video progress on `task_id`, up to `ceiling` percent.
+
+    Under --max-rate the child gets its own share of the cap, handed back once it exits.
+    Returns a Future for its ChildResult.
+    """
+    def on_output(stream, lines):
+        if stream != 'stdout':
+            return
+        # Only the newest progress line matters
+        for line in reversed(lines):
+            if line.replace(' ', '').startswith('Vid'):
+                match = PERCENT_PATTERN.search(line)
+                if match:
+                    progress.update(task_id,  completed=min(float(match.group(1)), ceiling))
+                break
+
+    share = bandwidth.reserve_child()
+    if share is not None:
+        argv = argv + ["--max-speed", f"{max(1, share // 1024)}K"]
+    try:
+        done = spawn(argv, on_output)
+    except OSError:
+        bandwidth.release_child(share)
+        raise
+    done.add_done_callback(lambda _: bandwidth.release_child(share))
+    return done
+
+def record_child_download(path):
+    """Count a file written by n_m3u8dl-re in the transfer totals."""
+    # The segments were fetched by the child process, account for them once it is done
+    transfer_meter.record(os.path.getsize(path))
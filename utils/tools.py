@@ -0,0 +1,57 @@
+import os
+import shutil
+import threading
+import subprocess
+from constants import logger
+from utils.cache import read_cache, write_cache
+
+# How each tool is asked to prove it runs, and what to tell the user when it doesn't
+TOOLS = {
+    "ffmpeg": (["-version"], "ffmpeg is not installed or not found in the system PATH."),
+    "n_m3u8dl-re": (["--version"], "Make sure mp4decrypt & n_m3u8dl-re is not installed or not found in the system PATH."),
+}
+
+class ToolNotFoundError(RuntimeError):
+    """An external tool needed for this lecture is missing or doesn't run."""
+
+_checked = {}
+_lock = threading.Lock()
+
+def require_tool(name):
+    """
+    Return the resolved path of an external tool, checking once that it runs.
+
+    The check is only made when a lecture actually needs the tool. Its result
+    is cached on disk keyed by the binary's path and mtime, so later runs skip
+    the version probe until the tool is replaced or updated.
+    """
+    with _lock:
+        if name in _checked:
+            path = _checked[name]
+        else:
+            path = _checked[name] = _discover(name)
+
+    if path is None:
+        raise ToolNotFoundError(TOOLS[name][1])
+    return path
+
+def _discover(name):
+    version_args, message = TOOLS[name]
+    path = shutil.which(name)
+    if path is None:
+        logger.error(message)
+        return None
+
+    path = os.path.realpath(path)
+    fingerprint = {'path': path, 'mtime': os.path.getmtime(path)}
+    if read_cache("tools", name) == fingerprint:
+        return path
+
+    try:
+        subprocess.run([path, *version_args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        logger.error(message)
+        return None
+
+    write_cache("tools", name, fingerprint)
+    return path
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Process ids of the tracks in the trace viewer: worker threads, scheduler slots and child processes
+THREADS_PID = 1
+SLOTS_PID = 2
+CHILDREN_PID = 3
+
+class TraceRecorder:
+    """
+    Collects spans in the Chrome trace-event format, which Perfetto and chrome://tracing open.
+
+    Worker threads, scheduler lane slots and child processes each get their
+    own group of tracks, and every item is an async span from the moment it
+    is picked up until its last job is done. Idle gaps, serialized metadata
+    calls and long-tail lectures show up as holes and long bars. Until
+    `enable` is called, every method returns straight away.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.lock = threading.Lock()
+        self.named_tracks = set()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        self.origin = time.perf_counter()
+        self.enabled = True
+        for pid, name in ((THREADS_PID, "Threads"), (SLOTS_PID, "Scheduler slots"), (CHILDREN_PID, "Child processes")):
+            self.events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': name}})
+            self.events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'sort_index': pid}})
+
+    def now(self):
+        """Microseconds since tracing started, the unit trace events use."""
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def name_track(self, pid, tid, name):
+        key = (pid, tid)
+        with self.lock:
+            if key in self.named_tracks:
+                return
+            self.named_tracks.add(key)
+        self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+
+    def complete(self, name, start, cat, pid=THREADS_PID, tid=None, args=None):
+        """Record a span that began at `start` (from now()) and ends now, on the calling thread unless a track is given."""
+        if not self.enabled:
+            return
+        if tid is None:
+            tid = threading.get_native_id()
+            self.name_track(THREADS_PID, tid, threading.current_thread().name)
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': round(start, 1), 'dur': round(self.now() - start, 1), 'pid': pid, 'tid': tid}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    @contextmanager
+    def span(self, name, cat="job", **args):
+        if not self.enabled:
+            yield
+            return
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.complete(name, start, cat, args=args)
+
+    def begin(self, name, span_id, cat="item", **args):
+        """Open an async span, which may end on another thread."""
+        if self.enabled:
+            self.events.append({'name': name, 'cat': cat, 'ph': 'b', 'id': str(span_id), 'ts': round(self.now(), 1), 'pid': THREADS_PID, 'tid': 0, 'args': args})
+
+    def end(self, name, span_id, cat="item", **args):
+        if self.enabled:
+            self.events.append({'name': name, 'cat': cat, 'ph': 'e', 'id': str(span_id), 'ts': round(self.now(), 1), 'pid': THREADS_PID, 'tid': 0, 'args': args})
+
+    def counter(self, name, **values):
+        if self.enabled:
+            self.events.append({'name': name, 'ph': 'C', 'ts': round(self.now(), 1), 'pid': SLOTS_PID, 'tid': 0, 'args': values})
+
+    def write(self, path):
+        # Appends from other threads may still be going on, copy the list first
+        events = list(self.events)
+        part_file = f"{path}.{os.getpid()}.part"
+        with open(part_file, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, separators=(',', ':'))
+        os.replace(part_file, path)
+
+tracer = TraceRecorder()
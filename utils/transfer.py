@@ -0,0 +1,208 @@
+import os
+import re
+import time
+import shutil
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+from requests.exceptions import ConnectionError, ChunkedEncodingError, Timeout
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from constants import logger
+from utils.session import fetch, check_response, TransientError
+from utils.limiter import transfer_meter, bandwidth
+from utils.metrics import metrics
+
+# Large reads keep the per-chunk Python overhead and write syscalls down on fast links
+CHUNK_SIZE = 1024 * 1024
+RESUME_ATTEMPTS = 5
+
+def _read_validator(validator_file):
+    try:
+        with open(validator_file, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _write_validator(validator_file, response):
+    # Weak ETags can't be used with If-Range, fall back to Last-Modified for those
+    etag = response.headers.get('ETag')
+    validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+    if validator:
+        with open(validator_file, 'w', encoding='utf-8') as f:
+            f.write(validator)
+    elif os.path.exists(validator_file):
+        os.remove(validator_file)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _preallocate(f, offset, total_size):
+    """Reserve the rest of the file up front so the filesystem can lay it out in one piece."""
+    if total_size <= offset:
+        return
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(f.fileno(), offset, total_size - offset)
+        else:
+            f.truncate(total_size)
+    except OSError as e:
+        # Not every filesystem supports it, the download works the same without
+        logger.debug(f"Could not preallocate {total_size} bytes: {e}")
+
+def _write_all(f, view):
+    while view:
+        written = f.write(view)
+        view = view[written:]
+
+# ioctl that asks Btrfs/XFS for a copy-on-write clone of a whole file
+FICLONE = 0x40049409
+
+def _reflink(source, output_file):
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(output_file, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        _remove_quietly(output_file)
+        return False
+
+def link_or_copy(source, output_file):
+    """
+    Hardlink `source` to `output_file`. Where links aren't possible (other
+    drive, FAT) fall back to a reflink, and to a plain copy after that.
+    """
+    if os.path.exists(output_file):
+        if os.path.samefile(source, output_file):
+            return output_file
+        os.remove(output_file)
+    try:
+        os.link(source, output_file)
+    except OSError:
+        part_file = f"{output_file}.part"
+        if not _reflink(source, part_file):
+            shutil.copyfile(source, part_file)
+        os.replace(part_file, output_file)
+    return output_file
+
+def write_blob(output_file, data):
+    """Write `data` to `output_file` through a temporary file, so readers never see a partial file."""
+    part_file = f"{output_file}.part"
+    start_time = time.perf_counter()
+    with open(part_file, 'wb') as f:
+        f.write(data)
+    os.replace(part_file, output_file)
+    metrics.observe("write", time.perf_counter() - start_time, len(data))
+    return output_file
+
+def download_file(url, output_file, on_progress=None, chunk_size=CHUNK_SIZE, on_start=None):
+    """
+    Stream `url` into `output_file`, resuming interrupted transfers.
+
+    Data is written to `<output_file>.part` and only renamed into place once its
+    size matches the advertised length. A leftover .part file, whether from a
+    dropped connection or an earlier run, is continued with a Range request
+    guarded by If-Range so a changed file on the server restarts from zero.
+
+    The body is read into one reused buffer of `chunk_size` bytes and written
+    unbuffered, and the file is preallocated from the advertised length.
+
+    `on_start` is called with the response and the total size (or None) once
+    the headers are in; if it returns False the download is abandoned and None
+    is returned.
+    """
+    part_file = f"{output_file}.part"
+    validator_file = f"{part_file}.etag"
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    for attempt in range(1, RESUME_ATTEMPTS + 1):
+        offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        # Ranges refer to the encoded body, so ask for the file as is
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
+            validator = _read_validator(validator_file)
+            if validator:
+                headers['If-Range'] = validator
+
+        start_time = time.perf_counter()
+        try:
+            response = fetch(url, stream=True, headers=headers)
+
+            if response.status_code == 416:
+                # The .part file is no longer a prefix of what the server has, start over
+                response.close()
+                _remove_quietly(part_file)
+                continue
+
+            check_response(response)
+
+            total_size = None
+            if response.status_code == 206:
+                content_range = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+                if not content_range or int(content_range.group(1)) != offset:
+                    response.close()
+                    _remove_quietly(part_file)
+                    continue
+                if content_range.group(2) != '*':
+                    total_size = int(content_range.group(2))
+            else:
+                offset = 0
+                if 'Content-Length' in response.headers:
+                    total_size = int(response.headers['Content-Length'])
+
+            if on_start is not None and on_start(response, total_size) is False:
+                response.close()
+                _remove_quietly(part_file)
+                _remove_quietly(validator_file)
+                return None
+
+            _write_validator(validator_file, response)
+
+            downloaded_size = offset
+            write_time = 0.0
+            # Servers that compress anyway are decoded by urllib3 before they reach the buffer
+            response.raw.decode_content = True
+            with open(part_file, 'r+b' if offset else 'wb', buffering=0) as f:
+                f.seek(offset)
+                if total_size is not None:
+                    _preallocate(f, offset, total_size)
+                try:
+                    while True:
+                        length = response.raw.readinto(view[:bandwidth.read_size(chunk_size)])
+                        if not length:
+                            break
+                        write_start = time.perf_counter()
+                        _write_all(f, view[:length])
+                        write_time += time.perf_counter() - write_start
+                        downloaded_size += length
+                        transfer_meter.record(length)
+                        bandwidth.consume(length)
+                        if on_progress is not None:
+                            on_progress(downloaded_size, total_size)
+                finally:
+                    # Drop the unwritten preallocated tail, the file size is the resume offset
+                    f.truncate(downloaded_size)
+                    response.close()
+                    metrics.observe("transfer", time.perf_counter() - start_time, downloaded_size - offset)
+                    metrics.observe("write", write_time, downloaded_size - offset)
+        except (ConnectionError, ChunkedEncodingError, Timeout, TransientError, ProtocolError, ReadTimeoutError) as e:
+            logger.warning(f"Transfer of {os.path.basename(output_file)} interrupted ({e}), resuming (attempt {attempt}/{RESUME_ATTEMPTS})")
+            continue
+
+        if total_size is not None and downloaded_size != total_size:
+            logger.warning(f"Transfer of {os.path.basename(output_file)} ended at {downloaded_size} of {total_size} bytes, resuming (attempt {attempt}/{RESUME_ATTEMPTS})")
+            continue
+
+        os.replace(part_file, output_file)
+        _remove_quietly(validator_file)
+        return output_file
+
+    raise OSError(f"Could not complete the download of {os.path.basename(output_file)} after {RESUME_ATTEMPTS} attempts")